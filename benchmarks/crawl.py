@@ -0,0 +1,160 @@
+"""Crawl throughput on a synthetic THREDDS server.
+
+Serves catalog trees of several shapes with thredds_crawler.testing.SyntheticTDS
+and crawls each of them with Crawl for several worker counts, reporting the
+wall time, datasets per second, requests made and peak RSS of the crawling
+process and of its workers. Each crawl runs in a fresh process so the peak
+RSS of one does not hide the next. No network access is needed.
+
+    python benchmarks/crawl.py
+    python benchmarks/crawl.py --quick
+    python benchmarks/crawl.py --shapes wide,deep --workers 1,4,16 --latency 0.02 --json results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.testing import SyntheticTDS
+
+logger = logging.getLogger(__name__)
+
+SHAPES = {
+    # One catalog listing every dataset
+    "flat": {"depth": 0, "fanout": 0, "datasets": 20000},
+    # A root listing many small catalogs, like a catalog per day
+    "wide": {"depth": 1, "fanout": 500, "datasets": 40},
+    # Many levels of two catalogRefs each (255 catalogs)
+    "deep": {"depth": 7, "fanout": 2, "datasets": 80},
+    # A balanced tree (585 catalogs)
+    "bushy": {"depth": 3, "fanout": 8, "datasets": 35},
+}
+
+# Shapes small enough to run on every CI build
+QUICK = {
+    "flat": {"depth": 0, "fanout": 0, "datasets": 2000},
+    "wide": {"depth": 1, "fanout": 50, "datasets": 20},
+    "deep": {"depth": 5, "fanout": 2, "datasets": 20},
+    "bushy": {"depth": 2, "fanout": 6, "datasets": 20},
+}
+
+
+def peak_rss(who):
+    """Returns the peak resident set size in bytes of this process or of its
+    finished children, None where the resource module is not available
+    :param str who: "self" or "children"
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # Kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+def crawl(url, workers):
+    """Crawls url and returns the measures of the crawl, run in the child process"""
+    start = time.perf_counter()
+    c = Crawl(url, workers=workers)
+    wall = time.perf_counter() - start
+    return {
+        "datasets": len(c.datasets),
+        "wall": wall,
+        "parse_time": c.stats.parse_time,
+        "failures": len(c.failures),
+        "rss": peak_rss("self"),
+        "workers_rss": peak_rss("children"),
+    }
+
+
+def run(shape, options, workers, latency):
+    """Serves a synthetic tree and crawls it from a new process"""
+    script = Path(__file__).resolve()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(script.parent.parent), os.environ.get("PYTHONPATH")])))
+    with SyntheticTDS(latency=latency, **options) as tds:
+        out = subprocess.run(  # noqa: S603
+            [sys.executable, str(script), "--run", tds.catalog_url, "--workers", str(workers)],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    result = json.loads(out.stdout.splitlines()[-1])
+    if result["datasets"] != tds.total_datasets:
+        msg = "Found {} of the {} datasets of {}".format(result["datasets"], tds.total_datasets, shape)
+        raise RuntimeError(msg)
+    result.update(
+        shape=shape,
+        workers=workers,
+        latency=latency,
+        catalogs=tds.total_catalogs,
+        requests=sum(tds.requests.values()),
+        throughput=result["datasets"] / result["wall"],
+    )
+    return result
+
+
+def megabytes(value):
+    return f"{value / 1e6:8.1f}" if value is not None else f"{'-':>8}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--shapes",
+        default=",".join(SHAPES),
+        help="Comma separated tree shapes, from {}".format(",".join(SHAPES)),
+    )
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma separated worker counts")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the server waits before answering")
+    parser.add_argument("--quick", action="store_true", help="Crawl small trees, for CI")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # The only line the parent reads, kept off the log
+        sys.stdout.write(json.dumps(crawl(args.run, int(args.workers))) + "\n")
+        return
+
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(logging.INFO)
+    shapes = QUICK if args.quick else SHAPES
+    results = []
+    logger.info(
+        "%-6s %7s %8s %8s %8s %8s %10s %8s %8s",
+        *("shape", "workers", "catalogs", "datasets", "requests", "wall", "datasets/s", "rss MB", "worker MB"),
+    )
+    for shape in args.shapes.split(","):
+        for workers in [int(w) for w in args.workers.split(",")]:
+            r = run(shape, shapes[shape], workers, args.latency)
+            results.append(r)
+            logger.info(
+                "%-6s %7d %8d %8d %8d %7.2fs %10.0f %s %s",
+                shape,
+                workers,
+                r["catalogs"],
+                r["datasets"],
+                r["requests"],
+                r["wall"],
+                r["throughput"],
+                megabytes(r["rss"]),
+                megabytes(r["workers_rss"]),
+            )
+    if args.json:
+        with Path(args.json).open("w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Micro-benchmarks of the dataset filters on a synthetic catalog.
+
+Times the filters of a crawl over every dataset of a catalog listing
+``--count`` datasets, against the filtering done before the filters were
+compiled (every regex tried in turn, every date parsed with dateutil), and
+the whole parse of the catalog with those filters.
+
+    python benchmarks/filters.py --count 100000
+"""
+
+import argparse
+import logging
+import re
+import time
+from datetime import datetime
+
+import pytz
+from dateutil.parser import parse
+from lxml import etree
+
+from thredds_crawler.crawl import CatalogParser, Crawl, iter_chunks
+from thredds_crawler.filters import DatasetFilter
+from thredds_crawler.utils import INV_NS
+
+logger = logging.getLogger(__name__)
+
+URL = "http://localhost/thredds/catalog.xml"
+
+SCENARIOS = {
+    "skips": {},
+    "select 10%": {"select": [r".*/file_\d*0\.nc"]},
+    "after": {"after": datetime(2016, 6, 1, tzinfo=pytz.utc)},
+    "select and after": {"select": [r".*/file_\d*0\.nc"], "after": datetime(2016, 6, 1, tzinfo=pytz.utc)},
+}
+
+
+def synthetic_catalog(count):
+    """Returns a catalog of count dated datasets"""
+    datasets = "".join(
+        f'<dataset name="file_{i}.nc" ID="bench/file_{i}.nc" urlPath="bench/file_{i}.nc">'
+        f'<date type="modified">2016-{i % 12 + 1:02d}-{i % 28 + 1:02d}T00:00:00Z</date></dataset>'
+        for i in range(count)
+    )
+    return (
+        f'<catalog xmlns="{INV_NS}"><service name="dap" serviceType="OPENDAP" base="/thredds/dodsC/" />'
+        '<dataset name="Bench" ID="bench"><metadata inherited="true"><serviceName>dap</serviceName></metadata>'
+        f"{datasets}</dataset></catalog>"
+    ).encode()
+
+
+def legacy_accept(leaf, skip, select, before, after):
+    """The filtering done before DatasetFilter"""
+    if any(x.match(leaf.get("name")) for x in skip):
+        return False
+    date_tag = leaf.find(f'.//{{{INV_NS}}}date[@type="modified"]')
+    if date_tag is not None:
+        try:
+            dt = parse(date_tag.text)
+        except ValueError:
+            return False
+        dt = dt.replace(tzinfo=pytz.utc)
+        if after and dt < after:
+            return False
+        if before and dt > before:
+            return False
+    gid = leaf.get("ID")
+    if select is not None:
+        return gid is not None and any(x.match(gid) for x in select)
+    return True
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100000, help="Number of datasets")
+    args = parser.parse_args()
+
+    xml = synthetic_catalog(args.count)
+    leaves = etree.fromstring(xml).findall(f".//{{{INV_NS}}}dataset[@urlPath]")
+    skip = [re.compile(x) for x in Crawl.SKIPS]
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(logging.INFO)
+    logger.info("%d datasets", len(leaves))
+    logger.info("%-18s %10s %10s %8s %10s", "", "legacy", "compiled", "speedup", "parse")
+    for name, options in SCENARIOS.items():
+        select = [re.compile(x) for x in options["select"]] if "select" in options else None
+        before, after = options.get("before"), options.get("after")
+
+        legacy, kept = timed(
+            lambda select=select, before=before, after=after: sum(
+                legacy_accept(leaf, skip, select, before, after) for leaf in leaves
+            ),
+        )
+        f = DatasetFilter(select, skip, before, after)
+        compiled, compiled_kept = timed(lambda f=f: sum(f.accept_dataset(leaf) for leaf in leaves))
+        if kept != compiled_kept:
+            msg = f"{name}: the legacy filters kept {kept} datasets, the compiled ones {compiled_kept}"
+            raise RuntimeError(msg)
+
+        catalog_parser = CatalogParser(select, skip, before, after, inline=False)
+        parsing, _ = timed(lambda catalog_parser=catalog_parser: catalog_parser.parse(URL, iter_chunks(xml)))
+        logger.info("%-18s %9.3fs %9.3fs %7.1fx %9.3fs", name, legacy, compiled, legacy / compiled, parsing)
+
+
+if __name__ == "__main__":
+    main()
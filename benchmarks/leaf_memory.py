@@ -0,0 +1,82 @@
+"""Measures the memory used per LeafDataset.
+
+Builds datasets from a synthetic catalog the same way a crawl does (parsed
+by a worker, pickled and unpickled in the parent) and reports the memory
+they take before and after their metadata is read.
+
+    python benchmarks/leaf_memory.py --count 100000
+"""
+
+import argparse
+import gc
+import logging
+import os
+import pickle
+import resource
+import tracemalloc
+from pathlib import Path
+
+from thredds_crawler.crawl import CatalogParser, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+URL = "http://localhost/thredds/catalog.xml"
+
+
+def synthetic_catalog(count):
+    """Returns a catalog of count datasets with a compound service and some metadata"""
+    datasets = "".join(
+        f'<dataset name="file_{i}.nc" ID="bench/file_{i}.nc" urlPath="bench/file_{i}.nc">'
+        f'<dataSize units="Kbytes">{i}</dataSize><date type="modified">2016-01-01T00:00:00Z</date>'
+        "</dataset>"
+        for i in range(count)
+    )
+    return (
+        '<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0">'
+        '<service name="all" serviceType="Compound" base="">'
+        '<service name="odap" serviceType="OPENDAP" base="/thredds/dodsC/" />'
+        '<service name="http" serviceType="HTTPServer" base="/thredds/fileServer/" />'
+        '<service name="iso" serviceType="ISO" base="/thredds/iso/" />'
+        "</service>"
+        '<dataset name="Bench" ID="bench"><metadata inherited="true"><serviceName>all</serviceName>'
+        "<creator><name>Benchmark</name></creator><documentation>Synthetic datasets</documentation></metadata>"
+        f"{datasets}</dataset></catalog>"
+    ).encode()
+
+
+def rss():
+    """Returns the resident set size of the process in bytes"""
+    try:
+        return int(Path("/proc/self/statm").read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak instead of current on platforms without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=50000, help="Number of datasets")
+    args = parser.parse_args()
+
+    # As returned by a worker
+    payload = pickle.dumps(CatalogParser().parse(URL, iter_chunks(synthetic_catalog(args.count))).leaves)
+    gc.collect()
+
+    tracemalloc.start()
+    datasets = pickle.loads(payload)  # noqa: S301
+    del payload
+    gc.collect()
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(logging.INFO)
+    logger.info("%d datasets", len(datasets))
+    logger.info("  compact:            %6.0f bytes per dataset", tracemalloc.get_traced_memory()[0] / len(datasets))
+
+    # The parsed trees are allocated by libxml2, outside of tracemalloc
+    before = rss()
+    trees = [d.metadata for d in datasets]
+    gc.collect()
+    logger.info("  metadata read adds: %6.0f bytes per dataset", (rss() - before) / len(trees))
+
+
+if __name__ == "__main__":
+    main()
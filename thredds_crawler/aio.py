@@ -0,0 +1,479 @@
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+import asyncio
+import queue
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from http import HTTPStatus
+
+from thredds_crawler.crawl import Crawl, LeafDataset, logger
+from thredds_crawler.throttle import RequestScheduler
+
+
+class FairBudget:
+    """Shares ``limit`` request slots between hosts, at most ``per_host`` each.
+
+    When every slot is taken, the hosts waiting for one are served in turn so
+    a host with many requests queued can not starve the others.
+    """
+
+    def __init__(self, limit, per_host=None):
+        """:param int limit: Requests in flight at once across all hosts
+        :param int per_host: Requests in flight at once to a single host, unlimited if None
+        """
+        self.limit = limit
+        self.per_host = per_host
+        self.active = 0
+        self.hosts = {}  # Requests in flight by host
+        self.waiting = OrderedDict()  # Futures waiting for a slot by host, in turn order
+
+    @asynccontextmanager
+    async def slot(self, host):
+        """Waits for a slot for a request to host and holds it
+        :param str host: Host about to be requested
+        """
+        await self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    async def acquire(self, host):
+        """Waits for a slot for a request to host
+        :param str host: Host about to be requested
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(host, deque()).append(future)
+        self._grant()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted, but cancelled before it could be used
+                self.release(host)
+            elif future in self.waiting.get(host, ()):
+                self.waiting[host].remove(future)
+                if not self.waiting[host]:
+                    del self.waiting[host]
+            raise
+
+    def release(self, host):
+        """Gives back the slot of a finished request
+        :param str host: Host that was requested
+        """
+        self.active -= 1
+        self.hosts[host] -= 1
+        self._grant()
+
+    def _grant(self):
+        """Hands the free slots to the waiting hosts in turn"""
+        while self.active < self.limit:
+            for host in list(self.waiting):
+                if self.per_host is None or self.hosts.get(host, 0) < self.per_host:
+                    break
+            else:
+                return
+            futures = self.waiting[host]
+            future = futures.popleft()
+            if not futures:
+                del self.waiting[host]
+            else:
+                # Next in line goes to the back of the turn order
+                self.waiting.move_to_end(host)
+            if future.cancelled():
+                continue
+            future.set_result(None)
+            self.active += 1
+            self.hosts[host] = self.hosts.get(host, 0) + 1
+
+
+class AsyncCrawl(Crawl):
+    """Crawls a catalog from an asyncio event loop.
+
+    The HTTP requests and the XML parsing run on a thread pool so hundreds of
+    requests can be in flight at once without blocking the event loop, while a
+    per host limit keeps any single server from being overwhelmed. The crawl
+    starts when the object is awaited (or ``run`` is called) and the results
+    are available as ``datasets`` afterwards, same as with ``Crawl``. Use
+    ``async for ds in crawl.iter_datasets()`` to get the datasets as they are found.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        catalog_url,
+        *,
+        select=None,
+        skip=None,
+        before=None,
+        after=None,
+        debug=None,
+        auth=None,
+        inline=True,
+        concurrency=None,
+        per_host=None,
+        cache=None,
+        snapshot=None,
+        settle_after=None,
+        scheduler=None,
+        predicates=None,
+        prune=None,
+        stats=None,
+        budget=None,
+    ):
+        """:param select list: Dataset IDs. Python regex supported.
+        :param list skip: Dataset names and/or a catalogRef titles. Python regex supported.
+        :param requests.auth.AuthBase auth: requests auth object to use
+        :param bool inline: Resolve datasets from the catalog they are listed in and only
+            request the individual dataset documents when that is not possible
+        :param int concurrency: Maximum number of requests in flight across all hosts
+        :param int per_host: Maximum number of requests in flight to a single host
+        :param thredds_crawler.cache.HTTPCache cache: Cache to revalidate catalogs and datasets against
+        :param thredds_crawler.snapshot.CrawlSnapshot snapshot: Snapshot of a previous crawl to seed this
+            one from. The new snapshot is available as ``snapshot`` and the changes as ``diff`` afterwards.
+        :param timedelta settle_after: Reuse the datasets of catalog subtrees whose datasets were all
+            last modified longer ago than this without requesting them again
+        :param thredds_crawler.throttle.RequestScheduler scheduler: Rate limits, retries, timeouts and
+            circuit breakers applied to every request. Requests that fail are listed in ``failures``.
+            Its ``concurrency`` caps the requests in flight to a single host along with per_host.
+        :param list predicates: Functions taking a dataset element and returning False to skip
+            the dataset, called after every other filter
+        :param prune: Do not request catalogRefs whose timeCoverage, or the date in their title or URL,
+            is outside of the before/after window. True to detect the dates, or a list of regular
+            expressions with year, month and day named groups.
+        :param thredds_crawler.stats.CrawlStats stats: Stats to record the crawl in, with any hooks to
+            call as it progresses. A new CrawlStats is used if None. Available as ``stats``.
+        :param thredds_crawler.budget.CrawlBudget budget: Limits on the depth, catalogs, datasets and
+            time of the crawl. The crawl stops at the first limit reached and ``complete`` is False.
+        """
+        self.concurrency = concurrency or 64
+        self.per_host = per_host or 8
+        if scheduler is None:
+            scheduler = RequestScheduler(concurrency=self.per_host)
+        self._configure(
+            select=select,
+            skip=skip,
+            before=before,
+            after=after,
+            debug=debug,
+            auth=auth,
+            inline=inline,
+            cache=cache,
+            snapshot=snapshot,
+            settle_after=settle_after,
+            scheduler=scheduler,
+            predicates=predicates,
+            prune=prune,
+            stats=stats,
+            budget=budget,
+        )
+        self.catalog_url = catalog_url
+        self.datasets = None
+
+    def __await__(self):
+        return self.run().__await__()
+
+    async def run(self):
+        """Performs the crawl and returns this object with ``datasets`` populated"""
+        self.datasets = [ds async for ds in self.iter_datasets()]
+        return self
+
+    async def iter_datasets(self, executor=None, slots=None):
+        """Performs the crawl and yields each LeafDataset as soon as it is resolved.
+        Datasets are not kept by the AsyncCrawl object.
+        :param concurrent.futures.Executor executor: Thread pool to make the requests on, shared with
+            other crawls. A pool of concurrency threads is used, and shut down once done, if None.
+        :param FairBudget slots: Request slots shared with other crawls, limited to concurrency
+            and per_host if None
+        """
+        self._loop = asyncio.get_running_loop()
+        self._slots = slots or FairBudget(self.concurrency, self.per_host)
+        self._results = asyncio.Queue()
+        self._begin()
+        self._executor = executor or ThreadPoolExecutor(max_workers=self.concurrency)
+        url = self._get_catalog_url(self.catalog_url)
+        self.visited.add(url)
+        crawl = asyncio.ensure_future(self._crawl(url))
+        crawl.add_done_callback(lambda _: self._results.put_nowait(None))
+        budget = self.budget
+        full = False
+        try:
+            while True:
+                try:
+                    ds = await asyncio.wait_for(self._results.get(), budget.remaining() if budget else None)
+                except asyncio.TimeoutError:
+                    budget.expired()
+                    break
+                if ds is None:
+                    break
+                if full and ds.id is not None:
+                    # A dataset beyond the last one allowed, the crawl is cut short
+                    budget.drop_dataset()
+                    break
+                ds = self._finalize(ds)
+                if ds is not None:
+                    yield ds
+                    full = budget is not None and budget.add_dataset()
+            if crawl.done():
+                # Surface any error raised while crawling
+                await crawl
+            self._end()
+        finally:
+            crawl.cancel()
+            if executor is None:
+                # Never block the event loop on the requests still in flight
+                self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _fetch(self, url, kind):
+        """Requests the XML at url on the thread pool, honoring the per host limit
+        and the scheduler, and returns the XMLResponse or None if it failed
+        :param str url: URL to request
+        :param str kind: "catalog" or "dataset"
+        """
+        host = urlparse.urlsplit(url).netloc
+        attempt = 1
+        while True:
+            async with self._slots.slot(host):
+                delay = self.scheduler.delay(url)
+                if delay is None:
+                    self._fail(url, kind, "circuit open")
+                    return None
+                if delay == 0:
+                    self.scheduler.start(url)
+                    response, error = None, None
+                    try:
+                        response = await self._loop.run_in_executor(self._executor, self._request, url, kind)
+                    except asyncio.CancelledError:
+                        # The crawl was cut short, free the place of the abandoned request
+                        self.scheduler.cancel(url)
+                        raise
+                    except Exception as e:  # noqa: BLE001
+                        # Any error is a failed request, like with the pool of Crawl
+                        error = e
+            # Wait without holding a slot
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            retry = self._outcome(url, kind, response, error, attempt)
+            if retry is None:
+                break
+            await asyncio.sleep(retry)
+            attempt += 1
+        if error is not None or response.status >= HTTPStatus.BAD_REQUEST:
+            return None
+        return response
+
+    def _request(self, url, kind):
+        """Requests the XML at url, revalidating it against the cache, and returns the XMLResponse
+        :param str url: URL to request
+        :param str kind: "catalog" or "dataset"
+        """
+        func, args, kwds = self._request_call(url, kind)
+        return func(*args, **kwds)
+
+    async def _crawl(self, url, depth=0):
+        """Crawls a catalog and all of its references concurrently, queueing the datasets found
+        :param str url: URL for the current catalog
+        :param int depth: Depth of the catalog, 0 for the root
+        """
+        if self.budget is not None and not self.budget.take_catalog():
+            self.stats.record_skip("max_catalogs")
+            return
+        logger.info("Crawling: %s", url)
+        response = await self._fetch(url, "catalog")
+        if response is None:
+            return
+        parsed = await self._loop.run_in_executor(self._executor, self._catalog, url, response)
+        if parsed is None:
+            return
+        references, leaves = parsed
+        self.stats.record_catalog(url, depth, references, leaves)
+
+        children = []
+        for child in references:
+            if child in self.visited:
+                logger.debug("Skipping %s (already crawled)", child)
+                self.stats.record_skip("visited")
+                continue
+            if self.budget is not None and not self.budget.allows(depth + 1):
+                logger.debug("Skipping %s (deeper than %d)", child, self.budget.max_depth)
+                self.stats.record_skip("max_depth")
+                continue
+            self.visited.add(child)
+            settled = self._settled(child)
+            if settled is not None:
+                self.stats.record_skip("settled")
+                leaves = leaves + settled
+                continue
+            children.append(child)
+
+        await asyncio.gather(
+            *[self._crawl(child, depth + 1) for child in children],
+            *[self._resolve(leaf) for leaf in leaves],
+        )
+
+    async def _resolve(self, leaf):
+        """Queues the LeafDataset, requesting it first if needed
+        :param leaf: LeafDataset or the URL to request one from
+        """
+        if not isinstance(leaf, LeafDataset):
+            url = leaf
+            response = await self._fetch(url, "dataset")
+            if response is None:
+                return
+            # Reading the cache and parsing touch the disk, keep them off the event loop
+            leaf = await self._loop.run_in_executor(self._executor, self._dataset, url, response)
+            if leaf.id is None:
+                self._fail(url, "dataset", "invalid XML")
+        self._results.put_nowait(leaf)
+
+
+class MultiCrawl:
+    """Crawls many catalogs at once in a single event loop.
+
+    Every root catalog is crawled by its own AsyncCrawl, with its own select,
+    skip, auth or any other parameter, but all of them share one thread pool,
+    one RequestScheduler and one budget of ``concurrency`` requests in flight,
+    at most ``per_host`` of them to a single host. Hosts waiting for a request
+    slot are served in turn, so a large or slow server does not hold back the
+    crawls of the others.
+
+    Roots are given as a dict of names to catalog URLs or to dicts of AsyncCrawl
+    parameters including the ``url``, or as a list of URLs used as their own names::
+
+        multi = MultiCrawl({
+            "ncei": "https://www.ncei.noaa.gov/thredds/catalog.xml",
+            "gliders": {"url": "https://tds.gliders.ioos.us/thredds/catalog.xml", "select": [".*_rt"]},
+        }, concurrency=32)
+        async for root, ds in multi.iter_datasets():
+            print(root, ds.id)
+
+    ``await multi`` instead collects the datasets of each root in ``datasets``.
+    A root whose crawl raises is logged and listed in ``errors`` without
+    stopping the others.
+    """
+
+    def __init__(self, roots, concurrency=None, per_host=None, **defaults: object):
+        """:param roots: Dict of names to catalog URLs or to dicts of AsyncCrawl parameters, or a list of URLs
+        :param int concurrency: Maximum number of requests in flight across all roots and hosts
+        :param int per_host: Maximum number of requests in flight to a single host
+        :param defaults: AsyncCrawl parameters applied to every root, such as auth, skip or scheduler
+        """
+        if not isinstance(roots, dict):
+            roots = {url: url for url in roots}
+        self.concurrency = concurrency or 32
+        self.per_host = per_host or 8
+        # One scheduler so rate limits and circuit breakers are per host, not per root
+        defaults.setdefault("scheduler", RequestScheduler(concurrency=self.per_host))
+        self.crawls = {}
+        for name, spec in roots.items():
+            options = dict(defaults, **(spec if isinstance(spec, dict) else {"url": spec}))
+            url = options.pop("url")
+            self.crawls[name] = AsyncCrawl(url, **options)
+        self.datasets = None
+        self.errors = {}
+
+    def __await__(self):
+        return self.run().__await__()
+
+    async def run(self):
+        """Crawls every root and returns this object with ``datasets``
+        populated with the list of datasets of each root
+        """
+        self.datasets = {name: [] for name in self.crawls}
+        async for name, ds in self.iter_datasets():
+            self.datasets[name].append(ds)
+        return self
+
+    async def iter_datasets(self):
+        """Crawls every root and yields a ``(root name, LeafDataset)`` tuple for
+        each dataset as soon as it is resolved
+        """
+        self.errors = {}
+        results = asyncio.Queue()
+        slots = FairBudget(self.concurrency, self.per_host)
+
+        async def crawl(name, datasets):
+            try:
+                async for ds in datasets:
+                    results.put_nowait((name, ds))
+            except Exception as e:  # noqa: BLE001
+                logger.exception("Crawl of %s failed", name)
+                self.errors[name] = e
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        tasks = []
+        for name, c in self.crawls.items():
+            task = asyncio.ensure_future(crawl(name, c.iter_datasets(executor, slots)))
+            task.add_done_callback(lambda _: results.put_nowait(None))
+            tasks.append(task)
+        try:
+            running = len(tasks)
+            while running:
+                item = await results.get()
+                if item is None:
+                    running -= 1
+                    continue
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Never block the event loop on the requests still in flight
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def crawl_async(catalog_url, **kwargs: object):
+    """Crawls a catalog from a running event loop and returns the finished AsyncCrawl
+    :param str catalog_url: URL of the catalog to start from
+    :param kwargs: Any AsyncCrawl parameter
+    """
+    return await AsyncCrawl(catalog_url, **kwargs)
+
+
+def crawl_roots(roots, **kwargs: object):
+    """Crawls many catalogs at once and returns the finished MultiCrawl,
+    for code that is not running an event loop
+    :param roots: Dict of names to catalog URLs or to dicts of AsyncCrawl parameters, or a list of URLs
+    :param kwargs: Any MultiCrawl parameter
+    """
+    return asyncio.run(MultiCrawl(roots, **kwargs).run())
+
+
+def iter_roots(roots, **kwargs: object):
+    """Crawls many catalogs at once and yields a ``(root name, LeafDataset)``
+    tuple for each dataset as soon as it is resolved, for code that is not
+    running an event loop. The crawl runs on a background thread and is
+    stopped if the generator is closed early.
+    :param roots: Dict of names to catalog URLs or to dicts of AsyncCrawl parameters, or a list of URLs
+    :param kwargs: Any MultiCrawl parameter
+    """
+    multi = MultiCrawl(roots, **kwargs)
+    results = queue.Queue()
+    done = object()
+    state = {}
+
+    async def produce():
+        state["loop"] = asyncio.get_running_loop()
+        state["task"] = asyncio.current_task()
+        async for item in multi.iter_datasets():
+            results.put(item)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(asyncio.run, produce())
+    future.add_done_callback(lambda _: results.put(done))
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        if not future.done() and "task" in state:
+            # RuntimeError if the loop finished in the meantime
+            with suppress(RuntimeError):
+                state["loop"].call_soon_threadsafe(state["task"].cancel)
+        executor.shutdown(wait=True)
+    # Surface any error raised while crawling
+    future.result()
@@ -0,0 +1,89 @@
+import time
+from datetime import timedelta
+
+
+class CrawlBudget:
+    """Limits on how much of a catalog tree a crawl covers.
+
+    A crawl given a budget stops as soon as any of its limits is reached and
+    returns the datasets found so far: catalogs deeper than ``max_depth`` are
+    not followed, no more than ``max_catalogs`` catalogs are requested, no
+    more than ``max_datasets`` datasets are returned and nothing is returned
+    after ``deadline`` seconds. The limits that cut the crawl short are listed
+    in ``exhausted`` and the crawl's ``complete`` is False.
+
+    A budget is reset at the start of every crawl it is given to.
+    """
+
+    def __init__(self, max_depth=None, max_catalogs=None, max_datasets=None, deadline=None):
+        """:param int max_depth: Deepest catalog to crawl, the root catalog being at depth 0
+        :param int max_catalogs: Most catalogs to request
+        :param int max_datasets: Most datasets to return
+        :param deadline: Seconds, or a timedelta, from the start of the crawl to stop at
+        """
+        if isinstance(deadline, timedelta):
+            deadline = deadline.total_seconds()
+        self.max_depth = max_depth
+        self.max_catalogs = max_catalogs
+        self.max_datasets = max_datasets
+        self.deadline = deadline
+        self.start()
+
+    def start(self):
+        """Resets the budget for a new crawl"""
+        self.catalogs = 0
+        self.datasets = 0
+        self.exhausted = set()
+        self.expires = time.monotonic() + self.deadline if self.deadline is not None else None
+
+    @property
+    def complete(self):
+        """False if any limit cut the crawl short"""
+        return not self.exhausted
+
+    def remaining(self):
+        """Returns the seconds left before the deadline, None without a deadline"""
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0)
+
+    def allows(self, depth):
+        """Returns True if a catalog at depth may be crawled
+        :param int depth: Depth of the catalog
+        """
+        if self.max_depth is not None and depth > self.max_depth:
+            self.exhausted.add("max_depth")
+            return False
+        return True
+
+    def take_catalog(self):
+        """Counts a catalog about to be requested and returns False if there is no budget left for it"""
+        if self.max_catalogs is not None and self.catalogs >= self.max_catalogs:
+            self.exhausted.add("max_catalogs")
+            return False
+        self.catalogs += 1
+        return True
+
+    def add_dataset(self):
+        """Counts a dataset returned and returns True if it was the last one allowed"""
+        self.datasets += 1
+        return self.max_datasets is not None and self.datasets >= self.max_datasets
+
+    def drop_dataset(self):
+        """Records that a dataset was found beyond the last one allowed"""
+        self.exhausted.add("max_datasets")
+
+    def expired(self):
+        """Returns True, and records it, if the deadline has passed. Only call
+        it when there is more to crawl.
+        """
+        if self.expires is not None and time.monotonic() >= self.expires:
+            self.exhausted.add("deadline")
+            return True
+        return False
+
+    def __repr__(self):
+        return (
+            f"<CrawlBudget max_depth: {self.max_depth}, max_catalogs: {self.max_catalogs}, "
+            f"max_datasets: {self.max_datasets}, deadline: {self.deadline}>"
+        )
@@ -0,0 +1,246 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: str
+    stored: float
+
+
+def auth_identity(auth):
+    """Returns a string identifying the credentials of a requests auth object
+    so responses fetched with different credentials are cached separately.
+    :param requests.auth.AuthBase auth: requests auth object (or user/password tuple)
+    """
+    if auth is None:
+        return ""
+    if isinstance(auth, (tuple, list)):
+        return repr(tuple(auth))
+    return "{}:{}:{}".format(
+        type(auth).__name__,
+        getattr(auth, "username", ""),
+        getattr(auth, "password", ""),
+    )
+
+
+def cache_key(url, auth=None):
+    """Returns the key a response is cached under
+    :param str url: URL of the response
+    :param requests.auth.AuthBase auth: requests auth object used to request it
+    """
+    return hashlib.sha256((f"{url}\n{auth_identity(auth)}").encode()).hexdigest()
+
+
+class HTTPCache:
+    """A conditional-GET cache for catalog and dataset XML.
+
+    Responses carrying an ETag or Last-Modified header are kept in an in-memory
+    LRU and, when a ``path`` is given, on disk so they survive between crawls.
+    Cached responses are revalidated with If-None-Match/If-Modified-Since and
+    the stored body is reused when the server answers 304 Not Modified.
+
+    The ``hits`` (304 answered from the cache), ``misses`` (full body downloaded),
+    ``stores`` and ``evictions`` counters can be used to monitor the cache.
+
+    A response whose validators were handed out is kept until its request is
+    answered, so a 304 always finds the body even if the response was evicted
+    in the meantime.
+    """
+
+    def __init__(self, path=None, max_size=None, max_age=None, memory_size=256):
+        """:param str path: Directory to keep the cache in. The cache is in memory only if None.
+        :param int max_size: Maximum size of the cached bodies on disk, in bytes
+        :param float max_age: Seconds after which a cached response is evicted instead of revalidated
+        :param int memory_size: Number of responses to keep in memory
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.memory_size = memory_size
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._pinned = {}  # Entries whose validators were handed out, until update
+        self._lock = threading.RLock()
+        self._size = None
+        if path is not None:
+            Path(path).mkdir(parents=True, exist_ok=True)
+
+    def validators(self, url, auth=None):
+        """Returns the conditional request headers for a cached response, if any
+        :param str url: URL about to be requested
+        :param requests.auth.AuthBase auth: requests auth object used for the request
+        """
+        entry = self.get(url, auth)
+        headers = {}
+        if entry is not None:
+            with self._lock:
+                self._pinned[cache_key(url, auth)] = entry
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def update(self, url, auth, response):
+        """Returns the body for a response, taking it from the cache on a 304 and
+        caching it otherwise
+        :param str url: URL that was requested
+        :param requests.auth.AuthBase auth: requests auth object used for the request
+        :param XMLResponse response: The response, None if the request failed
+        """
+        with self._lock:
+            pinned = self._pinned.pop(cache_key(url, auth), None)
+        if response is None:
+            return None
+        if response.status == HTTPStatus.NOT_MODIFIED:
+            entry = pinned or self.get(url, auth)
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                return entry.body
+            logger.warning("%s was not modified but is no longer cached", url)
+            return None
+
+        with self._lock:
+            self.misses += 1
+        if response.status == HTTPStatus.OK and (response.etag or response.last_modified):
+            self.put(url, auth, CacheEntry(response.body, response.etag, response.last_modified, time.time()))
+        return response.body
+
+    def get(self, url, auth=None):
+        """Returns the CacheEntry for a URL or None if it is not cached
+        :param str url: URL of the response
+        :param requests.auth.AuthBase auth: requests auth object used to request it
+        """
+        key = cache_key(url, auth)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._touch(key)
+            else:
+                entry = self._read(key)
+                if entry is not None:
+                    self._remember(key, entry)
+            if entry is not None and self.max_age is not None and time.time() - entry.stored > self.max_age:
+                self._evict(key)
+                return None
+            return entry
+
+    def put(self, url, auth, entry):
+        """Caches a response
+        :param str url: URL of the response
+        :param requests.auth.AuthBase auth: requests auth object used to request it
+        :param CacheEntry entry: The response to cache
+        """
+        key = cache_key(url, auth)
+        with self._lock:
+            self._remember(key, entry)
+            self._write(key, entry)
+            self.stores += 1
+
+    def clear(self):
+        """Removes every cached response"""
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._keys()):
+                self._evict(key)
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _file(self, key):
+        return Path(self.path) / key[:2] / key
+
+    def _keys(self):
+        if self.path is None:
+            return
+        for _, _, files in os.walk(self.path):
+            for f in files:
+                if not f.startswith("."):
+                    yield f
+
+    def _read(self, key):
+        if self.path is None:
+            return None
+        try:
+            with self._file(key).open("rb") as f:
+                header = json.loads(f.readline().decode("utf-8"))
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        self._touch(key)
+        return CacheEntry(body, header.get("etag"), header.get("last_modified"), header.get("stored"))
+
+    def _touch(self, key):
+        """Marks a response on disk as used, keeping the least recently used files first in line for eviction"""
+        if self.path is None:
+            return
+        with contextlib.suppress(OSError):
+            os.utime(self._file(key))
+
+    def _write(self, key, entry):
+        if self.path is None:
+            return
+        directory = self._file(key).parent
+        directory.mkdir(parents=True, exist_ok=True)
+        header = {"etag": entry.etag, "last_modified": entry.last_modified, "stored": entry.stored}
+        # Write to a temporary file and rename so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".")
+        tmp = Path(tmp)
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(entry.body)
+        if self.max_size is not None and self._size is not None:
+            # Count the size of the file replaced, if any, out
+            with contextlib.suppress(OSError):
+                self._size -= self._file(key).stat().st_size
+            self._size += tmp.stat().st_size
+        tmp.replace(self._file(key))
+        if self.max_size is not None:
+            if self._size is None:
+                self._size = self._disk_size()
+            if self._size > self.max_size:
+                self._shrink()
+
+    def _evict(self, key):
+        self._memory.pop(key, None)
+        if self.path is not None:
+            try:
+                self._file(key).unlink()
+            except OSError:
+                return
+        self.evictions += 1
+
+    def _disk_size(self):
+        return sum(self._file(k).stat().st_size for k in self._keys())
+
+    def _shrink(self):
+        """Evicts the least recently used responses until the cache fits in max_size"""
+        files = sorted((self._file(k).stat().st_mtime, k) for k in self._keys())
+        self._size = self._disk_size()
+        for _, key in files:
+            if self._size <= self.max_size:
+                break
+            self._size -= self._file(key).stat().st_size
+            self._evict(key)
@@ -5,12 +5,26 @@ try:
 except ImportError:
     from urllib import parse as urlparse
     from urllib.parse import quote_plus
+import contextlib
+import copy
+import functools
+import hashlib
+import heapq
+import itertools
+import json
 import logging
 import multiprocessing as mp
-import os
+import queue
 import re
 import sys
+import threading
+import time
+from collections import Counter, deque
+from collections.abc import Mapping
 from datetime import datetime
+from http import HTTPStatus
+from pathlib import PurePosixPath
+from typing import ClassVar, NamedTuple
 
 import pytz
 import requests
@@ -18,10 +32,14 @@ from dateutil.parser import parse
 from lxml import etree
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
-from thredds_crawler.utils import construct_url
+from thredds_crawler import dap
+from thredds_crawler.filters import DatasetFilter
+from thredds_crawler.frontier import Frontier
+from thredds_crawler.snapshot import CrawlSnapshot
+from thredds_crawler.stats import CrawlStats
+from thredds_crawler.throttle import RequestScheduler
+from thredds_crawler.utils import CHUNK_SIZE, INV_NS, XLINK_NS, construct_url, parse_datetime, request_headers, session
 
-INV_NS = "http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
-XLINK_NS = "http://www.w3.org/1999/xlink"
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 try:
@@ -36,16 +54,216 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# References and leaves of a catalog handed over at a time while it is parsed
+BATCH_SIZE = 1000
+
+
+class XMLResponse(NamedTuple):
+    """A response to a request for an XML document"""
+
+    status: int
+    body: bytes
+    etag: str
+    last_modified: str
+    retry_after: str = None
+    catalog: "ParsedCatalog" = None
+    elapsed: float = None
+    size: int = None
+    digest: str = None
+
+
+class ParsedCatalog(NamedTuple):
+    """The references and leaves of a catalog along with the hash of its content, the
+    count of catalogRefs and datasets left out by each filter rule and the seconds spent parsing
+    """
+
+    references: list
+    leaves: list
+    digest: str
+    rejected: Counter
+    parse_time: float
+
+
+class CatalogBatch(NamedTuple):
+    """References and leaves of a catalog handed over while it is parsed. The offset is
+    the number of references and leaves before the batch, in the order of the catalog.
+    """
+
+    offset: int
+    references: list
+    leaves: list
+
+
+def interned(value):
+    """Returns the interned copy of a string, so the many datasets repeating it share one object
+    :param str value: A string or None
+    """
+    return sys.intern(value) if value is not None else None
+
+
+class Service(Mapping):
+    """A service of a LeafDataset, its ``name``, ``service`` type and ``url``.
+
+    It is a read-only mapping of those fields as well, so ``service["url"]``,
+    ``"url" in service``, ``service.items()`` and ``dict(service)`` work and a
+    service equals the dict of its fields. ``json.dumps`` only takes real
+    dicts, serialize ``dict(service)`` (or LeafDataset.to_dict) instead.
+    """
+
+    __slots__ = ("name", "service", "url")
+    _fields = __slots__
+
+    def __init__(self, name, service, url):
+        self.name = name
+        self.service = service
+        self.url = url
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __eq__(self, other):
+        if isinstance(other, Service):
+            return (self.name, self.service, self.url) == (other.name, other.service, other.url)
+        return super().__eq__(other)
+
+    def __hash__(self):
+        return hash((self.name, self.service, self.url))
+
+    def __reduce__(self):
+        return Service, (self.name, self.service, self.url)
+
+    def __repr__(self):
+        return f"Service(name={self.name!r}, service={self.service!r}, url={self.url!r})"
+
+
+class CrawlFailure(NamedTuple):
+    """A request or dataset that could not be crawled"""
+
+    url: str
+    kind: str
+    reason: str
+
+
+def iter_chunks(content, size=CHUNK_SIZE):
+    """Yields an already downloaded body in chunks, so it can be parsed the
+    same way as a response that is still downloading
+    :param bytes content: The body
+    :param int size: Bytes per chunk
+    """
+    for i in range(0, len(content), size):
+        yield content[i : i + size]
+
+
+def fetch_xml(url, auth=None, headers=None, timeout=None):
+    """Returns an XMLResponse for the url. Raises the requests exception if it could not be requested.
+    :param str url: URL for the resource to load as an XML
+    :param requests.auth.AuthBase auth: requests auth object to use
+    :param dict headers: Additional request headers, such as cache validators
+    :param float timeout: Seconds to wait for the server to respond
+    """
+    start = time.monotonic()
+    r = session().get(url, auth=auth, headers=request_headers(headers), verify=False, timeout=timeout)
+    return XMLResponse(
+        r.status_code,
+        r.content if r.status_code != HTTPStatus.NOT_MODIFIED else None,
+        r.headers.get("ETag"),
+        r.headers.get("Last-Modified"),
+        r.headers.get("Retry-After"),
+        elapsed=time.monotonic() - start,
+        size=received(r),
+    )
+
+
+def keep_chunks(chunks, body):
+    """Yields the chunks of a body and keeps them in a list as they pass
+    :param chunks: Iterable of the bytes of the body
+    :param list body: List to keep the chunks in
+    """
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+
+
+def fetch_catalog(url, parser, auth=None, headers=None, timeout=None, *, keep_body=False, batches=None):  # noqa: PLR0913
+    """Returns an XMLResponse for a catalog, parsed with a CatalogParser while
+    it downloads so the body is never held in memory. The ParsedCatalog is the
+    ``catalog`` of the response, None if the catalog was not sent or could not
+    be parsed, and its content_hash, taken while parsing, the ``digest``.
+    Raises the requests exception if it could not be requested.
+
+    Given batches, the references and leaves are handed to it as soon as they
+    are parsed (see CatalogParser.parse) instead of being collected, so memory
+    use does not grow with the size of the catalog, unless the body is kept.
+    :param str url: URL for the catalog
+    :param CatalogParser parser: Parser to read the catalog with
+    :param requests.auth.AuthBase auth: requests auth object to use
+    :param dict headers: Additional request headers, such as cache validators
+    :param float timeout: Seconds to wait for the server to respond
+    :param bool keep_body: Keep the body of responses that can be cached
+    :param batches: Called with every CatalogBatch of the catalog
+    """
+    start = time.monotonic()
+    with session().get(
+        url,
+        auth=auth,
+        headers=request_headers(headers),
+        verify=False,
+        timeout=timeout,
+        stream=True,
+    ) as r:
+        response = XMLResponse(
+            r.status_code,
+            None,
+            r.headers.get("ETag"),
+            r.headers.get("Last-Modified"),
+            r.headers.get("Retry-After"),
+        )
+        if r.status_code < HTTPStatus.MULTIPLE_CHOICES:
+            chunks = r.iter_content(CHUNK_SIZE)
+            if keep_body and (response.etag or response.last_modified):
+                body = []
+                catalog = parser.parse(url, keep_chunks(chunks, body), batches)
+                # Parsing stops at invalid XML, the cache keeps the body as it was sent
+                body.extend(chunks)
+                response = response._replace(body=b"".join(body))
+            else:
+                catalog = parser.parse(url, chunks, batches)
+            if catalog is not None:
+                response = response._replace(catalog=catalog, digest=catalog.digest)
+        # The catalog is parsed while it downloads, leave the parse time out
+        parse_time = response.catalog.parse_time if response.catalog is not None else 0.0
+        return response._replace(elapsed=time.monotonic() - start - parse_time, size=received(r))
+
+
+def received(r):
+    """Returns the bytes of body received for a response, as sent over the wire (compressed)
+    :param requests.Response r: The response, once its body was read
+    """
+    try:
+        return r.raw.tell()
+    except AttributeError:
+        return len(r.content or b"")
+
 
 def request_xml(url, auth=None):
     """Returns an etree.XMLRoot object loaded from the url
     :param str url: URL for the resource to load as an XML
     """
     try:
-        r = requests.get(url, auth=auth, verify=False)
-        return r.text.encode("utf-8")
-    except BaseException:
-        logger.error("Skipping %s (error parsing the XML)" % url)
+        return fetch_xml(url, auth).body
+    except requests.RequestException:
+        logger.exception("Skipping %s (error parsing the XML)", url)
     return None
 
 
@@ -53,8 +271,372 @@ def make_leaf(url, auth):
     return LeafDataset(url, auth=auth)
 
 
+def inherited_metadata(dataset):
+    """Returns a single metadata element holding everything a dataset inherits
+    from its parent datasets followed by its own metadata, the same way the
+    TDS flattens it when serving an individual dataset, along with the
+    namespaces declared in the catalog. Returns None if there is no metadata at all.
+    :param lxml.etree.Element dataset: The dataset element
+    """
+    sources = [
+        m
+        for parent in reversed(list(dataset.iterancestors(f"{{{INV_NS}}}dataset")))
+        for m in parent.findall(f"{{{INV_NS}}}metadata")
+        if m.get("inherited") == "true"
+    ]
+    sources += dataset.findall(f"{{{INV_NS}}}metadata")
+    if not sources:
+        return None
+
+    metadata = etree.Element(f"{{{INV_NS}}}metadata", nsmap={**dataset.nsmap, None: INV_NS})
+    metadata.set("inherited", "true")
+    for m in sources:
+        for child in m:
+            metadata.append(copy.deepcopy(child))
+    return metadata
+
+
+def data_size_mb(dataset, metadata):
+    """Returns the dataSize of a dataset in megabytes, or None if it has none
+    (http://www.unidata.ucar.edu/software/thredds/current/tds/catalog/InvCatalogSpec.html#dataSize)
+    :param lxml.etree.Element dataset: The dataset element
+    :param lxml.etree.Element metadata: The metadata that applies to the dataset
+    """
+    data_size = dataset.find(f"{{{INV_NS}}}dataSize")
+    if data_size is None and metadata is not None:
+        data_size = metadata.find(f"{{{INV_NS}}}dataSize")
+    if data_size is None:
+        return None
+    size = float(data_size.text)
+    data_units = data_size.get("units")
+    # Convert to MB
+    if data_units == "bytes":
+        size *= 1e-6
+    elif data_units == "Kbytes":
+        size *= 0.001
+    elif data_units == "Gbytes":
+        size /= 0.001
+    elif data_units == "Tbytes":
+        size /= 1e-6
+    return size
+
+
+def modified_date(dataset_url, dataset, metadata):
+    """Returns the modified date of a dataset, or None if it has none or it is invalid
+    :param str dataset_url: URL for the dataset
+    :param lxml.etree.Element dataset: The dataset element
+    :param lxml.etree.Element metadata: The metadata that applies to the dataset
+    """
+    date_tag = dataset.find(f'{{{INV_NS}}}date[@type="modified"]')
+    if date_tag is None and metadata is not None:
+        date_tag = metadata.find(f'{{{INV_NS}}}date[@type="modified"]')
+    if date_tag is None:
+        return None
+    try:
+        return parse_datetime(date_tag.text)
+    except (ValueError, OverflowError):
+        logger.debug("Invalid modified date %s for %s", date_tag.text, dataset_url)
+    return None
+
+
+def service_name(dataset, metadata):
+    """Returns the name of the service a dataset uses, None if it does not name one
+    :param lxml.etree.Element dataset: The dataset element
+    :param lxml.etree.Element metadata: The metadata that applies to the dataset
+    """
+    service_tag = dataset.find(f"{{{INV_NS}}}serviceName")
+    if service_tag is None and metadata is not None:
+        # The most specific (last) serviceName wins over inherited ones
+        service_tags = metadata.findall(f"{{{INV_NS}}}serviceName")
+        if service_tags:
+            service_tag = service_tags[-1]
+    if service_tag is not None:
+        return service_tag.text
+    return dataset.get("serviceName")
+
+
+def get_catalog_url(url):
+    """Returns the appropriate catalog URL by replacing html with xml in some
+    cases
+    :param str url: URL to the catalog
+    """
+    u = urlparse.urlsplit(url)
+    if PurePosixPath(u.path).suffix == ".html":
+        u = urlparse.urlsplit(url.replace(".html", ".xml"))
+    return u.geturl()
+
+
+class CatalogParser:
+    """Reads the catalogRefs and leaf datasets of a catalog incrementally.
+
+    Chunks of XML are fed to an lxml pull parser and every catalogRef and
+    dataset is handled as soon as its end tag arrives, then removed from the
+    tree. Only the services and the metadata of the datasets still open are
+    kept, so the tree does not grow with the size of the catalog. The
+    references and leaves found are handed over in batches of ``batch_size``
+    as soon as a batch is complete, or collected until the end of the
+    catalog and returned together. The datasets of a parent that have no
+    metadata of their own share a single copy of the metadata they inherit.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        select=None,
+        skip=None,
+        before=None,
+        after=None,
+        *,
+        inline=True,
+        predicates=None,
+        prune=None,
+        batch_size=BATCH_SIZE,
+    ):
+        """:param list select: Regular expressions of the dataset IDs to keep
+        :param list skip: Regular expressions of the dataset names and catalogRef titles to skip
+        :param datetime before: Only keep datasets modified before this (UTC)
+        :param datetime after: Only keep datasets modified after this (UTC)
+        :param bool inline: Resolve datasets from the catalog they are listed in
+        :param list predicates: Callables taking a dataset element and returning False to skip it
+        :param prune: Prune catalogRefs outside of the before/after window (see DatasetFilter)
+        :param int batch_size: References and leaves per CatalogBatch
+        """
+        self.filter = DatasetFilter(select, skip, before, after, predicates, prune)
+        self.inline = inline
+        self.batch_size = batch_size
+        # Counts of the catalogRefs and datasets left out, for the catalog each thread is parsing
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def parse(self, url, chunks, batches=None):
+        """Returns the ParsedCatalog of a catalog, or None if the XML could not be parsed
+        :param str url: URL for the catalog
+        :param chunks: Iterable of the bytes of the catalog
+        :param batches: Called with every CatalogBatch as soon as it is parsed. The
+            references and leaves are then not collected in the ParsedCatalog.
+        """
+        references = []
+        leaves = []
+        for parsed in self.iter_batches(url, chunks):
+            if not isinstance(parsed, CatalogBatch):
+                break
+            if batches is not None:
+                batches(parsed)
+            else:
+                references += parsed.references
+                leaves += parsed.leaves
+        return parsed._replace(references=references, leaves=leaves) if parsed is not None else None
+
+    def iter_batches(self, url, chunks):
+        """Yields a CatalogBatch of the references and leaves of a catalog as soon as
+        ``batch_size`` of them are parsed, and the rest at the end of the catalog. Then
+        yields the ParsedCatalog, without references and leaves, or None if the XML
+        could not be parsed.
+        :param str url: URL for the catalog
+        :param chunks: Iterable of the bytes of the catalog
+        """
+        parser = etree.XMLPullParser(
+            events=("end",),
+            tag=(f"{{{INV_NS}}}dataset", f"{{{INV_NS}}}catalogRef"),
+        )
+        digest = hashlib.sha256()
+        found = []  # References and leaves not handed over yet, in the order of the catalog
+        offset = 0
+        rejected = Counter()
+        inherited = {}
+        # Only the time spent parsing, not the time waiting for the chunks to download
+        parse_time = 0.0
+        for chunk in itertools.chain(chunks, [None]):
+            start = time.perf_counter()
+            self._local.rejected = rejected
+            self._local.inherited = inherited
+            try:
+                if chunk is None:
+                    parser.close()
+                else:
+                    digest.update(chunk)
+                    parser.feed(chunk)
+                self._read_events(url, parser, found)
+            except etree.XMLSyntaxError:
+                found = None
+            finally:
+                self._local.rejected = None
+                self._local.inherited = None
+            if found is None:
+                yield None
+                return
+            parse_time += time.perf_counter() - start
+            while len(found) >= self.batch_size or (chunk is None and found):
+                batch = found[: self.batch_size]
+                del found[: self.batch_size]
+                yield CatalogBatch(
+                    offset,
+                    [item for is_reference, item in batch if is_reference],
+                    [item for is_reference, item in batch if not is_reference],
+                )
+                offset += len(batch)
+        yield ParsedCatalog([], [], digest.hexdigest(), rejected, parse_time)
+
+    def _read_events(self, url, parser, found):
+        """Handles the elements the parser finished since it was last read
+        :param str url: URL for the catalog
+        :param lxml.etree.XMLPullParser parser: The parser
+        :param list found: ``(is_reference, item)`` of the references and leaves (see leaf) found so far
+        """
+        for _, element in parser.read_events():
+            if element.tag == f"{{{INV_NS}}}catalogRef":
+                reference = self.reference(url, element)
+                if reference is not None:
+                    found.append((True, reference))
+            elif element.get("urlPath") is not None:
+                leaf = self.leaf(url, element)
+                if leaf is not None:
+                    found.append((False, leaf))
+            # Everything needed was taken from the element, drop it to keep the tree small
+            self._local.inherited.pop(element, None)
+            parent = element.getparent()
+            if parent is not None:
+                parent.remove(element)
+
+    def reference(self, url, ref):
+        """Returns the URL of a catalogRef, or None if it is skipped
+        :param str url: URL for the current catalog
+        :param lxml.etree.Element ref: The catalogRef element
+        """
+        reference = get_catalog_url(construct_url(url, ref.get(f"{{{XLINK_NS}}}href")))
+        if not self.filter.accept_reference(ref, reference, getattr(self._local, "rejected", None)):
+            return None
+        return reference
+
+    def leaf(self, url, leaf):
+        """Returns a LeafDataset for a dataset of the catalog, the URL to resolve
+        one from, or None if the dataset is filtered out
+        :param str url: URL for the current catalog
+        :param lxml.etree.Element leaf: The dataset element
+        """
+        if not self.filter.accept_dataset(leaf, getattr(self._local, "rejected", None)):
+            return None
+        return self.resolve(url, leaf)
+
+    def resolve(self, url, leaf):
+        """Returns a LeafDataset built from the catalog, or the dataset URL to
+        request when the catalog does not hold everything needed to build one
+        :param str url: URL for the current catalog
+        :param lxml.etree.Element leaf: The dataset element
+        """
+        dataset_url = "{}?dataset={}".format(url, leaf.get("ID"))
+        if self.inline:
+            ds = LeafDataset.from_catalog(url, leaf.getroottree().getroot(), leaf, self.inherited(leaf))
+            if ds is not None:
+                return ds
+            logger.debug("Could not resolve %s from the catalog", dataset_url)
+        return dataset_url
+
+    def inherited(self, leaf):
+        """Returns the metadata a dataset without metadata of its own inherits, as
+        an element and as XML, built once for all the datasets of the same parent.
+        Returns None if the dataset has metadata of its own.
+        :param lxml.etree.Element leaf: The dataset element
+        """
+        if leaf.find(f"{{{INV_NS}}}metadata") is not None:
+            return None
+        shared = getattr(self._local, "inherited", None)
+        parent = leaf.getparent()
+        if shared is None or parent not in shared:
+            metadata = inherited_metadata(leaf)
+            found = (metadata, etree.tostring(metadata) if metadata is not None else None)
+            if shared is None:
+                return found
+            shared[parent] = found
+        return shared[parent]
+
+
+def put_outcome(done, outcome):
+    """Puts the outcome of a request, or a CatalogBatch of it, in the queue of its
+    crawl. Outcomes of the requests still in flight when a crawl stopped are dropped
+    along with its queue.
+    :param queue.Queue done: The queue
+    :param tuple outcome: The request, the response or CatalogBatch and the error raised
+    """
+    with contextlib.suppress(OSError, EOFError):
+        done.put(outcome)
+
+
+def put_batch(done, request, batch):
+    """Puts a CatalogBatch of a catalog being parsed in the queue of its crawl
+    :param queue.Queue done: The queue
+    :param tuple request: The kind, URL, depth and attempt of the request
+    :param CatalogBatch batch: The batch
+    """
+    put_outcome(done, (request, batch, None))
+
+
+class _Stream:
+    """The references and leaves of a catalog handled so far, while it is handed over in batches"""
+
+    def __init__(self, handled=0, *, leaves=False):
+        """:param int handled: Number of references and leaves handled
+        :param bool leaves: Keep the leaves, not only the references
+        """
+        self.handled = handled
+        self.references = []
+        self.leaves = [] if leaves else None
+
+
+class _Requests:
+    """The requests of a crawl that are waiting for their host, waiting to be
+    retried or in flight, and the queue their outcomes are put in
+    """
+
+    def __init__(self, done):
+        """:param queue.Queue done: Queue for the outcomes, one the workers can put CatalogBatches in"""
+        self.done = done
+        self.waiting = {}  # Requests not sent yet, by host
+        self.retries = []  # Requests to send again, by time
+        self.outstanding = {"catalog": 0, "dataset": 0}
+        self.in_flight = Counter()  # Requests sent and not answered yet, by URL
+        self.streams = {}  # Catalogs handed over in batches, by URL
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return sum(self.outstanding.values())
+
+    def add(self, request):
+        """Adds a request to send
+        :param tuple request: The kind, URL, depth and attempt of the request
+        """
+        self._wait_for_host(request)
+        self.outstanding[request[0]] += 1
+
+    def retry(self, request, when):
+        """Adds a request to send again once the clock reaches when
+        :param tuple request: The kind, URL, depth and attempt of the request
+        :param float when: time.monotonic value to send it at
+        """
+        heapq.heappush(self.retries, (when, next(self._counter), request))
+
+    def due(self, now):
+        """Makes the retries that are due wait for their host and returns the
+        seconds until the next retry is, None if there is none
+        :param float now: time.monotonic value
+        """
+        while self.retries and self.retries[0][0] <= now:
+            self._wait_for_host(heapq.heappop(self.retries)[2])
+        return self.retries[0][0] - now if self.retries else None
+
+    def _wait_for_host(self, request):
+        self.waiting.setdefault(urlparse.urlsplit(request[1]).netloc, deque()).append(request)
+
+
 class Crawl:
-    SKIPS = [
+    SKIPS: ClassVar[list] = [
         ".*files.*",
         ".*Individual Files.*",
         ".*File_Access.*",
@@ -63,7 +645,7 @@ class Crawl:
         ".*Constant Forecast Date.*",
     ]
 
-    def __init__(
+    def __init__(  # noqa: PLR0913, PLR0917
         self,
         catalog_url,
         select=None,
@@ -73,25 +655,193 @@ class Crawl:
         debug=None,
         workers=None,
         auth=None,
+        *,
+        inline=True,
+        order=None,
+        priority=None,
+        lazy=False,
+        cache=None,
+        snapshot=None,
+        settle_after=None,
+        scheduler=None,
+        pool=None,
+        predicates=None,
+        store=None,
+        prune=None,
+        stats=None,
+        budget=None,
     ):
         """:param select list: Dataset IDs. Python regex supported.
         :param list skip: Dataset names and/or a catalogRef titles. Python regex supported.
+        :param int workers: Number of worker processes. Unless a scheduler is given, as many
+            requests as workers may be in flight to a single host.
         :param requests.auth.AuthBase auth: requests auth object to use
+        :param bool inline: Resolve datasets from the catalog they are listed in and only
+            request the individual dataset documents when that is not possible
+        :param str order: Order catalogs are crawled in, "dfs" (default), "bfs" or "priority"
+        :param callable priority: Function taking a catalog URL and its depth and returning
+            a sort key, lowest crawled first. Implies "priority" ordering.
+        :param bool lazy: Do not crawl until iter_datasets is called. ``datasets`` is not populated.
+        :param thredds_crawler.cache.HTTPCache cache: Cache to revalidate catalogs and datasets against
+        :param thredds_crawler.snapshot.CrawlSnapshot snapshot: Snapshot of a previous crawl to seed this
+            one from. The new snapshot is available as ``snapshot`` and the changes as ``diff`` afterwards.
+        :param timedelta settle_after: Reuse the datasets of catalog subtrees whose datasets were all
+            last modified longer ago than this without requesting them again
+        :param thredds_crawler.throttle.RequestScheduler scheduler: Rate limits, retries, timeouts and
+            circuit breakers applied to every request. Requests that fail are listed in ``failures``.
+            Its ``concurrency`` caps the requests in flight to a single host, whatever the workers.
+        :param multiprocessing.pool.Pool pool: Worker pool to crawl with instead of starting one.
+            It is left running when the crawl is over (see Crawler).
+        :param list predicates: Functions taking a dataset element and returning False to skip
+            the dataset, called after every other filter
+        :param thredds_crawler.store.CrawlStore store: Store to checkpoint the crawl in. An unfinished
+            crawl of the same catalog with the same options is resumed from it: the datasets found
+            before it stopped are yielded first, then the crawl carries on from where it stopped.
+        :param prune: Do not request catalogRefs whose timeCoverage, or the date in their title or URL
+            (2016/, 2016/01/, 20160110...), is outside of the before/after window. True to detect the
+            dates, or a list of regular expressions with year, month and day named groups.
+        :param thredds_crawler.stats.CrawlStats stats: Stats to record the crawl in, with any hooks to
+            call as it progresses. A new CrawlStats is used if None. Available as ``stats``.
+        :param thredds_crawler.budget.CrawlBudget budget: Limits on the depth, catalogs, datasets and
+            time of the crawl. The crawl stops at the first limit reached and ``complete`` is False.
         """
-        workers = workers or 4
-        self.pool = mp.Pool(processes=workers)
+        self.workers = workers or 4
+        if scheduler is None:
+            # Let every worker request the same host at once
+            scheduler = RequestScheduler(concurrency=self.workers)
+        self._configure(
+            select=select,
+            skip=skip,
+            before=before,
+            after=after,
+            debug=debug,
+            auth=auth,
+            inline=inline,
+            cache=cache,
+            snapshot=snapshot,
+            settle_after=settle_after,
+            scheduler=scheduler,
+            predicates=predicates,
+            prune=prune,
+            stats=stats,
+            budget=budget,
+        )
+        self.store = store
 
+        # Validate the ordering before starting any worker
+        Frontier(order, priority)
+        self.order = order
+        self.priority = priority
+
+        self.pool = pool
+        self._shared_pool = pool is not None
+        self.catalog_url = catalog_url
+        self.datasets = None
+        if not lazy:
+            self.datasets = list(self.iter_datasets())
+
+    def resolve_sizes(self, datasets=None, workers=8, timeout=60):
+        """Computes the size of the datasets concurrently and returns a dict of the
+        sizes in megabytes by dataset ID. Datasets without a dataSize have their
+        OPeNDAP DDS requested, once per endpoint, and ``size`` then reuses it.
+        :param list datasets: LeafDatasets, the datasets of the crawl if None
+        :param int workers: Number of requests in flight at once
+        :param float timeout: Seconds to wait for a server to respond
+        """
+        if datasets is None:
+            if self.datasets is None:
+                msg = "A lazy crawl keeps no datasets, pass the datasets to resolve"
+                raise ValueError(msg)
+            datasets = self.datasets
+        return dap.resolve_sizes(datasets, workers=workers, auth=self.auth, timeout=timeout)
+
+    def iter_datasets(self):
+        """Performs the crawl and yields each LeafDataset as soon as it is resolved.
+        Datasets are not kept by the Crawl object, so memory use does not grow
+        with the number of datasets found.
+        """
+        self._begin()
+        if not self._shared_pool:
+            self.pool = mp.Pool(processes=self.workers)
+        full = False
+        try:
+            for found in self._run(self.catalog_url):
+                if full and found is not None and found.id is not None:
+                    # A dataset beyond the last one allowed, the crawl is cut short
+                    self.budget.drop_dataset()
+                    break
+                ds = self._finalize(found)
+                if ds is not None:
+                    yield ds
+                    full = self.budget is not None and self.budget.add_dataset()
+        except BaseException:
+            self._stop_pool(wait=False)
+            raise
+        self._end()
+        # Do not wait for the requests still in flight when the crawl was cut short
+        self._stop_pool(wait=self.complete)
+
+    def _stop_pool(self, *, wait):
+        """Stops the worker pool, unless it is shared with other crawls
+        :param bool wait: Let the requests in flight finish instead of terminating the workers
+        """
+        if self._shared_pool:
+            return
+        if wait:
+            self.pool.close()
+        else:
+            self.pool.terminate()
+        self.pool.join()
+
+    def _configure(  # noqa: PLR0913
+        self,
+        *,
+        select,
+        skip,
+        before,
+        after,
+        debug,
+        auth,
+        inline,
+        cache,
+        snapshot,
+        settle_after,
+        scheduler,
+        predicates=None,
+        prune=None,
+        stats=None,
+        budget=None,
+    ):
+        """Validates and stores the crawl options shared by every crawl engine
+        :param list select: Dataset IDs. Python regex supported.
+        :param list skip: Dataset names and/or a catalogRef titles. Python regex supported.
+        :param datetime before: Only return datasets modified before this
+        :param datetime after: Only return datasets modified after this
+        :param bool debug: Log to STDOUT
+        :param requests.auth.AuthBase auth: requests auth object to use
+        :param bool inline: Resolve datasets from the catalog they are listed in
+        :param thredds_crawler.cache.HTTPCache cache: Cache to revalidate responses against
+        :param thredds_crawler.snapshot.CrawlSnapshot snapshot: Snapshot of a previous crawl
+        :param timedelta settle_after: Age after which unmodified catalog subtrees are reused
+        :param thredds_crawler.throttle.RequestScheduler scheduler: Decides when requests are made and retried
+        :param list predicates: Functions taking a dataset element and returning False to skip the dataset
+        :param prune: Prune catalogRefs outside of the before/after window, True or a list of date patterns
+        :param thredds_crawler.stats.CrawlStats stats: Stats to record the crawl in
+        :param thredds_crawler.budget.CrawlBudget budget: Limits on how much to crawl
+        """
+        # Log the messages of every module of the package
+        package_logger = logging.getLogger("thredds_crawler")
         if debug is True:
-            logger.setLevel(logging.DEBUG)
+            package_logger.setLevel(logging.DEBUG)
             ch = logging.StreamHandler(sys.stdout)
             ch.setLevel(logging.DEBUG)
             formatter = logging.Formatter(
                 "%(asctime)s - [%(levelname)s] %(message)s",
             )
             ch.setFormatter(formatter)
-            logger.addHandler(ch)
+            package_logger.addHandler(ch)
         else:
-            logger.addHandler(NullHandler())
+            package_logger.addHandler(NullHandler())
 
         # Only process these dataset IDs
         if select is not None:
@@ -107,295 +857,845 @@ class Crawl:
         # Only return datasets with a modified date greater or equal to this
         if after is not None:
             if not isinstance(after, datetime):
-                raise ValueError(
-                    "'after' parameter should be a datetime object",
-                )
-            if after.tzinfo:
-                after = after.astimezone(pytz.utc)
-            else:
-                after = after.replace(tzinfo=pytz.utc)
+                msg = "'after' parameter should be a datetime object"
+                raise ValueError(msg)
+            after = after.astimezone(pytz.utc) if after.tzinfo else after.replace(tzinfo=pytz.utc)
         self.after = after
 
         # Only return datasets with a modified date greater or equal to this
         if before is not None:
             if not isinstance(before, datetime):
-                raise ValueError(
-                    "'before' parameter should be a datetime object",
-                )
-            if before.tzinfo:
-                before = before.astimezone(pytz.utc)
-            else:
-                before = before.replace(tzinfo=pytz.utc)
+                msg = "'before' parameter should be a datetime object"
+                raise ValueError(msg)
+            before = before.astimezone(pytz.utc) if before.tzinfo else before.replace(tzinfo=pytz.utc)
         self.before = before
 
-        self.visited = []
-        datasets = []
-        urls = list(self._run(url=catalog_url, auth=auth))
+        # Resolve leaf datasets from the catalog they were found in instead of
+        # requesting each "?dataset=" document separately
+        self.inline = inline
 
-        jobs = [self.pool.apply_async(make_leaf, args=(url, auth)) for url in urls]
-        datasets = [j.get() for j in jobs]
+        self.predicates = list(predicates or [])
+        self.prune = prune
+        self.parser = CatalogParser(
+            self.select,
+            self.skip,
+            self.before,
+            self.after,
+            inline=self.inline,
+            predicates=self.predicates,
+            prune=self.prune,
+        )
 
-        self.pool.close()
-        self.pool.join()
+        self.auth = auth
+        self.cache = cache
+        self.scheduler = scheduler or RequestScheduler()
+        self.failures = []
+        self.stats = stats if stats is not None else CrawlStats()
+        self.budget = budget
+        self.complete = None
+
+        # Seed the crawl from a previous one
+        self.previous = snapshot
+        self.settle_after = settle_after
+        self.snapshot = None
+        self.diff = None
+        self.visited = set()
+        self.store = None
+        self._resumed = False
+        self._partial = set()  # Catalogs a resumed crawl stopped handing over half way
+
+    def _fingerprint(self):
+        """Returns a string identifying the options that decide which datasets are crawled"""
+        return json.dumps(
+            {
+                "select": [x.pattern for x in self.select] if self.select is not None else None,
+                "skip": [x.pattern for x in self.skip],
+                "before": self.before.isoformat() if self.before else None,
+                "after": self.after.isoformat() if self.after else None,
+                "inline": self.inline,
+                "predicates": [getattr(p, "__qualname__", repr(p)) for p in self.predicates],
+                "prune": self.prune if self.prune in (None, True, False) else [getattr(p, "pattern", p) for p in self.prune],
+            },
+            sort_keys=True,
+        )
+
+    def _begin(self):
+        """Resets the crawl state before a crawl starts"""
+        self.visited = set()
+        self.failures = []
+        self.diff = None
+        self.snapshot = None
+        self._reusable = False
+        self._resumed = False
+        self._partial = set()
+        self.complete = None
+        self.stats.start()
+        if self.budget is not None:
+            self.budget.start()
+        if self.store is not None:
+            self._resumed = self.store.open(self._get_catalog_url(self.catalog_url), self._fingerprint())
+            if self._resumed:
+                self.visited = self.store.visited()
+                logger.info("Resuming the crawl of %s", self.catalog_url)
+        if self.previous is not None:
+            self.snapshot = CrawlSnapshot(self._fingerprint())
+            self._reusable = self.previous.options == self.snapshot.options
+            if self.previous.options is not None and not self._reusable:
+                logger.warning("The snapshot was recorded with different options, crawling everything again")
+
+    def _end(self):
+        """Wraps up a crawl that ran to its end or to the end of its budget"""
+        self.stats.finish()
+        self.complete = self.budget is None or self.budget.complete
+        if not self.complete:
+            # A partial crawl can be resumed from the store and says nothing about what was removed
+            logger.info("Crawl of %s stopped early (%s)", self.catalog_url, ", ".join(sorted(self.budget.exhausted)))
+            return
+        if self.store is not None:
+            self.store.complete()
+        if self.snapshot is not None:
+            self.diff = self.snapshot.diff(self.previous)
+
+    def _fail(self, url, kind, reason, cause=None):
+        """Reports a catalog or dataset that could not be crawled
+        :param str url: URL that was requested
+        :param str kind: "catalog" or "dataset"
+        :param str reason: Why it failed
+        :param str cause: The reason without details, to count failures by, the reason if None
+        """
+        logger.error("Skipping %s (%s)", url, reason)
+        self.failures.append(CrawlFailure(url, kind, reason))
+        self.stats.record_error(cause or reason)
+
+    def _outcome(self, url, kind, response, error, attempt):
+        """Records the outcome of a request with the scheduler and returns the
+        seconds to wait before retrying it, or None if it is done. Requests that
+        are done without a usable response are reported as failures.
+        :param str url: URL that was requested
+        :param str kind: "catalog" or "dataset"
+        :param XMLResponse response: The response, None if the request raised
+        :param Exception error: The error raised by the request, if any
+        :param int attempt: Number of times the request was made, this one included
+        """
+        if response is not None:
+            self.stats.record_request(url, kind, response.status, response.elapsed, response.size)
+        else:
+            self.stats.record_request(url, kind)
+        retry = self.scheduler.finish(url, response, error, attempt)
+        if retry is not None:
+            logger.debug("Retrying %s in %.1f seconds", url, retry)
+            self.stats.record_retry()
+            return retry
+        if error is not None:
+            self._fail(url, kind, f"{type(error).__name__}: {error} after {attempt} attempts", type(error).__name__)
+        elif response.status >= HTTPStatus.BAD_REQUEST:
+            self._fail(url, kind, f"HTTP {response.status} after {attempt} attempts", f"HTTP {response.status}")
+        return None
+
+    def _validators(self, url):
+        """Returns the headers to revalidate a cached response, or the catalog
+        recorded in the previous snapshot, with
+        :param str url: URL about to be requested
+        """
+        if self.cache is not None:
+            return self.cache.validators(url, self.auth)
+        if self._reusable and url in self.previous.catalogs and url not in self._partial:
+            record = self.previous.catalogs[url]
+            headers = {}
+            if record["etag"]:
+                headers["If-None-Match"] = record["etag"]
+            if record["last_modified"]:
+                headers["If-Modified-Since"] = record["last_modified"]
+            return headers
+        return None
+
+    def _request_call(self, url, kind):
+        """Returns the function that requests url and the positional and keyword
+        arguments to call it with. Catalogs are parsed by the function while they download.
+        :param str url: URL to request
+        :param str kind: "catalog" or "dataset"
+        """
+        if kind == "catalog":
+            args = (url, self.parser, self.auth, self._validators(url), self.scheduler.timeout)
+            return fetch_catalog, args, {"keep_body": self.cache is not None}
+        return fetch_xml, (url, self.auth, self._validators(url), self.scheduler.timeout), {}
+
+    def _content(self, url, response):
+        """Returns the body of a response, from the cache if it was not modified
+        :param str url: URL that was requested
+        :param XMLResponse response: The response, None if the request failed
+        """
+        if self.cache is None:
+            return response.body if response is not None else None
+        return self.cache.update(url, self.auth, response)
 
-        datasets = [x for x in datasets if x.id is not None]
-        # Load the metadata back into an Element object
-        for d in datasets:
-            if d.metadata:
-                d.metadata = etree.fromstring(d.metadata)
+    def _dataset(self, url, response):
+        """Returns the LeafDataset of a requested dataset document, its id None if it could not be read
+        :param str url: URL that was requested
+        :param XMLResponse response: The response
+        """
+        return LeafDataset.from_xml(url, self._content(url, response))
 
-        self.datasets = datasets
+    def _finalize(self, dataset):
+        """Returns the dataset, or None if it could not be resolved
+        :param LeafDataset dataset: A resolved dataset
+        """
+        if dataset is None or dataset.id is None:
+            return None
+        dataset._auth = self.auth  # noqa: SLF001
+        if self.snapshot is not None:
+            self.snapshot.add_dataset(dataset.to_dict())
+        self.stats.record_dataset(dataset)
+        return dataset
 
     def _get_catalog_url(self, url):
         """Returns the appropriate catalog URL by replacing html with xml in some
         cases
         :param str url: URL to the catalog
         """
-        u = urlparse.urlsplit(url)
-        name, ext = os.path.splitext(u.path)
-        if ext == ".html":
-            u = urlparse.urlsplit(url.replace(".html", ".xml"))
-        url = u.geturl()
-        return url
+        return get_catalog_url(url)
 
-    def _yield_leaves(self, url, tree):
-        """Yields a URL corresponding to a leaf dataset for each dataset described by the catalog
-        :param str url: URL for the current catalog
-        :param lxml.etree.Element tree: Current XML Tree
-        """
-        for leaf in tree.findall(".//{%s}dataset[@urlPath]" % INV_NS):
-            # Subset by the skips
-            name = leaf.get("name")
-            if any([x.match(name) for x in self.skip]):
-                logger.info(
-                    "Skipping dataset based on 'skips'.  Name: %s" % name,
-                )
-                continue
-
-            # Subset by before and after
-            date_tag = leaf.find('.//{%s}date[@type="modified"]' % INV_NS)
-            if date_tag is not None:
-                try:
-                    dt = parse(date_tag.text)
-                except ValueError:
-                    logger.error(
-                        "Skipping dataset.Wrong date string %s " % date_tag.text,
-                    )
-                    continue
-                else:
-                    dt = dt.replace(tzinfo=pytz.utc)
-                if self.after and dt < self.after:
+    def _run(self, url):
+        """Crawls the catalog references from a frontier using the worker pool
+        and yields a LeafDataset for each dataset found. The references and
+        leaves of each catalog are handed over in batches while it is parsed,
+        so workers never wait on catalogs other than the ones they fetch, and
+        datasets that need their own request are resolved alongside the catalogs.
+        :param str url: URL for the root catalog
+        """
+        frontier = Frontier(self.order, self.priority)
+        # The workers put the batches in the queue themselves, before their outcome
+        manager = mp.Manager()
+        pending = _Requests(manager.Queue())
+        try:
+            yield from self._start(url, frontier, pending)
+            while len(frontier) or len(pending):
+                if self.budget is not None and self.budget.expired():
+                    break
+                self._fill(frontier, pending)
+                wait = self._send(pending)
+                if not len(pending):
                     continue
-                if self.before and dt > self.before:
+                try:
+                    request, response, error = pending.done.get(timeout=wait)
+                except queue.Empty:
                     continue
+                yield from self._handle(request, response, error, frontier, pending)
+        finally:
+            # Free the places of the requests abandoned when the crawl is cut short
+            for u in pending.in_flight.elements():
+                self.scheduler.cancel(u)
+            manager.shutdown()
 
-            # Subset by the Selects defined
-            gid = leaf.get("ID")
-            if self.select is not None:
-                if gid is not None and any(
-                    [x.match(gid) for x in self.select],
-                ):
-                    logger.debug("Processing %s" % gid)
-                    yield "%s?dataset=%s" % (url, gid)
+    def _start(self, url, frontier, pending):
+        """Adds the root catalog to the frontier, or picks up the requests that were
+        not handled when a resumed crawl stopped and yields the datasets it found
+        :param str url: URL for the root catalog
+        :param Frontier frontier: Catalogs to crawl
+        :param _Requests pending: Requests of the crawl
+        """
+        if self._resumed:
+            for kind, u, depth in self.store.pending():
+                if kind == "catalog":
+                    frontier.push(u, depth)
                 else:
-                    logger.info(
-                        "Ignoring dataset based on 'selects'.  ID: %s" % gid,
-                    )
-                    continue
-            else:
-                logger.debug("Processing %s" % gid)
-                yield "%s?dataset=%s" % (url, gid)
+                    pending.add(("dataset", u, depth, 1))
+            for u, handled in self.store.progress().items():
+                # Stopped while the catalog was handed over, skip the batches handled already
+                pending.streams[u] = self._stream(handled)
+                self._partial.add(u)
+            for d in self.store.datasets():
+                yield LeafDataset.from_dict(d)
+        else:
+            url = self._get_catalog_url(url)
+            frontier.push(url)
+            self._visit(url)
+            self._pending("catalog", url, 0)
+            if self.store is not None:
+                self.store.commit()
 
-    def _compile_references(self, url, tree):
-        """Returns a list of catalog reference URLs for the current catalog
-        :param str url: URL for the current catalog
-        :param lxml.etree.Element tree: Current XML Tree
+    def _fill(self, frontier, pending):
+        """Moves catalogs from the frontier to the requests, keeping every worker busy
+        :param Frontier frontier: Catalogs to crawl
+        :param _Requests pending: Requests of the crawl
         """
-        references = []
-        for ref in tree.findall(".//{%s}catalogRef" % INV_NS):
-            # Check skips
-            title = ref.get("{%s}title" % XLINK_NS)
-            if any([x.match(title) for x in self.skip]):
-                logger.info(
-                    "Skipping catalogRef based on 'skips'.  Title: %s" % title,
+        while len(frontier) and pending.outstanding["catalog"] < self.workers * 2:
+            ref, depth = frontier.pop()
+            if self.budget is not None and not self.budget.take_catalog():
+                # Out of catalogs, let the requests in flight finish
+                self.stats.record_skip("max_catalogs")
+                while len(frontier):
+                    frontier.pop()
+                    self.stats.record_skip("max_catalogs")
+                return
+            logger.info("Crawling: %s", ref)
+            pending.add(("catalog", ref, depth, 1))
+
+    def _send(self, pending):
+        """Sends the waiting requests their host is ready for and returns the
+        seconds until the next request may be sent, None to wait for a response
+        :param _Requests pending: Requests of the crawl
+        """
+        now = time.monotonic()
+        wait = pending.due(now)
+        for host_requests in pending.waiting.values():
+            while host_requests:
+                kind, u, depth, attempt = host_requests[0]
+                delay = self.scheduler.delay(u)
+                if delay is None:
+                    host_requests.popleft()
+                    pending.outstanding[kind] -= 1
+                    self._fail(u, kind, "circuit open")
+                    self._processed(u)
+                    continue
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    break
+                host_requests.popleft()
+                self.scheduler.start(u)
+                pending.in_flight[u] += 1
+                func, args, kwds = self._request_call(u, kind)
+                request = (kind, u, depth, attempt)
+                if kind == "catalog":
+                    kwds["batches"] = functools.partial(put_batch, pending.done, request)
+                self.pool.apply_async(
+                    func,
+                    args=args,
+                    kwds=kwds,
+                    callback=lambda r, q=request: put_outcome(pending.done, (q, r, None)),
+                    error_callback=lambda e, q=request: put_outcome(pending.done, (q, None, e)),
                 )
+        remaining = self.budget.remaining() if self.budget is not None else None
+        if remaining is not None:
+            wait = remaining if wait is None else min(wait, remaining)
+        return wait
+
+    def _handle(self, request, response, error, frontier, pending):
+        """Handles the outcome of a request, or a CatalogBatch of a catalog being
+        parsed, and yields the datasets it led to
+        :param tuple request: The kind, URL, depth and attempt of the request
+        :param XMLResponse response: The response or CatalogBatch, None if the request raised
+        :param Exception error: The error raised by the request, if any
+        :param Frontier frontier: Catalogs to crawl
+        :param _Requests pending: Requests of the crawl
+        """
+        kind, ref, depth, attempt = request
+        if isinstance(response, CatalogBatch):
+            yield from self._batch(ref, depth, response, frontier, pending)
+            return
+        pending.in_flight[ref] -= 1
+        retry = self._outcome(ref, kind, response, error, attempt)
+        if retry is not None:
+            pending.retry((kind, ref, depth, attempt + 1), time.monotonic() + retry)
+            return
+        pending.outstanding[kind] -= 1
+        if error is not None or response.status >= HTTPStatus.BAD_REQUEST:
+            pending.streams.pop(ref, None)
+            self._processed(ref)
+            return
+
+        if kind == "dataset":
+            ds = self._dataset(ref, response)
+            if ds.id is None:
+                self._fail(ref, kind, "invalid XML")
+            self._processed(ref, [ds])
+            yield ds
+            return
+
+        found = self._expand(ref, depth, response, frontier, pending)
+        self._processed(ref, found)
+        yield from found
+
+    def _expand(self, url, depth, response, frontier, pending):
+        """Returns the datasets of a requested catalog that were not handed over in
+        batches while it was parsed, adding its references to the frontier and the
+        datasets that need their own request to the requests
+        :param str url: URL for the catalog
+        :param int depth: Depth of the catalog
+        :param XMLResponse response: The response
+        :param Frontier frontier: Catalogs to crawl
+        :param _Requests pending: Requests of the crawl
+        """
+        xml_content = self._content(url, response)
+        parsed = response.catalog
+        found = []
+        if parsed is None:
+            # Not sent or not valid XML, the catalog was not handed over while downloading
+            reused = self._unchanged(url, response) if url not in pending.streams else None
+            if reused is not None:
+                references, leaves = reused
+                self.stats.record_catalog(url, depth, references, leaves)
+                return self._found(depth, references, leaves, frontier, pending)
+            if xml_content is not None:
+                for parsed in self.parser.iter_batches(url, iter_chunks(xml_content)):
+                    if not isinstance(parsed, CatalogBatch):
+                        break
+                    found += self._batch(url, depth, parsed, frontier, pending)
+            if parsed is None:
+                pending.streams.pop(url, None)
+                self._fail(url, "catalog", "invalid XML")
+                return found
+            response = response._replace(digest=parsed.digest)
+
+        stream = pending.streams.pop(url, None) or self._stream()
+        self.stats.record_parse(parsed)
+        if self.snapshot is not None:
+            self.snapshot.finish_catalog(url, response, response.digest)
+        self.stats.record_catalog(url, depth, stream.references, stream.leaves or [])
+        return found
+
+    def _batch(self, url, depth, batch, frontier, pending):
+        """Handles a CatalogBatch of a catalog being parsed and yields the datasets it
+        holds. Batches handled already, sent again when the request is retried, are skipped.
+        :param str url: URL for the catalog
+        :param int depth: Depth of the catalog
+        :param CatalogBatch batch: The batch
+        :param Frontier frontier: Catalogs to crawl
+        :param _Requests pending: Requests of the crawl
+        """
+        stream = pending.streams.setdefault(url, self._stream())
+        if batch.offset < stream.handled:
+            return
+        stream.handled += len(batch.references) + len(batch.leaves)
+        stream.references += batch.references
+        if stream.leaves is not None:
+            stream.leaves += batch.leaves
+        if self.snapshot is not None:
+            self.snapshot.extend_catalog(url, batch.references, self._ids(batch.leaves))
+        found = self._found(depth, batch.references, batch.leaves, frontier, pending)
+        if self.store is not None:
+            self.store.advance(url, stream.handled, [ds.to_dict() for ds in found if ds.id is not None])
+            self.store.checkpoint()
+        yield from found
+
+    def _stream(self, handled=0):
+        """Returns the state of a catalog about to be handed over in batches
+        :param int handled: Number of references and leaves handled already
+        """
+        # The leaves are only kept for the on_catalog hook
+        return _Stream(handled, leaves=self.stats.on_catalog is not None)
+
+    def _found(self, depth, references, leaves, frontier, pending):
+        """Returns the datasets among the leaves of a catalog, adding its references to
+        the frontier and the datasets that need their own request to the requests
+        :param int depth: Depth of the catalog
+        :param list references: catalogRef URLs of the catalog
+        :param list leaves: Leaves of the catalog (see CatalogParser.leaf)
+        :param Frontier frontier: Catalogs to crawl
+        :param _Requests pending: Requests of the crawl
+        """
+        found = []
+        for child in references:
+            if not self._follow(child, depth + 1):
                 continue
-            references.append(
-                construct_url(url, ref.get("{%s}href" % XLINK_NS)),
-            )
-        return references
+            settled = self._settled(child)
+            if settled is not None:
+                self.stats.record_skip("settled")
+                found += settled
+                continue
+            frontier.push(child, depth + 1)
+            self._pending("catalog", child, depth + 1)
 
-    def _run(self, url, auth):
-        """Performs a multiprocess depth-first-search of the catalog references
-        and yields a URL for each leaf dataset found
-        :param str url: URL for the current catalog
-        :param requests.auth.AuthBase auth: requests auth object to use
+        for ds in leaves:
+            if isinstance(ds, LeafDataset):
+                found.append(ds)
+            else:
+                pending.add(("dataset", ds, depth, 1))
+                self._pending("dataset", ds, depth)
+        return found
+
+    def _follow(self, url, depth):
+        """Returns True if a catalogRef is to be crawled, and records it as visited
+        :param str url: URL for the catalog
+        :param int depth: Depth of the catalog
         """
         if url in self.visited:
-            logger.debug("Skipping %s (already crawled)" % url)
-            return
-        self.visited.append(url)
+            logger.debug("Skipping %s (already crawled)", url)
+            self.stats.record_skip("visited")
+            return False
+        if self.budget is not None and not self.budget.allows(depth):
+            logger.debug("Skipping %s (deeper than %d)", url, self.budget.max_depth)
+            self.stats.record_skip("max_depth")
+            return False
+        self._visit(url)
+        return True
 
-        logger.info("Crawling: %s" % url)
-        url = self._get_catalog_url(url)
+    def _visit(self, url):
+        """Records a catalog URL as seen so it is crawled only once
+        :param str url: URL for the catalog
+        """
+        self.visited.add(url)
+        if self.store is not None:
+            self.store.visit(url)
 
-        # Get an etree object
-        xml_content = request_xml(url, auth)
-        for ds in self._build_catalog(url, xml_content):
-            yield ds
+    def _pending(self, kind, url, depth):
+        """Records a request about to be made in the store, if any
+        :param str kind: "catalog" or "dataset"
+        :param str url: URL to request
+        :param int depth: Depth of the catalog the request belongs to
+        """
+        if self.store is not None:
+            self.store.push(kind, url, depth)
 
-    def _build_catalog(self, url, xml_content):
-        """Recursive function to perform the DFS and yield the leaf datasets
+    def _processed(self, url, datasets=()):
+        """Records in the store, if any, that a request was handled along with the datasets it led to
+        :param str url: URL that was requested
+        :param list datasets: LeafDatasets found
+        """
+        if self.store is not None:
+            self.store.done(url, [ds.to_dict() for ds in datasets if ds.id is not None])
+            self.store.checkpoint()
+
+    def _catalog(self, url, response):
+        """Returns the catalog reference URLs and the leaves (see CatalogParser.leaf)
+        of a requested catalog, or None if it could not be parsed. Catalogs that
+        did not change since the previous snapshot are reused from it.
         :param str url: URL for the current catalog
-        :param str xml_content: XML Body returned from HTTP Request
+        :param XMLResponse response: The response, None if the request failed
         """
-        try:
-            tree = etree.XML(xml_content)
-        except BaseException:
-            return
+        xml_content = self._content(url, response)
+        reused = self._unchanged(url, response)
+        if reused is not None:
+            return reused
+        parsed = response.catalog if response is not None else None
+        if parsed is None and xml_content is not None:
+            # Revalidated from the cache, the catalog was not parsed while downloading
+            parsed = self.parser.parse(url, iter_chunks(xml_content))
+        if parsed is None:
+            self._fail(url, "catalog", "invalid XML")
+            return None
+        self.stats.record_parse(parsed)
+        if self.snapshot is not None:
+            self.snapshot.add_catalog(url, response, parsed.digest, parsed.references, self._ids(parsed.leaves))
+        return parsed.references, parsed.leaves
 
-        # Get a list of URLs
-        references = self._compile_references(url, tree)
-        # Using multiple processes, make HTTP requests for each child catalog
-        jobs = [self.pool.apply_async(request_xml, args=(ref,)) for ref in references]
-        responses = [j.get() for j in jobs]
+    def _unchanged(self, url, response):
+        """Returns the catalog reference URLs and the datasets of a catalog that did
+        not change since the previous snapshot, reused from it, or None if it changed
+        :param str url: URL for the current catalog
+        :param XMLResponse response: The response, None if the request failed
+        """
+        digest = response.digest if response is not None else None
+        if not self._reusable or not self.previous.unchanged(url, response, digest):
+            return None
+        logger.debug("Reusing %s (not modified)", url)
+        record = self.snapshot.reuse_catalog(self.previous, url)
+        return record["references"], self._reused(record)
 
-        # This is essentially the graph traversal step
-        for i, response in enumerate(responses):
-            for ds in self._build_catalog(references[i], response):
-                yield ds
+    def _ids(self, leaves):
+        """Returns the dataset IDs of the leaves of a catalog
+        :param list leaves: Leaves of the catalog (see CatalogParser.leaf)
+        """
+        return [ds.id if isinstance(ds, LeafDataset) else ds.split("?dataset=", 1)[1] for ds in leaves]
 
-        # Yield the leaves
-        for ds in self._yield_leaves(url, tree):
-            yield ds
+    def _reused(self, record):
+        """Returns the datasets of a catalog recorded in the previous snapshot
+        :param dict record: The catalog record
+        """
+        return [LeafDataset.from_dict(self.previous.datasets[gid]) for gid in record["datasets"] if gid in self.previous.datasets]
+
+    def _settled(self, url):
+        """Returns the datasets of the catalog subtree starting at url from the
+        previous snapshot if none of them were modified within settle_after,
+        otherwise None
+        :param str url: URL for the catalog at the top of the subtree
+        """
+        if not self._reusable or self.settle_after is None:
+            return None
+        urls = self.previous.settled(url, datetime.now(pytz.utc) - self.settle_after)
+        if urls is None:
+            return None
+        logger.debug("Reusing %s and %d catalogs below it (settled)", url, len(urls) - 1)
+        datasets = []
+        for u in urls:
+            self._visit(u)
+            datasets += self._reused(self.snapshot.reuse_catalog(self.previous, u))
+        return datasets
+
+
+def crawl_iter(catalog_url, **kwargs: object):
+    """Crawls a catalog and yields each LeafDataset as soon as it is resolved
+    :param str catalog_url: URL of the catalog to start from
+    :param kwargs: Any Crawl parameter
+    """
+    return Crawl(catalog_url, lazy=True, **kwargs).iter_datasets()
+
+
+class Crawler:
+    """A crawl engine to reuse for many crawls.
+
+    The worker pool is started once and kept running between crawls, and each
+    worker keeps its HTTP session (and with it a pool of keep-alive connections
+    per host) for as long as the engine is open. Any Crawl parameter given to
+    the engine is used as the default of every crawl.
+
+    Use it as a context manager, or call ``close`` when done::
+
+        with Crawler(workers=8) as crawler:
+            for url in urls:
+                datasets = crawler.crawl(url).datasets
+    """
+
+    def __init__(self, workers=None, **defaults: object):
+        """:param int workers: Number of worker processes
+        :param defaults: Crawl parameters applied to every crawl, such as auth, skip or scheduler
+        """
+        self.workers = workers or 4
+        self.defaults = defaults
+        self.pool = mp.Pool(processes=self.workers)
+        self.closed = False
+
+    def crawl(self, catalog_url, **kwargs: object):
+        """Crawls a catalog and returns the finished Crawl
+        :param str catalog_url: URL of the catalog to start from
+        :param kwargs: Any Crawl parameter, overriding the defaults of the engine
+        """
+        return self._crawl(catalog_url, kwargs, lazy=False)
+
+    def crawl_iter(self, catalog_url, **kwargs: object):
+        """Crawls a catalog and yields each LeafDataset as soon as it is resolved
+        :param str catalog_url: URL of the catalog to start from
+        :param kwargs: Any Crawl parameter, overriding the defaults of the engine
+        """
+        return self._crawl(catalog_url, kwargs, lazy=True).iter_datasets()
+
+    def _crawl(self, catalog_url, kwargs, *, lazy):
+        if self.closed:
+            msg = "The crawler is closed"
+            raise ValueError(msg)
+        options = dict(self.defaults, **kwargs)
+        return Crawl(catalog_url, workers=self.workers, pool=self.pool, lazy=lazy, **options)
+
+    def close(self):
+        """Stops the worker pool"""
+        if not self.closed:
+            self.closed = True
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc: object):
+        self.close()
 
 
 class LeafDataset:
-    def __init__(self, dataset_url, auth=None):
-        self.services = []
+    """A dataset found by a crawl.
+
+    Datasets are kept small so millions of them fit in memory: the attributes
+    are slots, the services are slotted Services with interned names and types,
+    and the metadata is kept as XML bytes until ``metadata`` is first read.
+    """
+
+    __slots__ = ("_auth", "_metadata", "catalog_url", "data_size", "id", "modified", "name", "services")
+
+    def __init__(self, dataset_url=None, auth=None, timeout=60):
+        self.services = ()
         self.id = None
         self.name = None
         self.catalog_url = None
         self.data_size = None
+        self.modified = None
+        self._metadata = None
+        # Credentials of the server the dataset was found on, to request its DDS with
+        self._auth = auth
+
+        if dataset_url is None:
+            return
 
         # Get an etree object
-        r = requests.get(dataset_url, auth=auth, verify=False)
+        r = session().get(dataset_url, auth=auth, headers=request_headers(), verify=False, timeout=timeout)
+        self._parse(dataset_url, r.content)
+
+    @property
+    def metadata(self):
+        """The metadata of the dataset as an etree Element, parsed on first access"""
+        if isinstance(self._metadata, bytes):
+            self._metadata = etree.fromstring(self._metadata)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
+
+    def metadata_bytes(self):
+        """Returns the metadata as XML bytes, without parsing it if it was not parsed yet"""
+        if self._metadata is None or isinstance(self._metadata, bytes):
+            return self._metadata
+        return etree.tostring(self._metadata)
+
+    def __getstate__(self):
+        # Element objects are not picklable, send the metadata as bytes
+        # Credentials are not sent along, the crawl sets them on the datasets it returns
+        state = {k: getattr(self, k) for k in self.__slots__ if k not in ("_metadata", "_auth")}
+        state["_metadata"] = self.metadata_bytes()
+        return state
+
+    def __setstate__(self, state):
+        self._auth = None
+        for k, v in state.items():
+            setattr(self, k, v)
+        # Strings unpickled in the parent are not interned, share them again
+        self.catalog_url = interned(self.catalog_url)
+        self.services = tuple(Service(interned(s.name), interned(s.service), s.url) for s in self.services)
+
+    def to_dict(self):
+        """Returns the dataset as a JSON serializable dict"""
+        metadata = self.metadata_bytes()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "catalog_url": self.catalog_url,
+            "data_size": self.data_size,
+            "modified": self.modified.isoformat() if self.modified is not None else None,
+            "services": [dict(s) for s in self.services],
+            "metadata": metadata.decode("utf-8") if metadata is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, d) -> "LeafDataset":
+        """Returns a LeafDataset from a dict returned by to_dict
+        :param dict d: The dataset as a dict
+        """
+        leaf = cls()
+        leaf.id = d["id"]
+        leaf.name = d["name"]
+        leaf.catalog_url = interned(d["catalog_url"])
+        leaf.data_size = d["data_size"]
+        leaf.modified = parse(d["modified"]) if d["modified"] is not None else None
+        leaf.services = tuple(Service(interned(s["name"]), interned(s["service"]), s["url"]) for s in d["services"])
+        leaf.metadata = d["metadata"].encode("utf-8") if d["metadata"] is not None else None
+        return leaf
+
+    @classmethod
+    def from_xml(cls, dataset_url, xml_content) -> "LeafDataset":
+        """Returns a LeafDataset built from an already requested dataset document
+        :param str dataset_url: URL the dataset document was requested from
+        :param bytes xml_content: XML Body returned from HTTP Request
+        """
+        leaf = cls()
+        if xml_content is None:
+            logger.error("Error processing %s, no XML", dataset_url)
+        else:
+            leaf._parse(dataset_url, xml_content)
+        return leaf
+
+    def _parse(self, dataset_url, xml_content):
+        """Populates the dataset from a dataset document
+        :param str dataset_url: URL the dataset document was requested from
+        :param bytes xml_content: XML Body returned from HTTP Request
+        """
         try:
-            tree = etree.XML(r.text.encode("utf-8"))
+            tree = etree.XML(xml_content)
         except etree.XMLSyntaxError:
-            logger.error("Error processing %s, invalid XML" % dataset_url)
+            logger.error("Error processing %s, invalid XML", dataset_url)
         else:
             try:
-                dataset = tree.find("{%s}dataset" % INV_NS)
-                self.id = dataset.get("ID")
-                self.name = dataset.get("name")
-                metadata = dataset.find("{%s}metadata" % INV_NS)
-                self.catalog_url = dataset_url.split("?")[0]
-
-                # Data Size - http://www.unidata.ucar.edu/software/thredds/current/tds/catalog/InvCatalogSpec.html#dataSize
-                data_size = dataset.find("{%s}dataSize" % INV_NS)
-                if data_size is not None:
-                    self.data_size = float(data_size.text)
-                    data_units = data_size.get("units")
-                    # Convert to MB
-                    if data_units == "bytes":
-                        self.data_size *= 1e-6
-                    elif data_units == "Kbytes":
-                        self.data_size *= 0.001
-                    elif data_units == "Gbytes":
-                        self.data_size /= 0.001
-                    elif data_units == "Tbytes":
-                        self.data_size /= 1e-6
-
-                # Services
-                service_tag = dataset.find("{%s}serviceName" % INV_NS)
-                if service_tag is None:
-                    if metadata is not None:
-                        service_tag = metadata.find("{%s}serviceName" % INV_NS)
-
-                if service_tag is None:
-                    # Use services found in the file. FMRC aggs do this.
-                    services = tree.findall(
-                        ".//{%s}service[@serviceType='Compound']" % INV_NS,
-                    )
-                else:
-                    # Use specific named services
-                    services = tree.findall(
-                        ".//{%s}service[@name='%s']" % (INV_NS, service_tag.text),
-                    )
-
-                for service in services:
-                    if service.get("serviceType") == "Compound":
-                        for s in service.findall("{%s}service" % INV_NS):
-                            url = construct_url(
-                                dataset_url,
-                                s.get("base"),
-                            ) + dataset.get("urlPath")
-                            if s.get("suffix") is not None:
-                                url += s.get("suffix")
-                            # ISO like services need additional parameters
-                            if s.get("name") in ["iso", "ncml", "uddc"]:
-                                url += "?dataset=%s&catalog=%s" % (
-                                    self.id,
-                                    quote_plus(self.catalog_url),
-                                )
-                            self.services.append(
-                                {
-                                    "name": s.get("name"),
-                                    "service": s.get("serviceType"),
-                                    "url": url,
-                                },
-                            )
-                    else:
-                        url = construct_url(dataset_url, service.get("base")) + dataset.get("urlPath") + service.get("suffix", "")
-                        # ISO like services need additional parameters
-                        if service.get("name") in ["iso", "ncml", "uddc"]:
-                            url += "?dataset=%s&catalog=%s" % (
-                                self.id,
-                                quote_plus(self.catalog_url),
-                            )
-                        self.services.append(
-                            {
-                                "name": service.get("name"),
-                                "service": service.get("serviceType"),
-                                "url": url,
-                            },
-                        )
-
-                # Element objects are not pickable to save as a string
-                try:
-                    self.metadata = etree.tostring(metadata)
-                except TypeError:
-                    self.metadata = None
-            except BaseException as e:
-                logger.exception(f"Could not process {dataset_url}. {e}.")
+                dataset = tree.find(f"{{{INV_NS}}}dataset")
+                self._load(
+                    dataset_url,
+                    tree,
+                    dataset,
+                    dataset.find(f"{{{INV_NS}}}metadata"),
+                )
+            except Exception:
+                logger.exception("Could not process %s", dataset_url)
+
+    @classmethod
+    def from_catalog(cls, catalog_url, tree, dataset, inherited=None) -> "LeafDataset":
+        """Returns a LeafDataset built from a dataset element of an already parsed
+        catalog, or None if the catalog does not describe any of its services
+        :param str catalog_url: URL for the catalog the dataset is listed in
+        :param lxml.etree.Element tree: XML Tree of the catalog
+        :param lxml.etree.Element dataset: The dataset element
+        :param tuple inherited: The metadata element and XML of a dataset without metadata
+            of its own, shared with the other datasets of its parent (see CatalogParser.inherited)
+        """
+        if dataset.get("ID") is None:
+            return None
+        dataset_url = "{}?dataset={}".format(catalog_url, dataset.get("ID"))
+        metadata, serialized = inherited if inherited is not None else (inherited_metadata(dataset), None)
+        leaf = cls()
+        try:
+            leaf._load(dataset_url, tree, dataset, metadata, serialized, compound=False)
+        except Exception:
+            logger.debug("Could not process %s inline", dataset_url, exc_info=True)
+            return None
+        if not leaf.services:
+            return None
+        return leaf
+
+    def _load(self, dataset_url, tree, dataset, metadata, serialized=None, *, compound=True):  # noqa: PLR0913
+        """Populates the dataset from its XML
+        :param str dataset_url: URL for the dataset
+        :param lxml.etree.Element tree: XML Tree holding the service definitions
+        :param lxml.etree.Element dataset: The dataset element
+        :param lxml.etree.Element metadata: The metadata that applies to the dataset
+        :param bytes serialized: The metadata as XML if it was already serialized
+        :param bool compound: Use the Compound services of the tree if the dataset names no service (see _services)
+        """
+        self.id = dataset.get("ID")
+        self.name = dataset.get("name")
+        self.catalog_url = interned(dataset_url.split("?")[0])
+
+        self.data_size = data_size_mb(dataset, metadata)
+        self.modified = modified_date(dataset_url, dataset, metadata)
+        self.services = tuple(self._services(dataset_url, tree, dataset, metadata, compound=compound))
+
+        # Element objects are not pickable to save as a string
+        if serialized is not None:
+            self.metadata = serialized
+            return
+        try:
+            self.metadata = etree.tostring(metadata)
+        except TypeError:
+            self.metadata = None
+
+    def _services(self, dataset_url, tree, dataset, metadata, *, compound=True):
+        """Yields the Services of the dataset
+        :param str dataset_url: URL for the dataset
+        :param lxml.etree.Element tree: XML Tree holding the service definitions
+        :param lxml.etree.Element dataset: The dataset element
+        :param lxml.etree.Element metadata: The metadata that applies to the dataset
+        :param bool compound: Use the Compound services of the tree if the dataset names no service.
+            Only a document served for a single dataset lists just the services of that dataset,
+            a catalog lists the services of all of its datasets.
+        """
+        name = service_name(dataset, metadata)
+        if name is None and not compound:
+            return
+        if name is None:
+            # Use services found in the file. FMRC aggs do this.
+            services = tree.findall(f".//{{{INV_NS}}}service[@serviceType='Compound']")
+        else:
+            # Use specific named services
+            services = tree.findall(f".//{{{INV_NS}}}service[@name='{name}']")
+
+        for service in services:
+            members = service.findall(f"{{{INV_NS}}}service") if service.get("serviceType") == "Compound" else [service]
+            for s in members:
+                url = construct_url(dataset_url, s.get("base")) + dataset.get("urlPath") + s.get("suffix", "")
+                # ISO like services need additional parameters
+                if s.get("name") in {"iso", "ncml", "uddc"}:
+                    url += f"?dataset={self.id}&catalog={quote_plus(self.catalog_url)}"
+                yield Service(interned(s.get("name")), interned(s.get("serviceType")), url)
 
     @property
     def size(self):
+        """Size of the dataset in megabytes: the dataSize of the catalog or, failing that,
+        the size of its variables computed from the OPeNDAP DDS (see dap.dataset_size).
+        None if it can not be computed.
+        """
         if self.data_size is not None:
             return self.data_size
-        try:
-            dap_endpoint = next(s.get("url") for s in self.services if s.get("service").lower() == "opendap")
-            # Get sizes from DDS
-            try:
-                import netCDF4
-
-                nc = netCDF4.Dataset(dap_endpoint)
-                bites = 0
-                for vname in nc.variables:
-                    var = nc.variables.get(vname)
-                    bites += var.dtype.itemsize * var.size
-                return bites * 1e-6  # Megabytes
-            except ImportError:
-                logger.error(
-                    "The python-netcdf4 library is required for computing the size of this dataset.",
-                )
-                return None
-        except StopIteration:
+        endpoint = dap.dap_endpoint(self)
+        if endpoint is None:
             return None  # We can't calculate
+        return dap.dataset_size(endpoint, self._auth)
 
     def __repr__(self):
-        return "<LeafDataset id: %s, name: %s, services: %s>" % (
+        return "<LeafDataset id: {}, name: {}, services: {}>".format(
             self.id,
             self.name,
             str([s.get("service") for s in self.services]),
@@ -0,0 +1,259 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from thredds_crawler.utils import request_headers, session
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None  # noqa: N816
+
+logger = logging.getLogger(__name__)
+
+# Bytes per value of the DAP 2 base types. Strings and URLs have no fixed size and are not counted.
+TYPE_SIZES = {
+    "byte": 1,
+    "int8": 1,
+    "uint8": 1,
+    "int16": 2,
+    "uint16": 2,
+    "int32": 4,
+    "uint32": 4,
+    "int64": 8,
+    "uint64": 8,
+    "float32": 4,
+    "float64": 8,
+    "string": 0,
+    "url": 0,
+}
+
+TOKEN = re.compile(r"\s*([{}\[\]=;:]|[^\s{}\[\]=;:]+)")
+
+# Number of endpoints whose size is remembered, the least recently used being forgotten first
+MEMORY_SIZE = 10000
+
+_sizes = OrderedDict()
+_lock = threading.Lock()
+
+
+class DDSError(ValueError):
+    """Raised when a DDS can not be parsed"""
+
+
+def tokenize(dds):
+    """Returns the tokens of a DDS
+    :param str dds: The DDS text
+    """
+    return TOKEN.findall(dds)
+
+
+class DDSParser:
+    """Computes the size of the variables described by a DAP 2 DDS.
+
+    The size is the sum over every array of the size of its type times the
+    number of values, the same as netCDF4 reports: Grids count their array
+    but not their maps (which are listed as variables of their own),
+    Structures count their members once per element and Sequences, having
+    no known length, are not counted.
+    """
+
+    def __init__(self, dds):
+        """:param str dds: The DDS text"""
+        self.tokens = tokenize(dds)
+        self.position = 0
+
+    def parse(self):
+        """Returns the size of the dataset in bytes"""
+        self.expect("Dataset")
+        size = self.declarations()
+        self.expect("}")
+        self.name()
+        self.expect(";")
+        return size
+
+    def peek(self):
+        if self.position >= len(self.tokens):
+            msg = "Unexpected end of the DDS"
+            raise DDSError(msg)
+        return self.tokens[self.position]
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, expected):
+        token = self.next()
+        if token.lower() != expected.lower():
+            msg = f"Expected {expected}, found {token}"
+            raise DDSError(msg)
+
+    def name(self):
+        name = self.next()
+        if name in "{}[]=;:":
+            msg = f"Expected a name, found {name}"
+            raise DDSError(msg)
+        return name
+
+    def declarations(self):
+        """Reads declarations up to the closing brace and returns their size"""
+        self.expect("{")
+        size = 0
+        while self.peek() != "}":
+            size += self.declaration()
+        return size
+
+    def declaration(self):
+        """Reads a declaration and returns its size"""
+        kind = self.next().lower()
+        if kind == "structure":
+            size = self.declarations()
+            self.expect("}")
+            return size * self.variable()
+        if kind == "sequence":
+            self.declarations()
+            self.expect("}")
+            self.variable()
+            return 0
+        if kind == "grid":
+            self.expect("{")
+            self.expect("ARRAY")
+            self.expect(":")
+            size = self.declaration()
+            self.expect("MAPS")
+            self.expect(":")
+            while self.peek() != "}":
+                self.declaration()
+            self.expect("}")
+            self.variable()
+            return size
+        if kind not in TYPE_SIZES:
+            msg = f"Unknown type {kind}"
+            raise DDSError(msg)
+        return TYPE_SIZES[kind] * self.variable()
+
+    def variable(self):
+        """Reads a variable name with its dimensions and returns the number of values"""
+        self.name()
+        count = 1
+        while self.peek() == "[":
+            self.next()
+            length = self.next()
+            if self.peek() == "=":
+                self.next()
+                length = self.next()
+            self.expect("]")
+            try:
+                count *= int(length)
+            except ValueError:
+                msg = f"Invalid dimension length {length}"
+                raise DDSError(msg) from None
+        self.expect(";")
+        return count
+
+
+def parse_dds(dds):
+    """Returns the size in bytes of the variables described by a DDS. Raises DDSError if it can not be parsed.
+    :param str dds: The DDS text
+    """
+    return DDSParser(dds).parse()
+
+
+def dap_endpoint(dataset):
+    """Returns the OPeNDAP URL of a LeafDataset, None if it has none
+    :param LeafDataset dataset: The dataset
+    """
+    return next((s.get("url") for s in dataset.services if (s.get("service") or "").lower() == "opendap"), None)
+
+
+def dataset_size(endpoint, auth=None, timeout=60):
+    """Returns the size in megabytes of the variables of an OPeNDAP dataset,
+    or None if it can not be computed. The size is computed from the DDS,
+    falling back to opening the dataset with netCDF4 when it is installed,
+    and remembered for the endpoint (see MEMORY_SIZE).
+    :param str endpoint: OPeNDAP URL of the dataset
+    :param requests.auth.AuthBase auth: requests auth object to use
+    :param float timeout: Seconds to wait for the server to respond
+    """
+    with _lock:
+        if endpoint in _sizes:
+            _sizes.move_to_end(endpoint)
+            return _sizes[endpoint]
+
+    size = None
+    try:
+        r = session().get(endpoint + ".dds", auth=auth, headers=request_headers(), verify=False, timeout=timeout)
+        r.raise_for_status()
+        size = parse_dds(r.text) * 1e-6
+    except (requests.RequestException, DDSError) as e:
+        logger.debug("Could not compute the size of %s from its DDS. %s", endpoint, e)
+        size = netcdf_size(endpoint)
+
+    if size is not None:
+        with _lock:
+            _sizes[endpoint] = size
+            while len(_sizes) > MEMORY_SIZE:
+                _sizes.popitem(last=False)
+    return size
+
+
+def netcdf_size(endpoint):
+    """Returns the size in megabytes of the variables of an OPeNDAP dataset opened with netCDF4,
+    or None if netCDF4 is not installed or the dataset can not be opened
+    :param str endpoint: OPeNDAP URL of the dataset
+    """
+    if netCDF4 is None:
+        logger.error(
+            "The python-netcdf4 library is required for computing the size of this dataset.",
+        )
+        return None
+    try:
+        with netCDF4.Dataset(endpoint) as nc:
+            bites = 0
+            for vname in nc.variables:
+                var = nc.variables.get(vname)
+                bites += var.dtype.itemsize * var.size
+    except (OSError, RuntimeError):
+        logger.exception("Could not open %s", endpoint)
+        return None
+    return bites * 1e-6  # Megabytes
+
+
+def resolve_sizes(datasets, workers=8, auth=None, timeout=60):
+    """Computes the size of many datasets concurrently and returns a dict of
+    the sizes in megabytes by dataset ID. Datasets without a dataSize in their
+    catalog have their OPeNDAP DDS requested, once per endpoint.
+    :param list datasets: LeafDatasets
+    :param int workers: Number of requests in flight at once
+    :param requests.auth.AuthBase auth: requests auth object to use
+    :param float timeout: Seconds to wait for a server to respond
+    """
+    sizes = {}
+    missing = {}
+    for d in datasets:
+        if d.data_size is not None:
+            sizes[d.id] = d.data_size
+            continue
+        endpoint = dap_endpoint(d)
+        if endpoint is None:
+            sizes[d.id] = None
+        else:
+            missing.setdefault(endpoint, []).append(d)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        endpoints = list(missing)
+        for endpoint, size in zip(endpoints, executor.map(lambda e: dataset_size(e, auth, timeout), endpoints)):
+            for d in missing[endpoint]:
+                sizes[d.id] = size
+    return sizes
+
+
+def clear():
+    """Forgets every size computed so far"""
+    with _lock:
+        _sizes.clear()
@@ -0,0 +1,257 @@
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+import contextlib
+import logging
+import re
+from datetime import datetime, timedelta
+
+import pytz
+
+from thredds_crawler.utils import INV_NS, XLINK_NS, parse_datetime, parse_duration
+
+logger = logging.getLogger(__name__)
+
+# Backreferences and conditional groups are numbered per pattern and would point
+# at the wrong group once combined, and global inline flags would apply to every pattern
+UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)")
+
+# Path segments (2016/, 2016/01/, 2016/01/10/, 20160110/, 2016-01/...) and
+# catalogRef titles (2016, 2016-01, 20160110...) naming the period a catalog covers
+DATE_PATTERNS = [
+    r"/(?P<year>(?:19|20)\d{2})(?:/(?P<month>0[1-9]|1[0-2])(?:/(?P<day>0[1-9]|[12]\d|3[01]))?)?/",
+    r"/(?P<year>(?:19|20)\d{2})-?(?P<month>0[1-9]|1[0-2])(?:-?(?P<day>0[1-9]|[12]\d|3[01]))?/",
+    r"^(?P<year>(?:19|20)\d{2})(?:[-/]?(?P<month>0[1-9]|1[0-2])(?:[-/]?(?P<day>0[1-9]|[12]\d|3[01]))?)?$",
+]
+
+
+def date_span(texts, patterns):
+    """Returns the ``(start, end)`` UTC datetimes of the most precise period
+    (a year, month or day) named by any of texts, or None if none names one
+    :param list texts: Strings to look for dates in, None values are ignored
+    :param list patterns: Compiled regular expressions with a ``year`` and optional
+        ``month`` and ``day`` named groups
+    """
+    best = None
+    for text in texts:
+        if not text:
+            continue
+        for pattern in patterns:
+            m = pattern.search(text)
+            if m is None:
+                continue
+            groups = m.groupdict()
+            try:
+                year = int(groups["year"])
+                month = int(groups.get("month") or 0)
+                day = int(groups.get("day") or 0)
+                if day:
+                    precision, start = 3, datetime(year, month, day, tzinfo=pytz.utc)
+                    end = start + timedelta(days=1)
+                elif month:
+                    precision, start = 2, datetime(year, month, 1, tzinfo=pytz.utc)
+                    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=pytz.utc)
+                else:
+                    precision = 1
+                    start, end = datetime(year, 1, 1, tzinfo=pytz.utc), datetime(year + 1, 1, 1, tzinfo=pytz.utc)
+            except (KeyError, TypeError, ValueError):
+                # No year, or not a real date such as February 30th
+                continue
+            if best is None or precision > best[0]:
+                best = (precision, start, end)
+    if best is None:
+        return None
+    return best[1], best[2]
+
+
+def time_coverage(element):
+    """Returns the ``(start, end)`` UTC datetimes of the timeCoverage of a
+    dataset or catalogRef, or None if it has none or it can not be read
+    :param lxml.etree.Element element: The dataset or catalogRef element
+    """
+    coverage = element.find(f"{{{INV_NS}}}timeCoverage")
+    if coverage is None:
+        coverage = element.find(f"{{{INV_NS}}}metadata/{{{INV_NS}}}timeCoverage")
+    if coverage is None:
+        return None
+
+    def read(tag):
+        text = coverage.findtext(f"{{{INV_NS}}}{tag}")
+        if text is None:
+            return None
+        if text.strip() == "present":
+            return datetime.now(pytz.utc)
+        return parse_datetime(text)
+
+    try:
+        start, end = read("start"), read("end")
+        duration = coverage.findtext(f"{{{INV_NS}}}duration")
+        if start is not None and end is None and duration is not None:
+            end = start + parse_duration(duration)
+        elif end is not None and start is None and duration is not None:
+            start = end - parse_duration(duration)
+    except (ValueError, OverflowError):
+        return None
+    if start is None or end is None:
+        return None
+    return start, end
+
+
+def combine(patterns):
+    """Returns a single compiled regular expression matching wherever any of
+    patterns matches, or None if they can not be combined
+    :param list patterns: Compiled regular expressions
+    """
+    if not patterns:
+        return None
+    flags = {p.flags for p in patterns}
+    if len(flags) > 1 or any(UNCOMBINABLE.search(p.pattern) for p in patterns):
+        return None
+    try:
+        return re.compile("|".join(f"(?:{p.pattern})" for p in patterns), flags.pop())
+    except re.error:
+        # Named groups used in more than one pattern, inline flags not at the start...
+        return None
+
+
+def reject(rejected, kind, rule):
+    """Counts a catalogRef or dataset left out by a rule
+    :param Counter rejected: The counts, nothing is counted if None
+    :param str kind: "catalogRef" or "dataset"
+    :param str rule: The rule, such as "skip"
+    """
+    if rejected is not None:
+        rejected[(kind, rule)] += 1
+
+
+class PatternSet:
+    """Matches strings against a list of regular expressions at once.
+
+    The patterns are combined into one alternation so a string is scanned a
+    single time, falling back to trying them one by one when they can not be
+    combined. Like ``re.match``, the patterns are anchored at the start.
+    """
+
+    def __init__(self, patterns):
+        """:param list patterns: Regular expressions, as strings or compiled"""
+        self.patterns = [re.compile(p) for p in patterns]
+        self._combined = combine(self.patterns)
+
+    def match(self, value):
+        """Returns True if any of the patterns matches value
+        :param str value: The string to match, never matched if None
+        """
+        if value is None:
+            return False
+        if self._combined is not None:
+            return self._combined.match(value) is not None
+        return any(p.match(value) for p in self.patterns)
+
+    def __len__(self):
+        return len(self.patterns)
+
+
+class DatasetFilter:
+    """Decides which catalogRefs are followed and which datasets are kept.
+
+    Datasets are checked from the cheapest test to the most expensive one:
+    the skips on their name, the selects on their ID, the modified date
+    (datasets whose modified date can not be read are always left out) and
+    last any user supplied predicates, each called with the dataset element
+    and returning False to leave the dataset out.
+
+    With ``prune``, catalogRefs covering a period entirely outside of the
+    ``before``/``after`` window are not followed. The period is read from the
+    timeCoverage of the catalogRef or, failing that, from date patterns in its
+    title and URL (see DATE_PATTERNS). This assumes the datasets of a date
+    partitioned catalog were modified within the period the catalog covers.
+    """
+
+    def __init__(self, select=None, skip=None, before=None, after=None, predicates=None, prune=None):  # noqa: PLR0913, PLR0917
+        """:param list select: Regular expressions of the dataset IDs to keep, every dataset if None
+        :param list skip: Regular expressions of the dataset names and catalogRef titles to skip
+        :param datetime before: Only keep datasets modified before this (UTC)
+        :param datetime after: Only keep datasets modified after this (UTC)
+        :param list predicates: Callables taking a dataset element and returning False to skip it
+        :param prune: True to prune catalogRefs using DATE_PATTERNS, or a list of regular
+            expressions with ``year`` and optional ``month`` and ``day`` named groups to use instead
+        """
+        self.select = PatternSet(select) if select is not None else None
+        self.skip = PatternSet(skip or [])
+        self.before = before
+        self.after = after
+        self.predicates = list(predicates or [])
+        if prune is True:
+            prune = DATE_PATTERNS
+        self.prune = [re.compile(p) for p in prune or []]
+
+    def accept_reference(self, ref, url=None, rejected=None):
+        """Returns True if a catalogRef should be followed
+        :param lxml.etree.Element ref: The catalogRef element
+        :param str url: URL the catalogRef points to
+        :param Counter rejected: Counts the ``("catalogRef", rule)`` of the catalogRefs not followed
+        """
+        title = ref.get(f"{{{XLINK_NS}}}title")
+        if self.skip.match(title):
+            logger.info("Skipping catalogRef based on 'skips'.  Title: %s", title)
+            reject(rejected, "catalogRef", "skip")
+            return False
+        if self.prune and (self.before is not None or self.after is not None):
+            span = time_coverage(ref)
+            if span is None:
+                span = date_span([title, urlparse.urlsplit(url).path if url else None], self.prune)
+            if span is not None and (
+                (self.after is not None and span[1] <= self.after) or (self.before is not None and span[0] > self.before)
+            ):
+                logger.info("Pruning catalogRef outside of the time window.  Title: %s", title)
+                reject(rejected, "catalogRef", "prune")
+                return False
+        return True
+
+    def accept_dataset(self, dataset, rejected=None):
+        """Returns True if a dataset should be kept
+        :param lxml.etree.Element dataset: The dataset element
+        :param Counter rejected: Counts the ``("dataset", rule)`` of the datasets left out
+        """
+        name = dataset.get("name")
+        if self.skip.match(name):
+            logger.info("Skipping dataset based on 'skips'.  Name: %s", name)
+            reject(rejected, "dataset", "skip")
+            return False
+
+        gid = dataset.get("ID")
+        if self.select is not None and not self.select.match(gid):
+            logger.info("Ignoring dataset based on 'selects'.  ID: %s", gid)
+            reject(rejected, "dataset", "select")
+            return False
+
+        modified = self.modified(dataset)
+        if modified is False:
+            reject(rejected, "dataset", "modified")
+            return False
+        if modified is not None and (
+            (self.after is not None and modified < self.after) or (self.before is not None and modified > self.before)
+        ):
+            reject(rejected, "dataset", "modified")
+            return False
+
+        for predicate in self.predicates:
+            if not predicate(dataset):
+                logger.info("Ignoring dataset based on 'predicates'.  ID: %s", gid)
+                reject(rejected, "dataset", "predicate {}".format(getattr(predicate, "__name__", repr(predicate))))
+                return False
+        return True
+
+    def modified(self, dataset):
+        """Returns the modified date of a dataset in UTC, None if it has none
+        or False if it can not be parsed
+        :param lxml.etree.Element dataset: The dataset element
+        """
+        date_tag = next((d for d in dataset.iter(f"{{{INV_NS}}}date") if d.get("type") == "modified"), None)
+        if date_tag is None:
+            return None
+        with contextlib.suppress(ValueError, OverflowError, TypeError):
+            return parse_datetime(date_tag.text)
+        logger.error("Skipping dataset.Wrong date string %s ", date_tag.text)
+        return False
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+import re
+from collections import deque
+
+from thredds_crawler.filters import DATE_PATTERNS, date_span
+
+
+class Frontier:
+    """The catalogs waiting to be crawled.
+
+    Catalog URLs are added as soon as the catalog referencing them is parsed
+    and taken out in breadth-first ("bfs"), depth-first ("dfs") or priority
+    ("priority") order. With priority ordering, the ``priority`` callable is
+    called with the URL and depth of each catalog and the lowest value is
+    crawled first; ties are broken by insertion order.
+    """
+
+    ORDERS = ("bfs", "dfs", "priority")
+
+    def __init__(self, order=None, priority=None):
+        """:param str order: One of "bfs", "dfs" or "priority". Defaults to "priority" when
+            a priority function is given and "dfs" otherwise.
+        :param callable priority: Function taking a catalog URL and its depth and returning a sort key
+        """
+        if order is None:
+            order = "priority" if priority is not None else "dfs"
+        if order not in self.ORDERS:
+            msg = "'order' parameter should be one of {}".format(", ".join(self.ORDERS))
+            raise ValueError(msg)
+        if order == "priority" and priority is None:
+            msg = "'priority' parameter is required for priority ordering"
+            raise ValueError(msg)
+        self.order = order
+        self.priority = priority
+        self._counter = itertools.count()
+        self._items = [] if order == "priority" else deque()
+
+    def push(self, url, depth=0):
+        """Adds a catalog to the frontier
+        :param str url: URL for the catalog
+        :param int depth: Number of catalogRefs between the root catalog and this one
+        """
+        if self.order == "priority":
+            heapq.heappush(self._items, (self.priority(url, depth), next(self._counter), url, depth))
+        else:
+            self._items.append((url, depth))
+
+    def pop(self):
+        """Removes and returns the next ``(url, depth)`` to crawl"""
+        if self.order == "priority":
+            _, _, url, depth = heapq.heappop(self._items)
+            return url, depth
+        if self.order == "bfs":
+            return self._items.popleft()
+        return self._items.pop()
+
+    def __len__(self):
+        return len(self._items)
+
+
+def newest_first(patterns=None):
+    """Returns a priority function crawling the catalogs whose URL names the
+    most recent period (2016/, 2016/01/, 20160110/...) first. Catalogs without
+    a date in their URL, which may hold anything, are crawled before any dated one.
+    :param list patterns: Regular expressions with year, month and day named groups, DATE_PATTERNS if None
+    """
+    patterns = [re.compile(p) for p in (patterns or DATE_PATTERNS)]
+
+    def priority(url, _depth):
+        span = date_span([url], patterns)
+        if span is None:
+            return (0, 0)
+        return (1, -span[1].timestamp())
+
+    return priority
+
+
+def matching_first(patterns):
+    """Returns a priority function crawling the catalogs whose URL matches the
+    first of patterns first, then those matching the second and so on, and
+    the catalogs matching none of them last
+    :param list patterns: Regular expressions, in order of preference
+    """
+    patterns = [re.compile(p) for p in patterns]
+
+    def priority(url, _depth):
+        for i, pattern in enumerate(patterns):
+            if pattern.search(url):
+                return i
+        return len(patterns)
+
+    return priority
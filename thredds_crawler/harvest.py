@@ -0,0 +1,288 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http import HTTPStatus
+from pathlib import Path
+from typing import NamedTuple
+
+import requests
+
+from thredds_crawler.crawl import XMLResponse
+from thredds_crawler.throttle import RequestScheduler
+from thredds_crawler.utils import CHUNK_SIZE, request_headers, session
+
+logger = logging.getLogger(__name__)
+
+
+class HarvestResult(NamedTuple):
+    """Outcome of harvesting one service endpoint of a dataset. The status is
+    "downloaded", "unchanged" (the file on disk is up to date) or "failed", in which case error says why.
+    size is the number of bytes written, 0 unless downloaded.
+    """
+
+    dataset_id: str
+    service: str
+    url: str
+    path: str
+    status: str
+    size: int
+    error: str
+
+
+DOWNLOADED = "downloaded"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+
+def default_filename(dataset_id, service):
+    """Returns the file name a service endpoint is saved as: the dataset ID with
+    slashes replaced, followed by the service type, such as ``a_b.nc.iso.xml``
+    :param str dataset_id: ID of the dataset
+    :param str service: Service type, such as ISO
+    """
+    return "{}.{}.xml".format(dataset_id.replace("/", "_"), service.lower())
+
+
+class Harvester:
+    """Downloads the service endpoints (ISO, NcML, UDDC...) of crawled datasets to a directory.
+
+    Datasets are read from any iterable, such as ``crawl_iter``, so downloads
+    start while the crawl is still running. Downloads run on a pool of
+    ``workers`` threads, each host being limited to ``per_host`` concurrent
+    requests by a RequestScheduler, which also retries failures and stops
+    requesting hosts that keep failing.
+
+    Bodies are streamed to a temporary file renamed over the target once
+    complete, so a file on disk is never partially written. What was
+    downloaded is recorded in ``.harvest.json`` in the directory, and on the
+    next run a file is left untouched when the modified date of its dataset
+    did not change, when the server answers a conditional request with 304
+    Not Modified, or when the downloaded content is identical.
+    """
+
+    STATE = ".harvest.json"
+
+    def __init__(  # noqa: PLR0913
+        self,
+        directory,
+        *,
+        services=("iso",),
+        workers=8,
+        per_host=4,
+        auth=None,
+        timeout=60,
+        filename=None,
+        scheduler=None,
+    ):
+        """:param str directory: Directory to save the files in, created if needed
+        :param list services: Service types to download, case insensitive
+        :param int workers: Number of downloads in flight at once
+        :param int per_host: Number of downloads in flight at once to a single host
+        :param requests.auth.AuthBase auth: requests auth object to use
+        :param float timeout: Seconds to wait for a server to respond
+        :param filename: Callable taking a dataset ID and a service type and returning the path,
+            relative to directory, to save the endpoint as. See default_filename.
+        :param RequestScheduler scheduler: Scheduler to use instead of one limited to per_host
+        """
+        self.directory = directory
+        self.services = {s.lower() for s in services}
+        self.workers = workers
+        self.auth = auth
+        self.timeout = timeout
+        self.filename = filename or default_filename
+        self.scheduler = scheduler or RequestScheduler(concurrency=per_host, max_concurrency=per_host, timeout=timeout)
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._slots = threading.Lock()
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with (Path(self.directory) / self.STATE).open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Writes what was downloaded so far, for the next run to skip unchanged files"""
+        with self._lock:
+            state = json.dumps(self.state)
+        write_atomic(Path(self.directory) / self.STATE, [state.encode("utf-8")])
+
+    def targets(self, datasets):
+        """Yields the ``(dataset_id, service, url, path, modified)`` of every endpoint to harvest
+        :param iterable datasets: LeafDatasets
+        """
+        for d in datasets:
+            modified = d.modified.isoformat() if d.modified is not None else None
+            for s in d.services:
+                if (s.service or "").lower() in self.services:
+                    yield d.id, s.service, s.url, self.filename(d.id, s.service), modified
+
+    def harvest(self, datasets):
+        """Downloads the endpoints of datasets and yields a HarvestResult for each,
+        in the order they complete. Datasets are only read as download slots
+        free up, and the state is saved once done or stopped.
+        :param iterable datasets: LeafDatasets, such as the ones yielded by crawl_iter
+        """
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        pending = set()
+        try:
+            for target in self.targets(datasets):
+                pending.add(executor.submit(self.download, *target))
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.save()
+
+    def download(self, dataset_id, service, url, path, modified=None):
+        """Downloads a single endpoint, unless unchanged, and returns a HarvestResult
+        :param str dataset_id: ID of the dataset
+        :param str service: Service type
+        :param str url: URL of the endpoint
+        :param str path: Path to save it as, relative to the harvest directory
+        :param str modified: Modified date of the dataset in ISO format, if known
+        """
+        target = Path(self.directory) / path
+        with self._lock:
+            record = self.state.get(path) if target.exists() else None
+        if record is not None and record.get("url") != url:
+            record = None
+
+        if record is not None and modified is not None and record.get("modified") == modified:
+            return self._result(dataset_id, service, url, path, UNCHANGED)
+
+        response, digest, size, error = self._attempts(url, target, record)
+        if error is not None:
+            return self._result(dataset_id, service, url, path, FAILED, error=str(error))
+        if response.status == HTTPStatus.NOT_MODIFIED or (response.status == HTTPStatus.OK and size is None):
+            status, size = UNCHANGED, 0
+        elif response.status == HTTPStatus.OK:
+            status = DOWNLOADED
+        else:
+            return self._result(dataset_id, service, url, path, FAILED, error=f"HTTP {response.status}")
+
+        with self._lock:
+            self.state[path] = {
+                "url": url,
+                "modified": modified,
+                "etag": response.etag or (record or {}).get("etag"),
+                "last_modified": response.last_modified or (record or {}).get("last_modified"),
+                "hash": digest or (record or {}).get("hash"),
+            }
+        return self._result(dataset_id, service, url, path, status, size)
+
+    def _attempts(self, url, target, record):
+        """Requests an endpoint until it succeeds or the scheduler gives up on it.
+        Returns the response, the hash of the body, the bytes written (see _fetch)
+        and the error of the last attempt, if any.
+        """
+        headers = {}
+        if record is not None:
+            if record.get("etag"):
+                headers["If-None-Match"] = record["etag"]
+            if record.get("last_modified"):
+                headers["If-Modified-Since"] = record["last_modified"]
+
+        attempt = 1
+        while True:
+            # Checking and taking a slot at once, so threads never exceed the limit of a host
+            with self._slots:
+                wait_for = self.scheduler.delay(url)
+                if wait_for == 0:
+                    self.scheduler.start(url)
+            if wait_for is None:
+                return None, None, None, "Too many failures from this host"
+            if wait_for > 0:
+                time.sleep(wait_for)
+                continue
+
+            response = digest = size = error = None
+            try:
+                response, digest, size = self._fetch(url, target, headers, record)
+            except (requests.RequestException, OSError) as e:
+                error = e
+            retry = self.scheduler.finish(url, response, error, attempt)
+            if retry is None:
+                return response, digest, size, error
+            logger.info("Retrying %s in %.1fs", url, retry)
+            time.sleep(retry)
+            attempt += 1
+
+    def _fetch(self, url, target, headers, record):
+        """Requests an endpoint and, when it changed, streams it to target.
+        Returns the response, the hash of the body (None unless 200) and the
+        bytes written (None if the body is the same as the file on disk).
+        """
+        r = session().get(url, auth=self.auth, headers=request_headers(headers), verify=False, timeout=self.timeout, stream=True)
+        with r:
+            response = XMLResponse(
+                r.status_code,
+                None,
+                r.headers.get("ETag"),
+                r.headers.get("Last-Modified"),
+                r.headers.get("Retry-After"),
+            )
+            if r.status_code != HTTPStatus.OK:
+                return response, None, None
+            digest = hashlib.sha256()
+
+            def chunks():
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    yield chunk
+
+            previous = record.get("hash") if record is not None else None
+            size = write_atomic(target, chunks(), keep=lambda: digest.hexdigest() != previous)
+        return response, digest.hexdigest(), size
+
+    def _result(self, dataset_id, service, url, path, status, size=0, error=None):  # noqa: PLR0913, PLR0917
+        with self._lock:
+            self.counts[status] += 1
+        if status == FAILED:
+            logger.error("Could not harvest %s: %s", url, error)
+        else:
+            logger.debug("Harvested %s (%s)", url, status)
+        return HarvestResult(dataset_id, service, url, str(Path(self.directory) / path), status, size, error)
+
+
+def write_atomic(path, chunks, keep=None):
+    """Writes chunks to a temporary file in the directory of path and renames it
+    over path once complete. Returns the bytes written, or None if keep returned
+    False once the chunks were written, in which case path is left untouched.
+    :param str path: Path of the file to write
+    :param iterable chunks: The bytes to write
+    :param keep: Callable deciding whether to replace path once every chunk is written
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".part")
+    tmp = Path(tmp)
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        if keep is not None and not keep():
+            tmp.unlink()
+            return None
+        tmp.replace(path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return size
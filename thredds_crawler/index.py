@@ -0,0 +1,363 @@
+import bisect
+import heapq
+import json
+import math
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import pytz
+from lxml import etree
+
+from thredds_crawler.crawl import LeafDataset
+from thredds_crawler.utils import INV_NS
+
+# Longitude of the antimeridian, boxes crossing it have an east greater than this
+ANTIMERIDIAN = 180.0
+
+
+def geospatial_coverage(metadata):
+    """Returns the ``(west, south, east, north)`` box in degrees of the last
+    geospatialCoverage of a metadata element, None if it has none or it can
+    not be read. East is greater than 180 for boxes crossing the antimeridian.
+    :param lxml.etree.Element metadata: The metadata element of a dataset
+    """
+    coverages = list(metadata.iter(f"{{{INV_NS}}}geospatialCoverage"))
+    if not coverages:
+        return None
+    coverage = coverages[-1]
+
+    def read(tag):
+        element = coverage.find(f"{{{INV_NS}}}{tag}")
+        if element is None:
+            return None
+        start = float(element.findtext(f"{{{INV_NS}}}start"))
+        size = float(element.findtext(f"{{{INV_NS}}}size") or 0)
+        return min(start, start + size), max(start, start + size)
+
+    try:
+        northsouth, eastwest = read("northsouth"), read("eastwest")
+    except (TypeError, ValueError):
+        return None
+    if northsouth is None or eastwest is None or not all(map(math.isfinite, northsouth + eastwest)):
+        return None
+    west, east = eastwest
+    if east - west >= 2 * ANTIMERIDIAN:
+        west, east = -180.0, 180.0
+    else:
+        # Longitudes from 0 to 360 and the like
+        width = east - west
+        west = (west + 180) % 360 - 180
+        east = west + width
+    return west, northsouth[0], east, northsouth[1]
+
+
+def dataset_box(dataset):
+    """Returns the box of the geospatialCoverage in the metadata of a dataset,
+    without keeping the metadata parsed
+    :param LeafDataset dataset: The dataset
+    """
+    metadata = dataset.metadata_bytes()
+    if metadata is None or b"geospatialCoverage" not in metadata:
+        return None
+    return geospatial_coverage(etree.fromstring(metadata))
+
+
+def spans(west, east):
+    """Returns the ``(west, east)`` longitude ranges within -180 and 180 a box covers,
+    two of them for a box crossing the antimeridian
+    """
+    if east > ANTIMERIDIAN:
+        return [(west, 180.0), (-180.0, east - 360)]
+    return [(west, east)]
+
+
+def utc(value):
+    """Returns a datetime in UTC, naive datetimes being taken as UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=pytz.utc)
+    return value.astimezone(pytz.utc)
+
+
+class Selection:
+    """Datasets of a DatasetIndex matching a query.
+
+    Selections of the same index combine with ``&`` (both), ``|`` (either)
+    and ``-`` (the first but not the second). Iterating over a selection
+    gives its datasets in the order they were added to the index.
+    """
+
+    def __init__(self, index, positions):
+        """:param DatasetIndex index: The index the datasets are in
+        :param set positions: Positions of the datasets in the index
+        """
+        self.index = index
+        self.positions = positions
+
+    def _combine(self, other, positions):
+        if other.index is not self.index:
+            msg = "Can not combine selections of different indexes"
+            raise ValueError(msg)
+        return Selection(self.index, positions)
+
+    def __and__(self, other):
+        return self._combine(other, self.positions & other.positions)
+
+    def __or__(self, other):
+        return self._combine(other, self.positions | other.positions)
+
+    def __sub__(self, other):
+        return self._combine(other, self.positions - other.positions)
+
+    def __iter__(self):
+        datasets = self.index.datasets
+        for position in sorted(self.positions):
+            yield datasets[position]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __bool__(self):
+        return bool(self.positions)
+
+    def filter(self, predicate):
+        """Returns the datasets of the selection for which predicate is True
+        :param callable predicate: Function taking a LeafDataset
+        """
+        datasets = self.index.datasets
+        return Selection(self.index, {p for p in self.positions if predicate(datasets[p])})
+
+    def newest(self, n):
+        """Returns the n most recently modified datasets of the selection, newest first
+        :param int n: Number of datasets
+        """
+        datasets = self.index.datasets
+        dated = (p for p in self.positions if datasets[p].modified is not None)
+        return [datasets[p] for p in heapq.nlargest(n, dated, key=lambda p: utc(datasets[p].modified))]
+
+    def ids(self):
+        """Returns the IDs of the datasets of the selection"""
+        return [ds.id for ds in self]
+
+    def __repr__(self):
+        return f"<Selection datasets: {len(self.positions)}>"
+
+
+class DatasetIndex:
+    """Indexes the datasets of a crawl for fast lookups.
+
+    Datasets are indexed by ID, service type and catalog URL in hash tables,
+    by modified date in a sorted list and by the box of the geospatialCoverage
+    in their metadata in a grid of ``cell`` degrees, the metadata being read
+    once when a dataset is added. Each query returns a Selection that combines
+    with the others::
+
+        index = DatasetIndex(Crawl(url).datasets)
+        index.get("some/dataset/id")
+        for ds in index.service("OPENDAP") & index.modified(after=datetime(2016, 1, 1)) & index.intersecting((-80, 30, -60, 45)):
+            print(ds.id)
+
+    Adding a dataset with the ID of one already indexed replaces it. The
+    index is written to a JSON file with ``save`` and read back with ``load``.
+    """
+
+    VERSION = 1
+
+    def __init__(self, datasets=(), cell=10.0):
+        """:param iterable datasets: LeafDatasets to index
+        :param float cell: Size of the cells of the spatial grid, in degrees
+        """
+        self.cell = cell
+        self.datasets = []  # By position, None once removed
+        self.boxes = {}  # By position
+        self._ids = {}
+        self._services = defaultdict(set)
+        self._catalogs = defaultdict(set)
+        self._grid = defaultdict(set)
+        self._undated = set()
+        self._times = None  # Sorted (modified timestamp, position), rebuilt after changes
+        self._keys = None
+        for dataset in datasets:
+            self.add(dataset)
+
+    def add(self, dataset, *, box=False):
+        """Indexes a dataset, replacing any with the same ID
+        :param LeafDataset dataset: The dataset
+        :param tuple box: Its ``(west, south, east, north)`` box if already known (None for
+            none), read from its metadata if False
+        """
+        if dataset.id in self._ids:
+            self.remove(dataset.id)
+        if box is False:
+            box = dataset_box(dataset)
+        position = len(self.datasets)
+        self.datasets.append(dataset)
+        self._ids[dataset.id] = position
+        for service in {s.service for s in dataset.services}:
+            self._services[service].add(position)
+        self._catalogs[dataset.catalog_url].add(position)
+        if dataset.modified is None:
+            self._undated.add(position)
+        if box is not None:
+            self.boxes[position] = tuple(box)
+            for cell in self._cells(box):
+                self._grid[cell].add(position)
+        self._times = None
+
+    def remove(self, dataset_id):
+        """Removes a dataset from the index
+        :param str dataset_id: ID of the dataset
+        """
+        position = self._ids.pop(dataset_id)
+        dataset = self.datasets[position]
+        self.datasets[position] = None
+        for service in {s.service for s in dataset.services}:
+            self._services[service].discard(position)
+        self._catalogs[dataset.catalog_url].discard(position)
+        self._undated.discard(position)
+        box = self.boxes.pop(position, None)
+        if box is not None:
+            for cell in self._cells(box):
+                self._grid[cell].discard(position)
+        self._times = None
+
+    def _cells(self, box):
+        """Yields the grid cells a box covers"""
+        west, south, east, north = box
+        rows = range(math.floor(south / self.cell), math.floor(north / self.cell) + 1)
+        for w, e in spans(west, east):
+            for column in range(math.floor(w / self.cell), math.floor(e / self.cell) + 1):
+                for row in rows:
+                    yield column, row
+
+    def _sorted_times(self):
+        if self._times is None:
+            self._times = sorted(
+                (utc(ds.modified).timestamp(), position)
+                for position, ds in enumerate(self.datasets)
+                if ds is not None and ds.modified is not None
+            )
+            self._keys = [t for t, _ in self._times]
+        return self._times
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self._ids
+
+    def __iter__(self):
+        return (ds for ds in self.datasets if ds is not None)
+
+    def get(self, dataset_id, default=None):
+        """Returns the dataset with an ID, or default if there is none
+        :param str dataset_id: ID of the dataset
+        """
+        position = self._ids.get(dataset_id)
+        return self.datasets[position] if position is not None else default
+
+    def all(self):
+        """Returns every dataset of the index"""
+        return Selection(self, set(self._ids.values()))
+
+    def service(self, service_type):
+        """Returns the datasets offering a service
+        :param str service_type: Type of the service, such as "OPENDAP" or "WMS"
+        """
+        return Selection(self, set(self._services.get(service_type, ())))
+
+    def catalog(self, catalog_url):
+        """Returns the datasets listed in a catalog
+        :param str catalog_url: URL of the catalog
+        """
+        return Selection(self, set(self._catalogs.get(catalog_url, ())))
+
+    def modified(self, after=None, before=None):
+        """Returns the datasets modified between after and before, both
+        included. Datasets without a modified date are left out.
+        :param datetime after: Earliest modified date, naive datetimes being UTC
+        :param datetime before: Latest modified date, naive datetimes being UTC
+        """
+        times = self._sorted_times()
+        start = bisect.bisect_left(self._keys, utc(after).timestamp()) if after is not None else 0
+        end = bisect.bisect_right(self._keys, utc(before).timestamp()) if before is not None else len(times)
+        return Selection(self, {position for _, position in times[start:end]})
+
+    def undated(self):
+        """Returns the datasets without a modified date"""
+        return Selection(self, set(self._undated))
+
+    def intersecting(self, box):
+        """Returns the datasets whose geospatialCoverage intersects a box
+        :param tuple box: ``(west, south, east, north)`` in degrees, east greater than 180
+            or smaller than west for a box crossing the antimeridian
+        """
+        west, south, east, north = box
+        if east < west:
+            east += 360
+        candidates = set()
+        for cell in self._cells((west, south, east, north)):
+            candidates |= self._grid.get(cell, set())
+        wanted = spans(west, east)
+        found = set()
+        for position in candidates:
+            w, s, e, n = self.boxes[position]
+            if s > north or n < south:
+                continue
+            if any(a <= y and x <= b for a, b in spans(w, e) for x, y in wanted):
+                found.add(position)
+        return Selection(self, found)
+
+    def query(self, service=None, catalog=None, after=None, before=None, box=None):
+        """Returns the datasets matching every criteria given
+        :param str service: Type of a service the datasets offer
+        :param str catalog: URL of the catalog the datasets are listed in
+        :param datetime after: Earliest modified date
+        :param datetime before: Latest modified date
+        :param tuple box: ``(west, south, east, north)`` box the geospatialCoverage intersects
+        """
+        selection = self.all()
+        if service is not None:
+            selection &= self.service(service)
+        if catalog is not None:
+            selection &= self.catalog(catalog)
+        if after is not None or before is not None:
+            selection &= self.modified(after, before)
+        if box is not None:
+            selection &= self.intersecting(box)
+        return selection
+
+    def save(self, path):
+        """Writes the index to a JSON file
+        :param str path: Path of the file
+        """
+        with Path(path).open("w") as f:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "created": datetime.now(pytz.utc).isoformat(),
+                    "cell": self.cell,
+                    "datasets": [
+                        [ds.to_dict(), self.boxes.get(position)] for position, ds in enumerate(self.datasets) if ds is not None
+                    ],
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path) -> "DatasetIndex":
+        """Reads an index written by save
+        :param str path: Path of the file
+        """
+        with Path(path).open() as f:
+            data = json.load(f)
+        if data.get("version") != cls.VERSION:
+            msg = "Unsupported index version {}".format(data.get("version"))
+            raise ValueError(msg)
+        index = cls(cell=data["cell"])
+        for d, box in data["datasets"]:
+            index.add(LeafDataset.from_dict(d), box=box)
+        return index
+
+    def __repr__(self):
+        return f"<DatasetIndex datasets: {len(self)}>"
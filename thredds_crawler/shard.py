@@ -0,0 +1,534 @@
+import heapq
+import itertools
+import json
+import os
+import queue
+import socket
+import sqlite3
+import time
+import zlib
+from abc import ABC, abstractmethod
+from http import HTTPStatus
+from typing import NamedTuple
+
+from thredds_crawler.crawl import Crawl, LeafDataset, logger
+
+
+class Task(NamedTuple):
+    """A request to make: "catalog" or "dataset", its URL, the depth of the catalog
+    it belongs to and the shard it was assigned to
+    """
+
+    kind: str
+    url: str
+    depth: int
+    shard: int
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tasks (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT UNIQUE,
+    kind TEXT,
+    depth INTEGER,
+    shard INTEGER,
+    state TEXT DEFAULT 'pending',
+    owner TEXT,
+    expires REAL,
+    attempts INTEGER DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, shard);
+CREATE TABLE IF NOT EXISTS results (id TEXT, source TEXT, data TEXT, PRIMARY KEY (id, source)) WITHOUT ROWID;
+"""
+
+
+def shard_of(url, shards):
+    """Returns the shard a URL hashes to, the same on every machine
+    :param str url: URL of the catalog
+    :param int shards: Number of shards
+    """
+    return zlib.crc32(url.encode("utf-8")) % shards
+
+
+class WorkQueue(ABC):
+    """The requests of a sharded crawl, shared by all of its workers.
+
+    A worker leases a few tasks at a time, for ``ttl`` seconds. A lease that
+    is not completed nor renewed in time expires and the task goes to the next
+    worker asking for work, so a worker that dies only delays its tasks. A
+    task leased ``max_attempts`` times without being completed is given up on,
+    including the times a worker gave it back because it could not make it.
+
+    Tasks are identified by their URL and adding a task already in the queue
+    does nothing, which is how a catalog referenced from several places is
+    crawled once across all of the workers. Completing a task adds the tasks
+    it led to and the datasets it found at once, and doing it twice (after a
+    lease expired under a slow worker) is harmless.
+
+    Subclass it to keep the queue in a message broker or a database server;
+    SQLiteQueue keeps it in a SQLite file.
+    """
+
+    @abstractmethod
+    def open(self, root, options):
+        """Seeds the queue with the root catalog, unless it already holds a
+        crawl of it. Raises ValueError if it holds a crawl of another catalog
+        or with other options.
+        :param str root: URL of the root catalog
+        :param str options: Fingerprint of the crawl options
+        """
+
+    @abstractmethod
+    def lease(self, worker, shard, count, ttl):
+        """Leases up to count tasks to worker and returns them, the tasks of
+        shard first, then those of any other shard
+        :param str worker: Name of the worker
+        :param int shard: Shard the worker prefers, None for any
+        :param int count: Most tasks to lease
+        :param float ttl: Seconds before the leases expire
+        """
+
+    @abstractmethod
+    def renew(self, worker, urls, ttl):
+        """Extends the leases the worker holds on tasks
+        :param str worker: Name of the worker
+        :param list urls: URLs of the tasks
+        :param float ttl: Seconds from now before the leases expire
+        """
+
+    @abstractmethod
+    def complete(self, worker, url, tasks=(), datasets=(), error=None):
+        """Marks a task as done, adding the tasks it led to and the datasets it found
+        :param str worker: Name of the worker
+        :param str url: URL of the task
+        :param list tasks: New Tasks
+        :param list datasets: Datasets found, as dicts returned by LeafDataset.to_dict
+        :param str error: Why the task failed, if it did
+        """
+
+    @abstractmethod
+    def release(self, worker, urls, *, delay=None, error=None):
+        """Gives back leased tasks so other workers can take them, at once or after a delay.
+        Given an error, the lease counts as an attempt and the tasks leased too many
+        times fail with it instead.
+        :param str worker: Name of the worker
+        :param list urls: URLs of the tasks
+        :param float delay: Seconds before the tasks can be leased again
+        :param str error: Why the worker could not make the requests
+        """
+
+    @abstractmethod
+    def counts(self):
+        """Returns the number of tasks in each state: pending, leased, done and failed"""
+
+    def finished(self):
+        """Returns True when every task is done or failed"""
+        counts = self.counts()
+        return not counts.get("pending") and not counts.get("leased")
+
+    @abstractmethod
+    def results(self):
+        """Yields the ``(dataset ID, source URL, dataset dict)`` of every dataset
+        found, ordered by dataset ID then source URL
+        """
+
+    def datasets(self):
+        """Yields every dataset found by all of the workers, ordered by ID, as
+        dicts returned by LeafDataset.to_dict. A dataset found in several
+        catalogs is taken from the first of them by URL, so the result does
+        not depend on which worker crawled what.
+        """
+        last = None
+        for gid, _, data in self.results():
+            if gid != last:
+                last = gid
+                yield data
+
+
+class SQLiteQueue(WorkQueue):
+    """A WorkQueue in a SQLite database, for workers on one machine or on
+    several sharing a file system with working locks. Each worker process
+    opens the database itself.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, max_attempts=3, timeout=60):
+        """:param str path: Path of the SQLite database, created if needed
+        :param int max_attempts: Leases of a task before it is given up on
+        :param float timeout: Seconds to wait for another worker to release the database
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    def open(self, root, options):
+        with self._transaction():
+            meta = dict(self._db.execute("SELECT key, value FROM meta"))
+            if meta:
+                if meta.get("version") != str(self.VERSION):
+                    msg = "Unsupported queue version {}".format(meta.get("version"))
+                    raise ValueError(msg)
+                if meta.get("root") != root or meta.get("options") != options:
+                    msg = "The queue holds a crawl of {} with other options".format(meta.get("root"))
+                    raise ValueError(msg)
+                return
+            self._db.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                [("version", str(self.VERSION)), ("root", root), ("options", options)],
+            )
+            self._add([Task("catalog", root, 0, 0)])
+
+    def lease(self, worker, shard, count, ttl):
+        now = time.time()
+        with self._transaction():
+            # Leases that expired too many times are given up on
+            self._db.execute(
+                "UPDATE tasks SET state = 'failed', error = 'lease expired' "
+                "WHERE state = 'leased' AND expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            rows = list(
+                self._db.execute(
+                    "SELECT kind, url, depth, shard FROM tasks "
+                    "WHERE (state = 'pending' AND (expires IS NULL OR expires <= ?)) OR (state = 'leased' AND expires < ?) "
+                    "ORDER BY shard IS NOT ?, seq LIMIT ?",
+                    (now, now, shard, count),
+                ),
+            )
+            self._db.executemany(
+                "UPDATE tasks SET state = 'leased', owner = ?, expires = ?, attempts = attempts + 1 WHERE url = ?",
+                [(worker, now + ttl, url) for _, url, _, _ in rows],
+            )
+        return [Task(*row) for row in rows]
+
+    def renew(self, worker, urls, ttl):
+        with self._transaction():
+            self._db.executemany(
+                "UPDATE tasks SET expires = ? WHERE url = ? AND owner = ? AND state = 'leased'",
+                [(time.time() + ttl, url, worker) for url in urls],
+            )
+
+    def complete(self, worker, url, tasks=(), datasets=(), error=None):
+        with self._transaction():
+            self._add(tasks)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results (id, source, data) VALUES (?, ?, ?)",
+                [(d["id"], url, json.dumps(d)) for d in datasets],
+            )
+            self._db.execute(
+                "UPDATE tasks SET state = ?, owner = ?, error = ? WHERE url = ?",
+                ("failed" if error else "done", worker, error, url),
+            )
+
+    def release(self, worker, urls, *, delay=None, error=None):
+        # Pending tasks are not leased before they expire
+        expires = time.time() + delay if delay else None
+        with self._transaction():
+            if error is not None:
+                self._db.executemany(
+                    "UPDATE tasks SET state = 'failed', error = ? "
+                    "WHERE url = ? AND owner = ? AND state = 'leased' AND attempts >= ?",
+                    [(error, url, worker, self.max_attempts) for url in urls],
+                )
+            self._db.executemany(
+                "UPDATE tasks SET state = 'pending', owner = NULL, expires = ?, attempts = attempts - ? "
+                "WHERE url = ? AND owner = ? AND state = 'leased'",
+                [(expires, 0 if error is not None else 1, url, worker) for url in urls],
+            )
+
+    def counts(self):
+        return dict(self._db.execute("SELECT state, count(*) FROM tasks GROUP BY state"))
+
+    def failures(self):
+        """Returns the ``(kind, url, error)`` of every task that failed"""
+        return list(self._db.execute("SELECT kind, url, error FROM tasks WHERE state = 'failed' ORDER BY url"))
+
+    def results(self):
+        for gid, source, data in self._db.execute("SELECT id, source, data FROM results ORDER BY id, source"):
+            yield gid, source, json.loads(data)
+
+    def _add(self, tasks):
+        self._db.executemany(
+            "INSERT OR IGNORE INTO tasks (kind, url, depth, shard) VALUES (?, ?, ?, ?)",
+            [tuple(t) for t in tasks],
+        )
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc: object):
+        self.close()
+
+
+class _Transaction:
+    """Holds the write lock of a SQLite database for the duration of a with block"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, *exc: object):
+        self.db.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+
+
+class ShardedCrawl(Crawl):
+    """One worker of a crawl shared by many, on any number of processes or machines.
+
+    The workers share a WorkQueue and need no coordinator: they all run
+    the same code against the same queue and the first one to open it seeds
+    it with the root catalog. Each worker leases catalogs from the queue,
+    crawls them with its own pool and puts the catalogRefs and dataset
+    requests they lead to back in the queue, so the catalog tree is spread
+    across all of them as it is discovered. A worker stops once every task
+    in the queue is done.
+
+    Tasks are split in ``shards`` shards, either by ``partition="subtree"``,
+    where every catalog belongs to the shard of the catalogRef below the
+    root it was found under, or by ``partition="hash"`` of each URL. A worker
+    takes the tasks of its own ``shard`` first and helps with the others
+    when there are none left, so workers keep to their part of the tree (and
+    their server connections and caches stay warm) without ever sitting idle.
+
+    ``datasets`` and ``iter_datasets`` give the datasets found by this worker;
+    ``merge(queue)`` gives those of every worker once the crawl is over::
+
+        # On each of 4 machines, with shard set to 0, 1, 2 and 3
+        with SQLiteQueue("/shared/unidata.db") as q:
+            ShardedCrawl(q, "http://thredds.ucar.edu/thredds/catalog.xml", shard=0, shards=4, lazy=True)
+        datasets = merge(q)
+    """
+
+    PARTITIONS = ("subtree", "hash")
+
+    def __init__(  # noqa: PLR0913
+        self,
+        work_queue,
+        catalog_url,
+        *,
+        worker=None,
+        shard=None,
+        shards=1,
+        partition="subtree",
+        lease=300,
+        poll=1.0,
+        **kwargs: object,
+    ):
+        """:param thredds_crawler.shard.WorkQueue work_queue: Queue shared by every worker of the crawl
+        :param str catalog_url: URL of the root catalog, the same for every worker
+        :param str worker: Name of this worker, unique across the crawl. Defaults to the host name and process ID.
+        :param int shard: Shard this worker takes tasks from first, any shard if None
+        :param int shards: Number of shards to split the tasks in, the same for every worker
+        :param str partition: "subtree" or "hash", how catalogs are assigned to shards
+        :param float lease: Seconds a worker has to complete a task before another one takes it over
+        :param float poll: Seconds to wait before asking for work again when there is none
+        :param kwargs: Any Crawl parameter but order, priority, store and budget
+        """
+        if partition not in self.PARTITIONS:
+            msg = "'partition' parameter should be one of {}".format(", ".join(self.PARTITIONS))
+            raise ValueError(msg)
+        if shard is not None and not 0 <= shard < shards:
+            msg = f"'shard' parameter should be between 0 and {shards - 1}"
+            raise ValueError(msg)
+        for name in ("order", "priority", "store", "budget"):
+            if kwargs.get(name) is not None:
+                msg = f"'{name}' parameter is not supported by a sharded crawl"
+                raise ValueError(msg)
+        self.queue = work_queue
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        self.shard = shard
+        self.shards = shards
+        self.partition = partition
+        self.lease = lease
+        self.poll = poll
+        super().__init__(catalog_url, **kwargs)
+
+    def _fingerprint(self):
+        options = json.loads(super()._fingerprint())
+        options.update(shards=self.shards, partition=self.partition)
+        return json.dumps(options, sort_keys=True)
+
+    def _shard(self, url, depth, parent):
+        """Returns the shard of a catalog
+        :param str url: URL of the catalog
+        :param int depth: Depth of the catalog
+        :param Task parent: Task of the catalog it was found in
+        """
+        if self.partition == "subtree" and depth > 1:
+            return parent.shard
+        return shard_of(url, self.shards)
+
+    def _run(self, url):
+        """Crawls the tasks leased from the queue using the worker pool until the
+        queue is finished, and yields a LeafDataset for each dataset found
+        :param str url: URL for the root catalog
+        """
+        self.queue.open(self._get_catalog_url(url), self._fingerprint())
+        done = queue.Queue()
+        held = {}  # Tasks leased, by URL
+        ready = []  # Tasks to send, by time
+        counter = itertools.count()
+        in_flight = set()  # URLs of the requests sent and not answered yet
+        renewed = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                if held and now - renewed >= self.lease / 3:
+                    self.queue.renew(self.worker, list(held), self.lease)
+                    renewed = now
+
+                self._lease(ready, held, counter, now)
+                if not held:
+                    if self.queue.finished():
+                        break
+                    # Other workers are still crawling and may find more
+                    time.sleep(self.poll)
+                    continue
+
+                wait = self._dispatch(ready, held, done, counter, now, in_flight)
+                if not in_flight:
+                    time.sleep(wait)
+                    continue
+                try:
+                    (task, attempt), response, error = done.get(timeout=wait)
+                except queue.Empty:
+                    continue
+                in_flight.discard(task.url)
+
+                retry = self._outcome(task.url, task.kind, response, error, attempt)
+                if retry is not None:
+                    heapq.heappush(ready, (time.monotonic() + retry, next(counter), task, attempt + 1))
+                elif error is not None or response.status >= HTTPStatus.BAD_REQUEST:
+                    self._complete(held, task, error=self.failures[-1].reason)
+                else:
+                    tasks, found, error = self._process(task, response)
+                    self._complete(held, task, tasks, found, error)
+                    yield from found
+        finally:
+            self._abandon(held, in_flight)
+
+    def _abandon(self, held, in_flight):
+        """Gives up on the tasks still leased when the crawl stopped
+        :param dict held: Tasks leased, by URL
+        :param set in_flight: URLs of the requests sent and not answered yet
+        """
+        # Free the places of the requests abandoned when the crawl is cut short
+        for u in in_flight:
+            self.scheduler.cancel(u)
+        if held:
+            # Stopped early, let the other workers carry on without waiting for the leases to expire
+            self.queue.release(self.worker, list(held))
+
+    def _lease(self, ready, held, counter, now):
+        """Leases enough tasks from the queue to keep every worker busy with a request
+        :param list ready: Heap of the ``(time, order, task, attempt)`` to send
+        :param dict held: Tasks leased, by URL
+        :param itertools.count counter: Order of the tasks sent at the same time
+        :param float now: The current time.monotonic()
+        """
+        if len(held) < self.workers * 2:
+            for task in self.queue.lease(self.worker, self.shard, self.workers * 2 - len(held), self.lease):
+                logger.info("Crawling: %s", task.url)
+                held[task.url] = task
+                heapq.heappush(ready, (now, next(counter), task, 1))
+
+    def _dispatch(self, ready, held, done, counter, now, in_flight):  # noqa: PLR0913, PLR0917
+        """Sends the tasks that are due and their host is ready for and returns the
+        seconds until the next task is due. Tasks to a host whose circuit is open are
+        given back to the queue until the circuit may close, the queue fails them once
+        they were leased too many times.
+        :param list ready: Heap of the ``(time, order, task, attempt)`` to send
+        :param dict held: Tasks leased, by URL
+        :param queue.Queue done: Queue the responses are put in
+        :param itertools.count counter: Order of the tasks sent at the same time
+        :param float now: The current time.monotonic()
+        :param set in_flight: URLs of the requests sent and not answered yet
+        """
+        while ready and ready[0][0] <= now:
+            _, _, task, attempt = heapq.heappop(ready)
+            delay = self.scheduler.delay(task.url)
+            if delay is None:
+                logger.debug("Giving back %s (circuit open)", task.url)
+                del held[task.url]
+                self.queue.release(self.worker, [task.url], delay=self.scheduler.reset_after, error="circuit open")
+            elif delay > 0:
+                heapq.heappush(ready, (now + delay, next(counter), task, attempt))
+            else:
+                self.scheduler.start(task.url)
+                in_flight.add(task.url)
+                func, args, kwds = self._request_call(task.url, task.kind)
+                self.pool.apply_async(
+                    func,
+                    args=args,
+                    kwds=kwds,
+                    callback=lambda r, q=(task, attempt): done.put((q, r, None)),
+                    error_callback=lambda e, q=(task, attempt): done.put((q, None, e)),
+                )
+        return min(self.poll, max(ready[0][0] - now, 0)) if ready else self.poll
+
+    def _complete(self, held, task, tasks=(), datasets=(), error=None):
+        """Records a leased task as done in the queue, along with what it led to
+        :param dict held: Tasks leased, by URL
+        :param Task task: The task
+        :param list tasks: Tasks it led to
+        :param list datasets: LeafDatasets found
+        :param str error: Why it failed, None if it did not
+        """
+        del held[task.url]
+        self.queue.complete(self.worker, task.url, tasks, [ds.to_dict() for ds in datasets if ds.id is not None], error)
+
+    def _process(self, task, response):
+        """Returns the tasks and datasets a response leads to, and the error if it can not be read
+        :param Task task: The task that was requested
+        :param XMLResponse response: Its response
+        """
+        if task.kind == "dataset":
+            ds = self._dataset(task.url, response)
+            if ds.id is None:
+                self._fail(task.url, task.kind, "invalid XML")
+            return [], [ds], None
+
+        parsed = self._catalog(task.url, response)
+        if parsed is None:
+            return [], [], "invalid XML"
+        references, leaves = parsed
+        self.stats.record_catalog(task.url, task.depth, references, leaves)
+        tasks, found = [], []
+        for child in references:
+            if child in self.visited:
+                self.stats.record_skip("visited")
+                continue
+            self.visited.add(child)
+            settled = self._settled(child)
+            if settled is not None:
+                self.stats.record_skip("settled")
+                found += settled
+                continue
+            tasks.append(Task("catalog", child, task.depth + 1, self._shard(child, task.depth + 1, task)))
+        for ds in leaves:
+            if isinstance(ds, LeafDataset):
+                found.append(ds)
+            else:
+                tasks.append(Task("dataset", ds, task.depth, task.shard))
+        return tasks, found, None
+
+
+def merge(work_queue):
+    """Returns the LeafDatasets found by every worker of a sharded crawl,
+    ordered by ID, the same whichever worker found them
+    :param thredds_crawler.shard.WorkQueue work_queue: Queue of the crawl
+    """
+    return [LeafDataset.from_dict(d) for d in work_queue.datasets()]
@@ -0,0 +1,321 @@
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from thredds_crawler.crawl import LeafDataset
+
+# Version of the layout written by the sinks, bumped whenever a field is
+# renamed, removed or changes meaning so readers can tell the layouts apart
+SCHEMA_VERSION = 1
+SCHEMA_KEY = "thredds_crawler.schema_version"
+
+
+class Sink(ABC):
+    """Writes LeafDatasets as a crawl produces them.
+
+    Sinks never hold more than a batch of datasets, so they can be fed from
+    ``crawl_iter`` or ``Crawl.iter_datasets`` without keeping the whole crawl
+    in memory::
+
+        with JSONLinesSink("datasets.jsonl") as sink:
+            sink.write_all(crawl_iter(url))
+    """
+
+    @abstractmethod
+    def write(self, dataset):
+        """Writes one dataset
+        :param LeafDataset dataset: The dataset
+        """
+
+    def write_all(self, datasets):
+        """Writes every dataset of an iterable and returns how many were written
+        :param iterable datasets: LeafDatasets, such as the ones yielded by crawl_iter
+        """
+        count = 0
+        for dataset in datasets:
+            self.write(dataset)
+            count += 1
+        return count
+
+    def flush(self):  # noqa: B027
+        """Writes out any buffered dataset, nothing to do for sinks that do not buffer"""
+
+    def close(self):
+        """Flushes and closes the sink"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc: object):
+        self.close()
+
+
+class JSONLinesSink(Sink):
+    """Writes one JSON object per line, the dict returned by LeafDataset.to_dict
+    with a ``schema_version`` field. Read it back with ``read_jsonl``.
+    """
+
+    def __init__(self, path, *, metadata=True):
+        """:param str path: Path of the file to write (str or path-like), or a writable text file object
+        :param bool metadata: False to leave out the metadata of the datasets
+        """
+        self.metadata = metadata
+        self._owned = isinstance(path, (str, os.PathLike))
+        self._file = Path(path).open("w", encoding="utf-8") if self._owned else path  # noqa: SIM115
+
+    def write(self, dataset):
+        record = dataset.to_dict()
+        if not self.metadata:
+            record["metadata"] = None
+        record["schema_version"] = SCHEMA_VERSION
+        self._file.write(json.dumps(record))
+        self._file.write("\n")
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+def read_jsonl(path):
+    """Yields the LeafDatasets of a file written by JSONLinesSink
+    :param str path: Path of the file
+    """
+    with Path(path).open(encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            check_version(record.get("schema_version"))
+            yield LeafDataset.from_dict(record)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS datasets (
+    id TEXT PRIMARY KEY, name TEXT, catalog_url TEXT, data_size REAL, modified TEXT, metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS services (dataset_id TEXT, name TEXT, service TEXT, url TEXT);
+CREATE INDEX IF NOT EXISTS services_dataset ON services (dataset_id);
+"""
+
+
+class SQLiteSink(Sink):
+    """Writes datasets to a ``datasets`` table and their services, one row per
+    endpoint, to a ``services`` table of a SQLite database. Rows are inserted
+    in batches of ``batch_size`` datasets, each batch in one transaction. The
+    schema version is kept in the ``meta`` table. Read it back with ``read_sqlite``.
+    """
+
+    def __init__(self, path, batch_size=1000, *, metadata=True):
+        """:param str path: Path of the SQLite database, created if needed
+        :param int batch_size: Datasets to buffer before inserting them
+        :param bool metadata: False to leave out the metadata of the datasets
+        """
+        self.batch_size = batch_size
+        self.metadata = metadata
+        self._datasets = []
+        self._services = []
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        version = self._db.execute("SELECT name FROM sqlite_master WHERE name = 'meta'").fetchone()
+        if version is not None:
+            version = self._db.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            check_version(int(version[0]) if version else None)
+        self._db.executescript(SQLITE_SCHEMA)
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+        self._db.commit()
+
+    def write(self, dataset):
+        metadata = dataset.metadata_bytes() if self.metadata else None
+        self._datasets.append(
+            (
+                dataset.id,
+                dataset.name,
+                dataset.catalog_url,
+                dataset.data_size,
+                dataset.modified.isoformat() if dataset.modified is not None else None,
+                metadata.decode("utf-8") if metadata is not None else None,
+            ),
+        )
+        self._services.extend((dataset.id, s.name, s.service, s.url) for s in dataset.services)
+        if len(self._datasets) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._datasets:
+            return
+        with self._db:
+            # A dataset written again replaces the previous one and its services
+            self._db.executemany("DELETE FROM services WHERE dataset_id = ?", [(d[0],) for d in self._datasets])
+            self._db.executemany("INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?)", self._datasets)
+            self._db.executemany("INSERT INTO services VALUES (?, ?, ?, ?)", self._services)
+        self._datasets = []
+        self._services = []
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+def read_sqlite(path):
+    """Yields the LeafDatasets of a database written by SQLiteSink
+    :param str path: Path of the database
+    """
+    db = sqlite3.connect(path)
+    try:
+        version = db.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        check_version(int(version[0]) if version else None)
+        services = {}
+        for dataset_id, name, service, url in db.execute("SELECT dataset_id, name, service, url FROM services"):
+            services.setdefault(dataset_id, []).append({"name": name, "service": service, "url": url})
+        for gid, name, catalog_url, data_size, modified, metadata in db.execute("SELECT * FROM datasets"):
+            yield LeafDataset.from_dict(
+                {
+                    "id": gid,
+                    "name": name,
+                    "catalog_url": catalog_url,
+                    "data_size": data_size,
+                    "modified": modified,
+                    "services": services.get(gid, []),
+                    "metadata": metadata,
+                },
+            )
+    finally:
+        db.close()
+
+
+def arrow_schema():
+    """Returns the Arrow schema of the rows written by ParquetSink and ArrowSink:
+    one row per service endpoint, with the fields of the dataset repeated
+    """
+    if pa is None:
+        msg = "The pyarrow library is required for writing Parquet and Arrow files."
+        raise ImportError(msg)
+    return pa.schema(
+        [
+            ("dataset_id", pa.string()),
+            ("name", pa.string()),
+            ("catalog_url", pa.string()),
+            ("data_size", pa.float64()),
+            ("modified", pa.timestamp("us", tz="UTC")),
+            ("service_name", pa.string()),
+            ("service", pa.string()),
+            ("url", pa.string()),
+        ],
+        metadata={SCHEMA_KEY: str(SCHEMA_VERSION)},
+    )
+
+
+class ColumnarSink(Sink):
+    """Buffers one row per service endpoint in columns and writes them as a
+    record batch every ``batch_size`` rows. A dataset without services is
+    written as one row with no service. The metadata is not written.
+    """
+
+    def __init__(self, batch_size=65536):
+        """:param int batch_size: Rows to buffer before writing them"""
+        self.schema = arrow_schema()
+        self.batch_size = batch_size
+        self._columns = {name: [] for name in self.schema.names}
+
+    def write(self, dataset):
+        for s in dataset.services or (None,):
+            self._columns["dataset_id"].append(dataset.id)
+            self._columns["name"].append(dataset.name)
+            self._columns["catalog_url"].append(dataset.catalog_url)
+            self._columns["data_size"].append(dataset.data_size)
+            self._columns["modified"].append(dataset.modified)
+            self._columns["service_name"].append(s.name if s is not None else None)
+            self._columns["service"].append(s.service if s is not None else None)
+            self._columns["url"].append(s.url if s is not None else None)
+        if len(self._columns["dataset_id"]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._columns["dataset_id"]:
+            return
+        self._write(pa.RecordBatch.from_pydict(self._columns, schema=self.schema))
+        self._columns = {name: [] for name in self.schema.names}
+
+    @abstractmethod
+    def _write(self, batch):
+        """Writes a RecordBatch to the file
+        :param pyarrow.RecordBatch batch: The batch
+        """
+
+
+class ParquetSink(ColumnarSink):
+    """Writes a Parquet file with one row group per batch. Requires pyarrow.
+    The schema version is kept in the file metadata, see ``check_schema``.
+    """
+
+    def __init__(self, path, batch_size=65536, compression="zstd"):
+        """:param str path: Path of the Parquet file
+        :param int batch_size: Rows to buffer before writing a row group
+        :param str compression: Parquet compression codec
+        """
+        super().__init__(batch_size)
+        self._writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def _write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+class ArrowSink(ColumnarSink):
+    """Writes an Arrow IPC file, which can be memory mapped and read without
+    copying. Requires pyarrow. The schema version is kept in the schema
+    metadata, see ``check_schema``.
+    """
+
+    def __init__(self, path, batch_size=65536):
+        """:param str path: Path of the Arrow file
+        :param int batch_size: Rows to buffer before writing a record batch
+        """
+        super().__init__(batch_size)
+        self._sink = pa.OSFile(path, "wb")
+        self._writer = pa.ipc.new_file(self._sink, self.schema)
+
+    def _write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        self._sink.close()
+
+
+def check_schema(schema):
+    """Raises ValueError if an Arrow schema read from a Parquet or Arrow file
+    was written with an unsupported schema version
+    :param pyarrow.Schema schema: Schema of the file
+    """
+    version = (schema.metadata or {}).get(SCHEMA_KEY.encode("utf-8"))
+    check_version(int(version) if version is not None else None)
+
+
+def check_version(version):
+    """Raises ValueError if results were written with an unsupported schema version
+    :param int version: Schema version the results were written with
+    """
+    if version != SCHEMA_VERSION:
+        msg = f"Unsupported schema version {version}, expected {SCHEMA_VERSION}"
+        raise ValueError(msg)
@@ -0,0 +1,186 @@
+import hashlib
+import json
+from datetime import datetime
+from http import HTTPStatus
+from pathlib import Path
+from typing import NamedTuple
+
+import pytz
+
+
+class CrawlDiff(NamedTuple):
+    """LeafDatasets added, removed and modified since a previous crawl"""
+
+    added: list
+    removed: list
+    modified: list
+
+
+def content_hash(xml_content):
+    """Returns the hash used to tell whether a catalog changed
+    :param bytes xml_content: XML Body returned from HTTP Request
+    """
+    return hashlib.sha256(xml_content).hexdigest()
+
+
+class CrawlSnapshot:
+    """The state of a finished crawl, used to seed the next crawl of the same catalog.
+
+    For every catalog the snapshot holds its validators (ETag/Last-Modified),
+    the hash of its content, the catalogRefs and dataset IDs it yielded and the
+    most recent modified date of those datasets. Every dataset found is kept
+    so unchanged catalogs can be reused without parsing them again.
+    """
+
+    VERSION = 1
+
+    def __init__(self, options=None):
+        """:param str options: Fingerprint of the crawl options the snapshot was recorded with"""
+        self.options = options
+        self.catalogs = {}
+        self.datasets = {}
+
+    def add_catalog(self, url, response, digest, references, dataset_ids):
+        """Records a crawled catalog
+        :param str url: URL of the catalog
+        :param XMLResponse response: The response the catalog was read from
+        :param str digest: content_hash of the catalog
+        :param list references: The catalogRef URLs followed from the catalog
+        :param list dataset_ids: IDs of the datasets yielded from the catalog
+        """
+        self.catalogs[url] = {
+            "etag": response.etag if response is not None else None,
+            "last_modified": response.last_modified if response is not None else None,
+            "hash": digest,
+            "references": list(references),
+            "datasets": list(dataset_ids),
+            "newest": None,
+            "undated": False,
+        }
+
+    def extend_catalog(self, url, references, dataset_ids):
+        """Records part of a catalog handed over in batches while it is crawled
+        :param str url: URL of the catalog
+        :param list references: The catalogRef URLs of the batch
+        :param list dataset_ids: IDs of the datasets of the batch
+        """
+        if url not in self.catalogs:
+            self.add_catalog(url, None, None, [], [])
+        record = self.catalogs[url]
+        record["references"] += references
+        record["datasets"] += dataset_ids
+
+    def finish_catalog(self, url, response, digest):
+        """Records the validators and the hash of a catalog handed over in batches, once it was read
+        :param str url: URL of the catalog
+        :param XMLResponse response: The response the catalog was read from
+        :param str digest: content_hash of the catalog
+        """
+        if url not in self.catalogs:
+            self.add_catalog(url, response, digest, [], [])
+        self.catalogs[url].update(etag=response.etag, last_modified=response.last_modified, hash=digest)
+
+    def reuse_catalog(self, previous, url):
+        """Copies the record of an unchanged catalog from a previous snapshot,
+        along with its datasets, and returns the record
+        :param CrawlSnapshot previous: The snapshot the catalog is recorded in
+        :param str url: URL of the catalog
+        """
+        record = self.catalogs[url] = dict(previous.catalogs[url])
+        for gid in record["datasets"]:
+            if gid in previous.datasets:
+                self.datasets[gid] = previous.datasets[gid]
+        return record
+
+    def add_dataset(self, dataset):
+        """Records a dataset and updates the modified date range of its catalog
+        :param dict dataset: The dataset as returned by LeafDataset.to_dict
+        """
+        self.datasets[dataset["id"]] = dataset
+        record = self.catalogs.get(dataset["catalog_url"])
+        if record is None:
+            return
+        if dataset.get("modified") is None:
+            record["undated"] = True
+        elif record["newest"] is None or dataset["modified"] > record["newest"]:
+            record["newest"] = dataset["modified"]
+
+    def unchanged(self, url, response, digest):
+        """Returns True if a catalog is the same as when the snapshot was recorded
+        :param str url: URL of the catalog
+        :param XMLResponse response: The response to the (conditional) request for the catalog
+        :param str digest: content_hash of the catalog, None if it was not sent
+        """
+        record = self.catalogs.get(url)
+        if record is None or response is None:
+            return False
+        if response.status == HTTPStatus.NOT_MODIFIED and (record["etag"] or record["last_modified"]):
+            return True
+        return digest is not None and record["hash"] == digest
+
+    def settled(self, url, cutoff):
+        """Returns the URLs of the catalogs in the subtree starting at url if none
+        of its datasets were modified after cutoff, or None if the subtree may have changed
+        :param str url: URL of the catalog at the top of the subtree
+        :param datetime cutoff: Subtrees whose newest dataset is older than this are settled
+        """
+        cutoff = cutoff.astimezone(pytz.utc).isoformat()
+        urls = []
+        stack = [url]
+        while stack:
+            u = stack.pop()
+            record = self.catalogs.get(u)
+            if record is None or record["undated"]:
+                return None
+            if record["newest"] is not None and record["newest"] >= cutoff:
+                return None
+            urls.append(u)
+            stack.extend(record["references"])
+        return urls
+
+    def diff(self, previous):
+        """Returns the CrawlDiff between a previous snapshot and this one
+        :param CrawlSnapshot previous: Snapshot of the previous crawl
+        """
+        # Avoid a circular import, crawl imports this module
+        from thredds_crawler.crawl import LeafDataset  # noqa: PLC0415
+
+        added = [LeafDataset.from_dict(d) for gid, d in self.datasets.items() if gid not in previous.datasets]
+        removed = [LeafDataset.from_dict(d) for gid, d in previous.datasets.items() if gid not in self.datasets]
+        modified = [
+            LeafDataset.from_dict(d)
+            for gid, d in self.datasets.items()
+            if gid in previous.datasets and previous.datasets[gid] != d
+        ]
+        return CrawlDiff(added, removed, modified)
+
+    def save(self, path):
+        """Writes the snapshot to a JSON file
+        :param str path: Path of the file
+        """
+        with Path(path).open("w") as f:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "created": datetime.now(pytz.utc).isoformat(),
+                    "options": self.options,
+                    "catalogs": self.catalogs,
+                    "datasets": self.datasets,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path) -> "CrawlSnapshot":
+        """Reads a snapshot written by save
+        :param str path: Path of the file
+        """
+        with Path(path).open() as f:
+            data = json.load(f)
+        if data.get("version") != cls.VERSION:
+            msg = "Unsupported snapshot version {}".format(data.get("version"))
+            raise ValueError(msg)
+        snapshot = cls(data["options"])
+        snapshot.catalogs = data["catalogs"]
+        snapshot.datasets = data["datasets"]
+        return snapshot
@@ -0,0 +1,234 @@
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+import bisect
+import threading
+import time
+from collections import Counter
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Upper bounds of the buckets of catalogRefs followed per catalog
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    """Counts observations in buckets of fixed upper bounds, the last bucket
+    holding everything above the highest bound
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """:param tuple bounds: Sorted upper bounds of the buckets"""
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Records an observation
+        :param float value: The observed value
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q quantile (the
+        largest value observed for the last bucket), None without observations
+        :param float q: Quantile between 0 and 1
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and seen > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        """Returns the histogram as a JSON serializable dict"""
+        return {
+            "bounds": list(self.bounds),
+            "counts": list(self.counts),
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+class CrawlStats:
+    """Counters, timings and histograms describing a crawl.
+
+    Every crawl records into its ``stats``: the requests made to each host,
+    the bytes received, the latency of catalog and dataset requests, the time
+    spent parsing catalogs, the catalogRefs not followed and the datasets left
+    out by each rule, the shape of the catalog tree and the errors by cause.
+    Stats passed to several crawls add up.
+
+    The ``on_request``, ``on_catalog`` and ``on_dataset`` hooks are called as
+    the crawl progresses, from the thread running the crawl, to feed another
+    metrics system. They are skipped entirely when None::
+
+        stats = CrawlStats(on_request=lambda url, kind, status, elapsed, size: timer.observe(elapsed))
+        Crawl(url, stats=stats)
+    """
+
+    def __init__(self, on_request=None, on_catalog=None, on_dataset=None):
+        """:param on_request: Called with the URL, kind ("catalog" or "dataset"), HTTP status
+            (None if the request raised), seconds spent and bytes received of every request
+        :param on_catalog: Called with the URL, depth, catalogRef URLs followed and leaves of every catalog crawled
+        :param on_dataset: Called with every LeafDataset found
+        """
+        self.on_request = on_request
+        self.on_catalog = on_catalog
+        self.on_dataset = on_dataset
+        self.requests = Counter()  # By host
+        self.statuses = Counter()
+        self.bytes = 0
+        self.retries = 0
+        self.latency = {"catalog": Histogram(), "dataset": Histogram()}
+        self.parse_time = 0.0
+        self.catalogs = 0
+        self.datasets = 0
+        self.skipped = Counter()  # catalogRefs not followed, by rule
+        self.filtered = Counter()  # Datasets left out, by rule
+        self.depths = Counter()  # Catalogs crawled at each depth
+        self.fanout = Histogram(FANOUT_BUCKETS)
+        self.errors = Counter()  # By cause
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def max_depth(self):
+        return max(self.depths) if self.depths else None
+
+    @property
+    def elapsed(self):
+        """Seconds from the start of the crawl to its end, or to now if still running"""
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def start(self):
+        """Records the start of a crawl"""
+        self.started = time.time()
+        self.finished = None
+
+    def finish(self):
+        """Records the end of a crawl"""
+        self.finished = time.time()
+
+    def record_request(self, url, kind, status=None, elapsed=None, size=None):
+        """Records a request
+        :param str url: URL that was requested
+        :param str kind: "catalog" or "dataset"
+        :param int status: HTTP status, None if the request raised
+        :param float elapsed: Seconds spent requesting and downloading the response
+        :param int size: Bytes received
+        """
+        with self._lock:
+            self.requests[urlparse.urlsplit(url).netloc] += 1
+            self.statuses[status] += 1
+            if size:
+                self.bytes += size
+            if elapsed is not None:
+                self.latency[kind].observe(elapsed)
+        if self.on_request is not None:
+            self.on_request(url, kind, status, elapsed, size)
+
+    def record_retry(self):
+        """Records a request about to be retried"""
+        with self._lock:
+            self.retries += 1
+
+    def record_parse(self, parsed):
+        """Records the parse time and the filter rejections of a parsed catalog
+        :param ParsedCatalog parsed: The parsed catalog
+        """
+        with self._lock:
+            self.parse_time += parsed.parse_time
+            for (kind, rule), count in parsed.rejected.items():
+                if kind == "catalogRef":
+                    self.skipped[rule] += count
+                else:
+                    self.filtered[rule] += count
+
+    def record_catalog(self, url, depth, references, leaves):
+        """Records a crawled catalog
+        :param str url: URL of the catalog
+        :param int depth: Depth of the catalog, 0 for the root
+        :param list references: catalogRef URLs followed from the catalog
+        :param list leaves: LeafDatasets and dataset URLs found in the catalog
+        """
+        with self._lock:
+            self.catalogs += 1
+            self.depths[depth] += 1
+            self.fanout.observe(len(references))
+        if self.on_catalog is not None:
+            self.on_catalog(url, depth, references, leaves)
+
+    def record_skip(self, rule):
+        """Records a catalogRef that was not followed
+        :param str rule: Why, such as "visited"
+        """
+        with self._lock:
+            self.skipped[rule] += 1
+
+    def record_dataset(self, dataset):
+        """Records a dataset found
+        :param LeafDataset dataset: The dataset
+        """
+        self.datasets += 1
+        if self.on_dataset is not None:
+            self.on_dataset(dataset)
+
+    def record_error(self, cause):
+        """Records a failed catalog or dataset
+        :param str cause: What failed, such as "HTTP 404" or "invalid XML"
+        """
+        with self._lock:
+            self.errors[cause] += 1
+
+    def to_dict(self):
+        """Returns the stats as a JSON serializable dict"""
+        with self._lock:
+            return {
+                "started": self.started,
+                "finished": self.finished,
+                "elapsed": self.elapsed,
+                "requests": dict(self.requests),
+                "statuses": {str(k): v for k, v in self.statuses.items()},
+                "bytes": self.bytes,
+                "retries": self.retries,
+                "latency": {k: h.to_dict() for k, h in self.latency.items()},
+                "parse_time": self.parse_time,
+                "catalogs": self.catalogs,
+                "datasets": self.datasets,
+                "skipped": dict(self.skipped),
+                "filtered": dict(self.filtered),
+                "depths": {str(k): v for k, v in sorted(self.depths.items())},
+                "max_depth": self.max_depth,
+                "fanout": self.fanout.to_dict(),
+                "errors": dict(self.errors),
+            }
+
+    def __repr__(self):
+        return (
+            f"<CrawlStats catalogs: {self.catalogs}, datasets: {self.datasets}, requests: {sum(self.requests.values())}, "
+            f"bytes: {self.bytes}, errors: {sum(self.errors.values())}>"
+        )
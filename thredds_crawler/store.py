@@ -0,0 +1,163 @@
+import json
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS frontier (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT UNIQUE, kind TEXT, depth INTEGER, handled INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS visited (url TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS datasets (id TEXT PRIMARY KEY, data TEXT) WITHOUT ROWID;
+"""
+
+
+class CrawlStore:
+    """Keeps the state of a crawl in a SQLite database so it can be resumed.
+
+    The store holds the requests still to be made (the frontier), the catalog
+    URLs already seen and the datasets found so far. A request only leaves the
+    frontier once its response has been handled, together with the datasets
+    and requests it led to, so a crawl that stops at any point resumes from
+    the last commit without losing or repeating work. Commits are batched:
+    every ``batch_size`` changes or ``interval`` seconds, whichever comes first.
+    A catalog handed over in batches records how far it was handled along with
+    the datasets and requests of each batch, so its batches are not repeated.
+    The database uses write-ahead logging.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path, batch_size=1000, interval=5.0):
+        """:param str path: Path of the SQLite database, created if needed
+        :param int batch_size: Changes to make before committing them
+        :param float interval: Longest time between two commits, in seconds
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self._changes = 0
+        self._committed = time.monotonic()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def open(self, root, options):
+        """Prepares the store for a crawl and returns True if it resumes an
+        unfinished crawl of the same catalog, False if it starts a new one.
+        Raises ValueError if the store holds an unfinished crawl of another
+        catalog or with other options.
+        :param str root: URL of the root catalog
+        :param str options: Fingerprint of the crawl options
+        """
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        if meta and meta.get("complete") == "0":
+            if meta.get("version") != str(self.VERSION):
+                msg = "Unsupported store version {}".format(meta.get("version"))
+                raise ValueError(msg)
+            if meta.get("root") != root or meta.get("options") != options:
+                msg = "The store holds an unfinished crawl of {} with other options".format(meta.get("root"))
+                raise ValueError(msg)
+            return True
+
+        if meta and meta.get("version") != str(self.VERSION):
+            # Written by another version, start over with the current schema
+            self._db.execute("DROP TABLE frontier")
+            self._db.executescript(SCHEMA)
+        for statement in ("DELETE FROM meta", "DELETE FROM frontier", "DELETE FROM visited", "DELETE FROM datasets"):
+            self._db.execute(statement)
+        self._db.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?)",
+            [("version", str(self.VERSION)), ("root", root), ("options", options), ("complete", "0")],
+        )
+        self.commit()
+        return False
+
+    def pending(self):
+        """Returns the ``(kind, url, depth)`` of every request in the frontier, in the order they were added"""
+        return list(self._db.execute("SELECT kind, url, depth FROM frontier ORDER BY seq"))
+
+    def progress(self):
+        """Returns the number of references and leaves handled of the catalogs in the
+        frontier that were handed over in part, by URL
+        """
+        return dict(self._db.execute("SELECT url, handled FROM frontier WHERE handled > 0"))
+
+    def visited(self):
+        """Returns the set of catalog URLs seen so far"""
+        return {url for (url,) in self._db.execute("SELECT url FROM visited")}
+
+    def datasets(self):
+        """Yields every dataset found so far, as dicts returned by LeafDataset.to_dict"""
+        for (data,) in self._db.execute("SELECT data FROM datasets"):
+            yield json.loads(data)
+
+    def visit(self, url):
+        """Records a catalog URL as seen
+        :param str url: URL of the catalog
+        """
+        self._db.execute("INSERT OR IGNORE INTO visited (url) VALUES (?)", (url,))
+        self._changes += 1
+
+    def push(self, kind, url, depth):
+        """Adds a request to the frontier
+        :param str kind: "catalog" or "dataset"
+        :param str url: URL to request
+        :param int depth: Depth of the catalog the request belongs to
+        """
+        self._db.execute("INSERT OR IGNORE INTO frontier (url, kind, depth) VALUES (?, ?, ?)", (url, kind, depth))
+        self._changes += 1
+
+    def done(self, url, datasets=()):
+        """Removes a handled request from the frontier and records the datasets it led to
+        :param str url: URL that was requested
+        :param list datasets: Datasets found, as dicts returned by LeafDataset.to_dict
+        """
+        self._db.execute("DELETE FROM frontier WHERE url = ?", (url,))
+        self._db.executemany(
+            "INSERT OR REPLACE INTO datasets (id, data) VALUES (?, ?)",
+            [(d["id"], json.dumps(d)) for d in datasets],
+        )
+        self._changes += 1 + len(datasets)
+
+    def advance(self, url, handled, datasets=()):
+        """Records a batch of a catalog in the frontier as handled along with the datasets it led to
+        :param str url: URL of the catalog
+        :param int handled: Number of references and leaves of the catalog handled so far
+        :param list datasets: Datasets found in the batch, as dicts returned by LeafDataset.to_dict
+        """
+        self._db.execute("UPDATE frontier SET handled = ? WHERE url = ?", (handled, url))
+        self._db.executemany(
+            "INSERT OR REPLACE INTO datasets (id, data) VALUES (?, ?)",
+            [(d["id"], json.dumps(d)) for d in datasets],
+        )
+        self._changes += 1 + len(datasets)
+
+    def checkpoint(self):
+        """Commits the changes made so far if the batch is full or the interval elapsed"""
+        if self._changes >= self.batch_size or time.monotonic() - self._committed >= self.interval:
+            self.commit()
+
+    def commit(self):
+        """Commits the changes made so far"""
+        self._db.commit()
+        self._changes = 0
+        self._committed = time.monotonic()
+
+    def complete(self):
+        """Marks the crawl as finished, a new crawl with this store starts over"""
+        self._db.execute("UPDATE meta SET value = '1' WHERE key = 'complete'")
+        self.commit()
+
+    def close(self):
+        """Commits any pending change and closes the database"""
+        self.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc: object):
+        self.close()
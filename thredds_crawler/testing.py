@@ -0,0 +1,319 @@
+"""A synthetic THREDDS server for testing and benchmarking crawls without network access.
+
+    with SyntheticTDS(depth=3, fanout=4, datasets=50) as tds:
+        c = Crawl(tds.catalog_url)
+        assert len(c.datasets) == tds.total_datasets
+
+Run ``python -m thredds_crawler.testing`` to serve a synthetic tree until interrupted.
+"""
+
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+import argparse
+import contextlib
+import hashlib
+import logging
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytz
+
+from thredds_crawler.utils import INV_NS, XLINK_NS
+
+# Service name: (service type, base path). The TDS adds the dataset and catalog
+# to the URLs of the services named iso, ncml and uddc.
+SERVICES = {
+    "dap": ("OPENDAP", "/thredds/dodsC/"),
+    "http": ("HTTPServer", "/thredds/fileServer/"),
+    "iso": ("ISO", "/thredds/iso/"),
+    "ncml": ("NCML", "/thredds/ncml/"),
+    "uddc": ("UDDC", "/thredds/uddc/"),
+    "wms": ("WMS", "/thredds/wms/"),
+}
+
+DDS = "Dataset {\n    Float64 time[time = 24];\n    Float32 temp[time = 24][lat = 10][lon = 10];\n} %s;\n"
+
+logger = logging.getLogger(__name__)
+
+
+class LocalServer(ABC):
+    """A threaded HTTP server on localhost, started and stopped as a context
+    manager, answering every GET request with ``answer``. Connections are kept
+    alive like on a real TDS.
+    """
+
+    def __init__(self, port=0):
+        """:param int port: Port to listen on, any free port if 0"""
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @abstractmethod
+    def answer(self, request):
+        """Returns the ``(status, headers, body)`` to answer a GET request with
+        :param http.server.BaseHTTPRequestHandler request: The request, with its path, headers and client_address
+        """
+
+    def __enter__(self):
+        local = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Send the headers and body together, avoiding delayed ACK stalls
+            wbufsize = -1
+
+            def do_GET(self):
+                status, headers, body = local.answer(self)
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: object):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc: object):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class SyntheticTDS(LocalServer):
+    """Serves a generated catalog tree over HTTP on localhost.
+
+    The root catalog has ``fanout`` catalogRefs, each of those catalogs has
+    ``fanout`` more and so on down to ``depth`` levels below the root. Every
+    catalog lists ``datasets`` datasets offering the ``services`` given, with
+    modified dates spread between ``start`` and ``end``. Catalogs are built
+    when requested, so trees of any size are served without holding them in
+    memory, and the same parameters always produce the same tree.
+
+    Dataset documents (``catalog.xml?dataset=``), DDS for the OPeNDAP service
+    and small XML documents for the ISO, NcML and UDDC services are served as
+    well. Every response can be delayed by ``latency`` seconds (plus up to
+    ``jitter``) and a fraction ``error_rate`` of them answered with 503
+    Service Unavailable. The requests served are counted by kind in ``requests``.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        depth=2,
+        fanout=4,
+        datasets=10,
+        services=("dap", "http", "iso"),
+        start=datetime(2015, 1, 1, tzinfo=pytz.utc),
+        end=datetime(2017, 1, 1, tzinfo=pytz.utc),
+        sizes=True,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        seed=0,
+        port=0,
+    ):
+        """:param int depth: Levels of catalogs below the root
+        :param int fanout: catalogRefs in every catalog above the deepest level
+        :param int datasets: Datasets in every catalog
+        :param list services: Names of the services offered by every dataset, see SERVICES
+        :param datetime start: Earliest modified date of the datasets
+        :param datetime end: Latest modified date of the datasets
+        :param bool sizes: List the dataSize of the datasets in the catalogs
+        :param float latency: Seconds to wait before answering any request
+        :param float jitter: Up to this many more seconds, chosen at random, to wait before answering
+        :param float error_rate: Fraction of the requests answered with 503 Service Unavailable
+        :param int seed: Seed of the random latencies and errors
+        :param int port: Port to listen on, any free port if 0
+        """
+        super().__init__(port)
+        unknown = set(services) - set(SERVICES)
+        if unknown:
+            msg = f"Unknown services {sorted(unknown)}, choose from {sorted(SERVICES)}"
+            raise ValueError(msg)
+        self.depth = depth
+        self.fanout = fanout
+        self.datasets = datasets
+        self.services = list(services)
+        self.start = start
+        self.end = end
+        self.sizes = sizes
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self.errors = 0
+        self._random = random.Random(seed)  # noqa: S311
+        self._lock = threading.Lock()
+
+    @property
+    def catalog_url(self):
+        return self.url + "/thredds/catalog.xml"
+
+    @property
+    def total_catalogs(self):
+        return sum(self.fanout**level for level in range(self.depth + 1))
+
+    @property
+    def total_datasets(self):
+        return self.total_catalogs * self.datasets
+
+    def catalog_path(self, node):
+        """Returns the path of the catalog at node
+        :param tuple node: Index of the catalogRef followed at each level, () for the root
+        """
+        return "/thredds/{}catalog.xml".format("".join(f"c{i}/" for i in node))
+
+    def node(self, path):
+        """Returns the node of a catalog path, or None if there is no such catalog
+        :param str path: Path of the catalog, without any query string
+        """
+        parts = path.split("/")
+        if parts[:2] != ["", "thredds"] or parts[-1] != "catalog.xml":
+            return None
+        node = []
+        for part in parts[2:-1]:
+            if not part.startswith("c") or not part[1:].isdigit() or int(part[1:]) >= self.fanout:
+                return None
+            node.append(int(part[1:]))
+        if len(node) > self.depth:
+            return None
+        return tuple(node)
+
+    def dataset_id(self, node, index):
+        return "synthetic/{}file_{}.nc".format("".join(f"c{i}/" for i in node), index)
+
+    def modified(self, dataset_id):
+        """Returns the modified date of a dataset, the same on every request"""
+        fraction = int(hashlib.md5(dataset_id.encode("utf-8"), usedforsecurity=False).hexdigest()[:8], 16) / 0xFFFFFFFF
+        return self.start + timedelta(seconds=int((self.end - self.start).total_seconds() * fraction))
+
+    def dataset_xml(self, node, index, metadata=""):
+        gid = self.dataset_id(node, index)
+        size = f'<dataSize units="Kbytes">{index + 1}</dataSize>' if self.sizes else ""
+        modified = self.modified(gid).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return (
+            f'<dataset name="file_{index}.nc" ID="{gid}" urlPath="{gid}">'
+            f'{metadata}{size}<date type="modified">{modified}</date></dataset>'
+        )
+
+    def catalog_xml(self, node, only=None):
+        """Returns the catalog at node, or the document of one of its datasets,
+        None if there is no such dataset
+        :param tuple node: Index of the catalogRef followed at each level, () for the root
+        :param str only: ID of the dataset to return the document of
+        """
+        services = "".join(
+            f'<service name="{name}" serviceType="{SERVICES[name][0]}" base="{SERVICES[name][1]}" />' for name in self.services
+        )
+        header = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            f'<catalog xmlns="{INV_NS}" xmlns:xlink="{XLINK_NS}" name="Synthetic" version="1.0.1">'
+            f'<service name="all" serviceType="Compound" base="">{services}</service>'
+        )
+        metadata = '<metadata inherited="true"><serviceName>all</serviceName><dataType>Grid</dataType></metadata>'
+        if only is not None:
+            # Like the TDS, a single dataset with the metadata it inherits
+            for i in range(self.datasets):
+                if self.dataset_id(node, i) == only:
+                    return header + self.dataset_xml(node, i, metadata) + "</catalog>"
+            return None
+
+        refs = ""
+        if len(node) < self.depth:
+            refs = "".join(
+                f'<catalogRef xlink:href="c{i}/catalog.xml" xlink:title="Catalog {i}" name="" />' for i in range(self.fanout)
+            )
+        datasets = "".join(self.dataset_xml(node, i) for i in range(self.datasets))
+        return (
+            header
+            + f'<dataset name="Synthetic {len(node)}" ID="synthetic/{len(node)}">{metadata}{datasets}</dataset>{refs}</catalog>'
+        )
+
+    def respond(self, target):
+        """Returns the ``(kind, status, content type, body)`` to answer a request with
+        :param str target: Request path, including any query string
+        """
+        parts = urlparse.urlsplit(target)
+        query = urlparse.parse_qs(parts.query)
+        node = self.node(parts.path)
+        if node is not None:
+            if "dataset" in query:
+                body = self.catalog_xml(node, query["dataset"][0])
+                if body is not None:
+                    return "dataset", 200, "application/xml", body
+                return "missing", 404, "text/plain", "Not Found"
+            return "catalog", 200, "application/xml", self.catalog_xml(node)
+        if parts.path.startswith("/thredds/dodsC/") and parts.path.endswith(".dds"):
+            return "service", 200, "text/plain", DDS % parts.path.rsplit("/", 1)[1][:-4]
+        for name in ("iso", "ncml", "uddc"):
+            if parts.path.startswith(SERVICES[name][1]):
+                return "service", 200, "application/xml", f"<{name}>{parts.path}</{name}>"
+        return "missing", 404, "text/plain", "Not Found"
+
+    def answer(self, request):
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate and self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            kind, status, content_type, body = "error", 503, "text/plain", "Service Unavailable"
+            with self._lock:
+                self.errors += 1
+        else:
+            kind, status, content_type, body = self.respond(request.path)
+        with self._lock:
+            self.requests[kind] += 1
+        return status, {"Content-Type": content_type}, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a synthetic THREDDS catalog tree on localhost")
+    parser.add_argument("--depth", type=int, default=2, help="Levels of catalogs below the root")
+    parser.add_argument("--fanout", type=int, default=4, help="catalogRefs per catalog")
+    parser.add_argument("--datasets", type=int, default=10, help="Datasets per catalog")
+    parser.add_argument("--services", default="dap,http,iso", help="Comma separated services, from {}".format(",".join(SERVICES)))
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    args = parser.parse_args()
+
+    tds = SyntheticTDS(
+        depth=args.depth,
+        fanout=args.fanout,
+        datasets=args.datasets,
+        services=args.services.split(","),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        port=args.port,
+    )
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    with tds:
+        logger.info("Serving %d catalogs and %d datasets at %s", tds.total_catalogs, tds.total_datasets, tds.catalog_url)
+        with contextlib.suppress(KeyboardInterrupt):
+            tds.thread.join()
+
+
+if __name__ == "__main__":
+    main()
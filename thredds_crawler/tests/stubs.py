@@ -0,0 +1,106 @@
+import time
+from pathlib import Path
+
+from thredds_crawler.testing import LocalServer
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def resource(name):
+    """Returns the bytes of a file in the test resources directory
+    :param str name: File name relative to the resources directory
+    """
+    return (RESOURCES / name).read_bytes()
+
+
+# A small catalog tree: an inherited metadata collection, a catalogRef and
+# one dataset that has to be requested individually
+CATALOG_ROUTES = {
+    "/thredds/catalog.xml": resource("catalog.xml"),
+    "/thredds/child/catalog.xml": resource("child.xml"),
+    "/thredds/child/catalog.xml?dataset=child/one.nc": resource("child_one.xml"),
+}
+# The IDs of the datasets found crawling CATALOG_ROUTES, sorted
+CATALOG_DATASETS = ["child/one.nc", "child/two.nc", "test/agg", "test/dap"]
+
+# A catalog offering an OPeNDAP service, its catalogRefs and datasets going in place of %s
+CATALOG = """<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <service name="dap" serviceType="OPENDAP" base="/thredds/dodsC/" />
+  %s
+</catalog>"""
+# A dataset of CATALOG from its name, ID and urlPath without the .nc extension
+DATASET = '<dataset name="%s" ID="%s" urlPath="%s.nc" serviceName="dap" />'
+# A catalogRef of CATALOG from the href without the .xml extension and the title
+REF = '<catalogRef xlink:href="%s.xml" xlink:title="%s" />'
+
+
+def slow_routes(name, count, lock, active, delay=0.05):
+    """Returns the routes of a root catalog referencing count catalogs that each
+    take delay seconds to answer and list a dataset with the ID name. The
+    requests in flight are counted in ``active[0]`` and the most at once in ``active[1]``.
+    :param str name: ID of the dataset of the referenced catalogs
+    :param int count: Number of referenced catalogs
+    :param threading.Lock lock: Lock guarding active
+    :param list active: Two counters, both 0 to start with
+    :param float delay: Seconds each referenced catalog takes to answer
+    """
+
+    def slow(_headers):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(delay)
+        with lock:
+            active[0] -= 1
+        return 200, {}, CATALOG % (DATASET % (name, name, name))
+
+    refs = "".join(REF % (i, i) for i in range(count))
+    routes = {f"/{i}.xml": slow for i in range(count)}
+    routes["/catalog.xml"] = CATALOG % refs
+    return routes
+
+
+def stalled_routes(delay):
+    """Returns the routes of a root catalog listing the dataset "a" and a
+    catalogRef to a catalog that takes delay seconds to answer
+    :param float delay: Seconds the referenced catalog takes to answer
+    """
+
+    def stalled(_headers):
+        time.sleep(delay)
+        return 200, {}, CATALOG % ""
+
+    return {"/catalog.xml": CATALOG % (DATASET % ("a", "a", "a") + REF % ("stalled", "stalled")), "/stalled.xml": stalled}
+
+
+class StubServer(LocalServer):
+    """A local HTTP server answering with canned responses so crawls can be
+    tested without network access.
+
+    Routes map a request path (including any query string) to either the body
+    to return or a callable taking the request headers and returning a
+    ``(status, headers, body)`` tuple.
+    """
+
+    def __init__(self, routes=None):
+        super().__init__()
+        self.routes = dict(routes or {})
+        self.requests = []
+        self.connections = set()
+
+    def count(self, path):
+        """Returns how many times a path was requested
+        :param str path: Request path, including any query string
+        """
+        return sum(1 for p, _ in self.requests if p == path)
+
+    def answer(self, request):
+        self.requests.append((request.path, dict(request.headers)))
+        self.connections.add(request.client_address)
+        route = self.routes.get(request.path)
+        if route is None:
+            return 404, {}, b"Not Found"
+        if callable(route):
+            return route(request.headers)
+        return 200, {"Content-Type": "application/xml"}, route
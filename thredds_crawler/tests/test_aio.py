@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from thredds_crawler.aio import AsyncCrawl, crawl_async
+from thredds_crawler.cache import HTTPCache
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer, slow_routes, stalled_routes
+
+# Catalogs referenced by slow_routes and the requests allowed in flight to their host
+COUNT = 20
+PER_HOST = 3
+# Seconds the stalled catalog takes to answer
+STALL = 1
+
+
+class AsyncCrawlTest(unittest.TestCase):
+    def test_crawl_async(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = asyncio.run(crawl_async(server.url + "/thredds/catalog.xml", per_host=2))
+        assert isinstance(c, AsyncCrawl)
+        assert sorted(d.id for d in c.datasets) == CATALOG_DATASETS
+        assert server.count("/thredds/child/catalog.xml?dataset=child/one.nc") == 1
+
+    def test_cache_off_loop(self):
+        threads = set()
+
+        class RecordingCache(HTTPCache):
+            def update(self, url, auth, response):
+                threads.add(threading.current_thread())
+                return super().update(url, auth, response)
+
+        with StubServer(CATALOG_ROUTES) as server:
+            c = asyncio.run(crawl_async(server.url + "/thredds/catalog.xml", cache=RecordingCache()))
+        assert sorted(d.id for d in c.datasets) == CATALOG_DATASETS
+        # The event loop runs on the main thread, the cache is only read and written on the pool
+        assert threads
+        assert threading.main_thread() not in threads
+
+    def test_per_host_limit(self):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        routes = slow_routes("a", COUNT, lock, active)
+
+        async def crawl(url):
+            # Run from inside an already running event loop
+            return await AsyncCrawl(url, per_host=PER_HOST)
+
+        with StubServer(routes) as server:
+            c = asyncio.run(crawl(server.url + "/catalog.xml"))
+        assert len(c.datasets) == COUNT
+        assert 1 < active[1] <= PER_HOST
+
+    def test_close_early(self):
+        async def first(url):
+            datasets = AsyncCrawl(url).iter_datasets()
+            ds = await datasets.__anext__()
+            # Let the stalled catalog be requested
+            await asyncio.sleep(0.2)
+            start = time.monotonic()
+            await datasets.aclose()
+            return ds, time.monotonic() - start
+
+        with StubServer(stalled_routes(STALL)) as server:
+            ds, elapsed = asyncio.run(first(server.url + "/catalog.xml"))
+        assert ds.id == "a"
+        # Closing does not wait on the event loop for the stalled request still in flight
+        assert elapsed < STALL / 2
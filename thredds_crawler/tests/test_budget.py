@@ -0,0 +1,110 @@
+import asyncio
+import time
+import unittest
+from datetime import timedelta
+
+from thredds_crawler.aio import AsyncCrawl
+from thredds_crawler.budget import CrawlBudget
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.frontier import newest_first
+from thredds_crawler.tests.stubs import CATALOG, CATALOG_DATASETS, CATALOG_ROUTES, REF, StubServer
+from thredds_crawler.throttle import RequestScheduler
+
+ROOT_DATASETS = ["test/agg", "test/dap"]
+
+
+def dated_routes():
+    """A catalog per year holding a catalog per month of two datasets each"""
+    years = (2015, 2016, 2017)
+    months = ("01", "02", "03")
+    routes = {"/thredds/catalog.xml": CATALOG % "".join(REF % (f"{y}/catalog", y) for y in years)}
+    for year in years:
+        routes[f"/thredds/{year}/catalog.xml"] = CATALOG % "".join(REF % (f"{m}/catalog", m) for m in months)
+        for month in months:
+            routes[f"/thredds/{year}/{month}/catalog.xml"] = CATALOG % "".join(
+                f'<dataset name="{i}" ID="{year}-{month}-{i}" urlPath="{i}.nc" serviceName="dap" />' for i in range(2)
+            )
+    return routes
+
+
+class CrawlBudgetTest(unittest.TestCase):
+    def test_max_depth(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, budget=CrawlBudget(max_depth=0))
+        assert sorted(d.id for d in c.datasets) == ROOT_DATASETS
+        assert c.complete is False
+        assert c.budget.exhausted == {"max_depth"}
+        assert c.stats.skipped["max_depth"] == 1
+        assert server.count("/thredds/child/catalog.xml") == 0
+
+    def test_max_catalogs(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, budget=CrawlBudget(max_catalogs=1))
+        assert sorted(d.id for d in c.datasets) == ROOT_DATASETS
+        assert c.budget.exhausted == {"max_catalogs"}
+
+    def test_complete(self):
+        budget = CrawlBudget(max_depth=5, max_catalogs=10, max_datasets=10, deadline=timedelta(minutes=1))
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, budget=budget)
+            assert len(c.datasets) == len(CATALOG_DATASETS)
+            assert c.complete is True
+            assert Crawl(server.url + "/thredds/catalog.xml", workers=2).complete is True
+
+    def test_exact_limit(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            url = server.url + "/thredds/catalog.xml"
+            limit = len(CATALOG_DATASETS)
+            c = Crawl(url, workers=2, budget=CrawlBudget(max_datasets=limit))
+            assert len(c.datasets) == limit
+            assert c.complete is True
+            c = asyncio.run(AsyncCrawl(url, budget=CrawlBudget(max_datasets=limit)).run())
+            assert len(c.datasets) == limit
+            assert c.complete is True
+
+    def test_newest_datasets(self):
+        with StubServer(dated_routes()) as server:
+            limit = 4
+            budget = CrawlBudget(max_datasets=limit)
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=1, priority=newest_first(), budget=budget)
+        assert len(c.datasets) == limit
+        assert all(d.id.startswith("2017-") for d in c.datasets)
+        assert c.budget.exhausted == {"max_datasets"}
+        assert c.complete is False
+
+    def test_deadline(self):
+        deadline = 0.5
+
+        def slow(_headers):
+            time.sleep(deadline * 4)
+            return 200, {}, CATALOG_ROUTES["/thredds/child/catalog.xml"]
+
+        routes = dict(CATALOG_ROUTES)
+        routes["/thredds/child/catalog.xml"] = slow
+        scheduler = RequestScheduler()
+        with StubServer(routes) as server:
+            url = server.url + "/thredds/catalog.xml"
+            start = time.monotonic()
+            c = Crawl(url, workers=2, scheduler=scheduler, budget=CrawlBudget(deadline=deadline))
+            assert time.monotonic() - start < deadline * 3
+            assert sorted(d.id for d in c.datasets) == ROOT_DATASETS
+            assert c.budget.exhausted == {"deadline"}
+            # The request abandoned in flight gave its place back
+            assert scheduler.host(url).active == 0
+
+            start = time.monotonic()
+            c = asyncio.run(AsyncCrawl(url, scheduler=scheduler, budget=CrawlBudget(deadline=deadline)).run())
+            assert time.monotonic() - start < deadline * 3
+            assert sorted(d.id for d in c.datasets) == ROOT_DATASETS
+            assert c.complete is False
+            assert scheduler.host(url).active == 0
+
+    def test_async(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            url = server.url + "/thredds/catalog.xml"
+            c = asyncio.run(AsyncCrawl(url, budget=CrawlBudget(max_depth=0)).run())
+            assert sorted(d.id for d in c.datasets) == ROOT_DATASETS
+            assert c.budget.exhausted == {"max_depth"}
+            c = asyncio.run(AsyncCrawl(url, budget=CrawlBudget(max_datasets=1)).run())
+            assert len(c.datasets) == 1
+            assert c.complete is False
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from thredds_crawler.aio import AsyncCrawl
+from thredds_crawler.cache import CacheEntry, HTTPCache, cache_key
+from thredds_crawler.crawl import Crawl, XMLResponse
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer
+
+
+def conditional(body, etag):
+    """Returns a stub route answering 304 when the request carries the ETag"""
+
+    def route(headers):
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag, "Content-Type": "application/xml"}, body
+
+    return route
+
+
+def cached_file(cache, url):
+    """Returns the path of the file a response is cached in on disk"""
+    key = cache_key(url)
+    return Path(cache.path) / key[:2] / key
+
+
+class HTTPCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.routes = {path: conditional(body, f'"{i}"') for i, (path, body) in enumerate(CATALOG_ROUTES.items())}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_revalidation(self):
+        with StubServer(self.routes) as server:
+            url = server.url + "/thredds/catalog.xml"
+            first = Crawl(url, workers=2, cache=HTTPCache(self.path))
+
+            cache = HTTPCache(self.path)
+            second = Crawl(url, workers=2, cache=cache)
+
+        assert sorted(d.id for d in first.datasets) == sorted(d.id for d in second.datasets)
+        # Both catalogs and the individually requested dataset were revalidated
+        assert cache.hits == len(CATALOG_ROUTES)
+        assert cache.misses == 0
+        assert sum(1 for _, headers in server.requests if headers.get("If-None-Match")) == len(CATALOG_ROUTES)
+
+    def test_async_revalidation(self):
+        cache = HTTPCache()
+        with StubServer(self.routes) as server:
+            url = server.url + "/thredds/catalog.xml"
+            first = asyncio.run(AsyncCrawl(url, cache=cache).run())
+            second = asyncio.run(AsyncCrawl(url, cache=cache).run())
+        assert len(second.datasets) == len(first.datasets) == len(CATALOG_DATASETS)
+        assert cache.hits == len(CATALOG_ROUTES)
+        assert cache.misses == len(CATALOG_ROUTES)
+
+    def test_auth_identity(self):
+        cache = HTTPCache()
+        cache.update("http://a/catalog.xml", ("user", "one"), XMLResponse(200, b"<a/>", '"1"', None))
+        assert cache.validators("http://a/catalog.xml", ("user", "one")) == {"If-None-Match": '"1"'}
+        assert cache.validators("http://a/catalog.xml", ("user", "two")) == {}
+        assert cache.validators("http://a/catalog.xml") == {}
+
+    def test_uncacheable(self):
+        cache = HTTPCache(self.path)
+        responses = {
+            "http://a/catalog.xml": XMLResponse(200, b"<a/>", None, None),
+            "http://a/missing.xml": XMLResponse(404, b"", '"1"', None),
+        }
+        for url, response in responses.items():
+            assert cache.update(url, None, response) == response.body
+        assert cache.stores == 0
+        assert cache.misses == len(responses)
+
+    def test_max_age(self):
+        cache = HTTPCache(self.path, max_age=60)
+        cache.put("http://a/old.xml", None, CacheEntry(b"<old/>", '"1"', None, time.time() - 120))
+        cache.put("http://a/new.xml", None, CacheEntry(b"<new/>", '"2"', None, time.time()))
+        assert cache.get("http://a/old.xml") is None
+        assert cache.get("http://a/new.xml").body == b"<new/>"
+        assert cache.evictions == 1
+
+    def test_max_size(self):
+        cache = HTTPCache(self.path, max_size=2500, memory_size=1)
+        count, kept = 5, 2
+        for i in range(count):
+            cache.put(f"http://a/{i}.xml", None, CacheEntry(b"x" * 1000, f'"{i}"', None, time.time()))
+            # Distinct modification times for a deterministic eviction order
+            os.utime(cached_file(cache, f"http://a/{i}.xml"), (i, i))
+        assert cache.evictions == count - kept
+        assert cache.get("http://a/0.xml") is None
+        assert cache.get("http://a/4.xml").body == b"x" * 1000
+
+    def test_evicted_while_revalidating(self):
+        cache = HTTPCache(self.path, max_age=60)
+        cache.put("http://a/old.xml", None, CacheEntry(b"<old/>", '"1"', None, time.time() - 59.9))
+        assert cache.validators("http://a/old.xml") == {"If-None-Match": '"1"'}
+        time.sleep(0.2)
+        # The response expired before the server answered, the 304 still gets its body
+        assert cache.update("http://a/old.xml", None, XMLResponse(304, None, '"1"', None)) == b"<old/>"
+        assert cache.hits == 1
+
+    def test_overwrite_size(self):
+        cache = HTTPCache(self.path, max_size=2500, memory_size=1)
+        for i in range(5):
+            cache.put("http://a/same.xml", None, CacheEntry(b"x" * 1000, f'"{i}"', None, time.time()))
+        cache.put("http://a/other.xml", None, CacheEntry(b"x" * 1000, '"o"', None, time.time()))
+        # Replacing a response does not count its old size
+        assert cache.evictions == 0
+        # Nor is the size counted less than the size on disk, a third response does not fit
+        cache.put("http://a/third.xml", None, CacheEntry(b"x" * 1000, '"t"', None, time.time()))
+        assert cache.evictions == 1
+
+    def test_disk_lru_memory_hits(self):
+        cache = HTTPCache(self.path, max_size=2500, memory_size=2)
+        for i in range(2):
+            cache.put(f"http://a/{i}.xml", None, CacheEntry(b"x" * 1000, f'"{i}"', None, time.time()))
+            os.utime(cached_file(cache, f"http://a/{i}.xml"), (i, i))
+        # Answered from memory, the first response is still the most recently used on disk
+        assert cache.get("http://a/0.xml") is not None
+        cache.put("http://a/2.xml", None, CacheEntry(b"x" * 1000, '"2"', None, time.time()))
+        assert cache.evictions == 1
+        assert cached_file(cache, "http://a/0.xml").exists()
+        assert not cached_file(cache, "http://a/1.xml").exists()
+
+    def test_memory_lru(self):
+        cache = HTTPCache(memory_size=2)
+        for i in range(3):
+            cache.put(f"http://a/{i}.xml", None, CacheEntry(b"", f'"{i}"', None, time.time()))
+        assert cache.get("http://a/0.xml") is None
+        assert cache.get("http://a/2.xml") is not None
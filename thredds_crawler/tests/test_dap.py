@@ -0,0 +1,141 @@
+import unittest
+from unittest import mock
+
+import pytest
+
+from thredds_crawler import dap
+from thredds_crawler.crawl import Crawl, LeafDataset, Service
+from thredds_crawler.tests.stubs import StubServer
+
+GRID_DDS = """Dataset {
+    Float64 time[time = 12];
+    Float32 lat[lat = 180];
+    Float32 lon[lon = 360];
+    Grid {
+     ARRAY:
+        Int16 sst[time = 12][lat = 180][lon = 360];
+     MAPS:
+        Float64 time[time = 12];
+        Float32 lat[lat = 180];
+        Float32 lon[lon = 360];
+    } sst;
+    String title;
+} sst.nc;
+"""
+
+STRUCTURE_DDS = """Dataset {
+    Structure {
+        Int32 id;
+        Float64 depth[z = 10];
+    } profile[profile = 5];
+    Sequence {
+        Float32 temperature;
+    } obs;
+    Byte flags[3][4];
+} casts.nc;
+"""
+
+CATALOG = """<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0">
+  <service name="dap" serviceType="OPENDAP" base="/thredds/dodsC/" />
+  <dataset name="sst" ID="sst" urlPath="sst.nc"><serviceName>dap</serviceName></dataset>
+  <dataset name="casts" ID="casts" urlPath="casts.nc"><serviceName>dap</serviceName></dataset>
+  <dataset name="sized" ID="sized" urlPath="sized.nc"><serviceName>dap</serviceName>
+    <dataSize units="Mbytes">12.5</dataSize></dataset>
+</catalog>"""
+
+ROUTES = {
+    "/thredds/catalog.xml": CATALOG,
+    "/thredds/dodsC/sst.nc.dds": GRID_DDS,
+    "/thredds/dodsC/casts.nc.dds": STRUCTURE_DDS,
+}
+
+GRID_BYTES = 12 * 8 + 180 * 4 + 360 * 4 + 12 * 180 * 360 * 2
+STRUCTURE_BYTES = 5 * (4 + 10 * 8) + 3 * 4
+
+
+class ParseDDSTest(unittest.TestCase):
+    def test_grid(self):
+        # The maps of a Grid are not counted twice
+        assert dap.parse_dds(GRID_DDS) == GRID_BYTES
+
+    def test_structure(self):
+        assert dap.parse_dds(STRUCTURE_DDS) == STRUCTURE_BYTES
+
+    def test_invalid(self):
+        for dds in ("", "Dataset {", "Dataset { Complex64 x[3]; } d;", "Dataset { Int32 x[n = many]; } d;"):
+            with pytest.raises(dap.DDSError):
+                dap.parse_dds(dds)
+
+
+class ResolveSizesTest(unittest.TestCase):
+    def setUp(self):
+        dap.clear()
+        self.addCleanup(dap.clear)
+
+    def test_resolve_sizes(self):
+        with StubServer(ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2)
+            sizes = c.resolve_sizes(workers=4)
+            assert sizes == {"sst": GRID_BYTES * 1e-6, "casts": STRUCTURE_BYTES * 1e-6, "sized": 12.5}
+            # Memoized per endpoint
+            assert [d.size for d in sorted(c.datasets, key=lambda d: d.id)] == [
+                STRUCTURE_BYTES * 1e-6,
+                12.5,
+                GRID_BYTES * 1e-6,
+            ]
+            c.resolve_sizes()
+        assert server.count("/thredds/dodsC/sst.nc.dds") == 1
+        assert server.count("/thredds/dodsC/casts.nc.dds") == 1
+        assert server.count("/thredds/dodsC/sized.nc.dds") == 0
+
+    def test_unavailable(self):
+        d = LeafDataset()
+        assert d.size is None
+        with StubServer({}) as server:
+            d.services = (Service("dap", "OPENDAP", server.url + "/thredds/dodsC/missing.nc"),)
+            # Without netCDF4 the size is unknown, and not remembered
+            if dap.netCDF4 is None:
+                for count in range(1, 3):
+                    assert d.size is None
+                    assert server.count("/thredds/dodsC/missing.nc.dds") == count
+
+    def test_netcdf_closed(self):
+        nc = mock.MagicMock()
+        nc.__enter__.return_value = nc
+        type(nc).variables = mock.PropertyMock(side_effect=RuntimeError("NetCDF: Access failure"))
+        with mock.patch.object(dap, "netCDF4") as netcdf4:
+            netcdf4.Dataset.return_value = nc
+            assert dap.netcdf_size("http://localhost/thredds/dodsC/broken.nc") is None
+        # Closed even though reading it failed
+        nc.__exit__.assert_called_once()
+
+    def test_lazy(self):
+        with StubServer(ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, lazy=True)
+            with pytest.raises(ValueError, match="lazy"):
+                c.resolve_sizes()
+            datasets = list(c.iter_datasets())
+            assert c.resolve_sizes(datasets)["sst"] == GRID_BYTES * 1e-6
+
+    def test_auth(self):
+        def protected(body):
+            def route(headers):
+                if headers.get("Authorization") is None:
+                    return 401, {}, b"Unauthorized"
+                return 200, {"Content-Type": "application/xml"}, body
+
+            return route
+
+        with StubServer({path: protected(body) for path, body in ROUTES.items()}) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, auth=("user", "secret"))
+            # The DDS is requested with the credentials of the crawl
+            assert {d.id: d.size for d in c.datasets}["sst"] == GRID_BYTES * 1e-6
+
+    def test_bounded_memory(self):
+        names = ("sst", "casts", "sst", "casts")
+        with StubServer(ROUTES) as server, mock.patch.object(dap, "MEMORY_SIZE", 1):
+            for name in names:
+                dap.dataset_size(server.url + f"/thredds/dodsC/{name}.nc")
+        # Only the last size is remembered, every request is made again
+        for name in set(names):
+            assert server.count(f"/thredds/dodsC/{name}.nc.dds") == names.count(name)
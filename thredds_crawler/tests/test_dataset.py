@@ -0,0 +1,62 @@
+import json
+import pickle
+import unittest
+
+import pytest
+
+from thredds_crawler.crawl import INV_NS, CatalogParser, LeafDataset, Service
+from thredds_crawler.tests.stubs import resource
+
+URL = "http://localhost/thredds/catalog.xml"
+
+
+class LeafDatasetTest(unittest.TestCase):
+    def setUp(self):
+        self.agg, self.dap = CatalogParser().parse(URL, [resource("catalog.xml")]).leaves[:2]
+
+    def test_slots(self):
+        assert not hasattr(self.agg, "__dict__")
+        with pytest.raises(AttributeError):
+            self.agg.color = "blue"
+
+    def test_services(self):
+        service = self.agg.services[0]
+        assert isinstance(service, Service)
+        assert service.get("service") == service["service"] == service.service == "OPENDAP"
+        assert service.get("missing") is None
+        fields = {"name": "odap", "service": "OPENDAP", "url": "http://localhost/thredds/dodsC/test/agg.nc"}
+        assert dict(service) == fields
+        assert service == fields
+        assert "url" in service
+        assert "color" not in service
+        assert list(service) == ["name", "service", "url"]
+        assert dict(service.items()) == fields
+        assert list(service.values()) == list(fields.values())
+        # json only takes dicts
+        assert json.loads(json.dumps(dict(service))) == fields
+        assert json.loads(json.dumps(self.agg.to_dict()))["services"][0] == fields
+        with pytest.raises(TypeError, match="not JSON serializable"):
+            json.dumps(service)
+        # Names, types and catalog URLs are shared between datasets
+        assert self.agg.services[0].service is self.dap.services[0].service
+        assert self.agg.catalog_url is self.dap.catalog_url
+
+    def test_lazy_metadata(self):
+        # Kept as bytes, the same bytes are returned until the metadata is parsed
+        raw = self.agg.metadata_bytes()
+        assert isinstance(raw, bytes)
+        assert self.agg.metadata_bytes() is raw
+        assert self.agg.metadata.find(f"{{{INV_NS}}}documentation").text == "Aggregation docs"
+        assert self.agg.metadata_bytes() is not raw
+
+    def test_pickle(self):
+        assert self.agg.metadata is not None
+        copy = pickle.loads(pickle.dumps(self.agg))  # noqa: S301
+        assert copy.metadata_bytes() is copy.metadata_bytes()
+        assert copy.to_dict() == self.agg.to_dict()
+        assert copy.services[0].service is self.dap.services[0].service
+
+    def test_dict(self):
+        copy = LeafDataset.from_dict(self.agg.to_dict())
+        assert copy.services == self.agg.services
+        assert copy.metadata.find(f"{{{INV_NS}}}documentation").text == "Aggregation docs"
@@ -0,0 +1,52 @@
+import multiprocessing as mp
+import os
+import threading
+import unittest
+
+import pytest
+
+from thredds_crawler.crawl import Crawler, session
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer
+
+
+class EngineTest(unittest.TestCase):
+    def test_reuse(self):
+        workers, crawls = 2, 3
+        with StubServer(CATALOG_ROUTES) as server, Crawler(workers=workers) as crawler:
+            pids = sorted(p.pid for p in mp.active_children())
+            for _ in range(crawls):
+                c = crawler.crawl(server.url + "/thredds/catalog.xml")
+                assert sorted(d.id for d in c.datasets) == CATALOG_DATASETS
+            assert sorted(d.id for d in crawler.crawl_iter(server.url + "/thredds/catalog.xml")) == CATALOG_DATASETS
+            # The same workers served every crawl
+            assert sorted(p.pid for p in mp.active_children()) == pids
+        # Every request of the crawls went over the kept alive connections of the workers
+        assert len(server.requests) == (crawls + 1) * len(CATALOG_ROUTES)
+        assert len(server.connections) <= workers
+        assert crawler.closed
+        with pytest.raises(ValueError, match="closed"):
+            crawler.crawl(server.url + "/thredds/catalog.xml")
+
+    def test_defaults(self):
+        with StubServer(CATALOG_ROUTES) as server, Crawler(workers=2, select=[".*two.*"]) as crawler:
+            assert [d.id for d in crawler.crawl(server.url + "/thredds/catalog.xml").datasets] == ["child/two.nc"]
+            c = crawler.crawl(server.url + "/thredds/catalog.xml", select=[".*agg.*"])
+            assert [d.id for d in c.datasets] == ["test/agg"]
+
+    def test_session_per_thread(self):
+        sessions = []
+        t = threading.Thread(target=lambda: sessions.append(session()))
+        t.start()
+        t.join()
+        assert session() is session()
+        assert sessions[0] is not session()
+
+    def test_session_after_fork(self):
+        parent = id(session())
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(w, b"1" if id(session()) != parent else b"0")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert os.read(r, 1) == b"1"
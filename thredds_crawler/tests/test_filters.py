@@ -0,0 +1,90 @@
+import re
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import pytest
+import pytz
+from lxml import etree
+
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.filters import DatasetFilter, PatternSet, combine
+from thredds_crawler.tests.stubs import CATALOG_ROUTES, StubServer
+from thredds_crawler.utils import INV_NS, parse_datetime
+
+
+def dataset(name, gid, modified=None):
+    date = f'<date type="modified">{modified}</date>' if modified else ""
+    return etree.fromstring(f'<dataset xmlns="{INV_NS}" name="{name}" ID="{gid}" urlPath="{gid}">{date}</dataset>')
+
+
+def no_dap(element):
+    return not element.get("ID").endswith("dap")
+
+
+class PatternSetTest(unittest.TestCase):
+    def test_combined(self):
+        patterns = [*Crawl.SKIPS, "^abc$", "x+y"]
+        ps = PatternSet(patterns)
+        assert combine(ps.patterns) is not None
+        for value in ["files/a.nc", "Individual Files", "abc", "abcd", "xxy", "yx", "", "Latest"]:
+            assert ps.match(value) == any(re.match(p, value) for p in patterns), value
+        assert not ps.match(None)
+
+    def test_uncombinable(self):
+        cases = [
+            ([r"(a)\1", "b"], "aa"),
+            (["(?i)abc", "def"], "ABC"),
+            ([re.compile("a", re.IGNORECASE), "b"], "A"),
+            (["(?P<x>a)", "(?P<x>b)"], "b"),
+            (["(a)?(?(1)b|c)", "d"], "ab"),
+        ]
+        for patterns, value in cases:
+            ps = PatternSet(patterns)
+            assert combine(ps.patterns) is None
+            assert ps.match(value)
+            assert not ps.match("zzz")
+
+    def test_empty(self):
+        assert not PatternSet([]).match("anything")
+
+
+class DatasetFilterTest(unittest.TestCase):
+    def test_dates_parsed_last(self):
+        f = DatasetFilter(select=["keep.*"], after=datetime(2016, 1, 15, tzinfo=pytz.utc))
+        with mock.patch("thredds_crawler.filters.parse_datetime", wraps=parse_datetime) as parse:
+            assert not f.accept_dataset(dataset("a", "other", "2016-01-20T00:00:00Z"))
+            parse.assert_not_called()
+            selected = [dataset("a", "keep/a", "2016-01-20T00:00:00Z"), dataset("a", "keep/b", "2016-01-10T00:00:00Z")]
+            assert [f.accept_dataset(d) for d in selected] == [True, False]
+            assert parse.call_count == len(selected)
+
+    def test_invalid_date(self):
+        # Left out with or without a time window, like datasets always were
+        assert not DatasetFilter().accept_dataset(dataset("a", "a", "not a date"))
+        assert not DatasetFilter(before=datetime.now(pytz.utc)).accept_dataset(dataset("a", "a", "not a date"))
+        assert DatasetFilter().accept_dataset(dataset("a", "a"))
+
+    def test_predicates(self):
+        f = DatasetFilter(predicates=[no_dap])
+        assert f.accept_dataset(dataset("a", "test/agg"))
+        assert not f.accept_dataset(dataset("a", "test/dap"))
+
+    def test_crawl_predicates(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, predicates=[no_dap])
+        assert sorted(d.id for d in c.datasets) == ["child/one.nc", "child/two.nc", "test/agg"]
+
+
+class ParseDatetimeTest(unittest.TestCase):
+    def test_formats(self):
+        expected = datetime(2016, 1, 10, 12, tzinfo=pytz.utc)
+        assert parse_datetime("2016-01-10T12:00:00Z") == expected
+        assert parse_datetime(" 2016-01-10T12:00:00 ") == expected
+        assert parse_datetime("2016-01-10T14:00:00+02:00") == expected
+        assert parse_datetime("2016-01-10T12:00:00.000Z") == expected
+        # Not ISO 8601, handled by dateutil
+        assert parse_datetime("Jan 10 2016 12:00") == expected
+        for invalid in ["", None, "yesterday"]:
+            with pytest.raises(ValueError):  # noqa: PT011
+                parse_datetime(invalid)
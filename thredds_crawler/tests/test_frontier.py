@@ -0,0 +1,54 @@
+import sys
+import unittest
+
+import pytest
+
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.frontier import Frontier, matching_first, newest_first
+from thredds_crawler.tests.stubs import CATALOG, CATALOG_DATASETS, CATALOG_ROUTES, DATASET, REF, StubServer
+
+
+class FrontierTest(unittest.TestCase):
+    def fill(self, frontier):
+        for depth, url in enumerate(["a", "b", "c"]):
+            frontier.push(url, depth)
+        return [frontier.pop()[0] for _ in range(len(frontier))]
+
+    def test_orders(self):
+        assert self.fill(Frontier("bfs")) == ["a", "b", "c"]
+        assert self.fill(Frontier("dfs")) == ["c", "b", "a"]
+        assert self.fill(Frontier(priority=lambda url, _depth: {"a": 2, "b": 0, "c": 1}[url])) == ["b", "c", "a"]
+
+    def test_invalid(self):
+        with pytest.raises(ValueError, match="order"):
+            Frontier("random")
+        with pytest.raises(ValueError, match="priority"):
+            Frontier("priority")
+
+    def test_orders_crawl_the_same_datasets(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            for order in Frontier.ORDERS[:2]:
+                c = Crawl(server.url + "/thredds/catalog.xml", workers=2, order=order)
+                assert sorted(d.id for d in c.datasets) == CATALOG_DATASETS
+
+    def test_deeper_than_recursion_limit(self):
+        depth = sys.getrecursionlimit() + 100
+        routes = {}
+        for i in range(depth):
+            ref = REF % (i + 1, i + 1) if i + 1 < depth else ""
+            routes[f"/{i}.xml"] = CATALOG % (DATASET % (i, i, i) + ref)
+
+        with StubServer(routes) as server:
+            c = Crawl(server.url + "/0.xml", workers=2)
+        assert len(c.datasets) == depth
+
+    def test_priorities(self):
+        urls = [
+            "http://a/raw/catalog.xml",
+            "http://a/2016/catalog.xml",
+            "http://a/2017/02/catalog.xml",
+            "http://a/2017/catalog.xml",
+        ]
+        assert sorted(urls, key=lambda u: newest_first()(u, 1)) == [urls[0], urls[3], urls[2], urls[1]]
+        priority = matching_first([".*/raw/.*", ".*/2016/.*"])
+        assert [priority(u, 1) for u in urls] == [0, 1, 2, 2]
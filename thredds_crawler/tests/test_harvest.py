@@ -0,0 +1,129 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from thredds_crawler.crawl import crawl_iter
+from thredds_crawler.harvest import DOWNLOADED, FAILED, UNCHANGED, Harvester
+from thredds_crawler.tests.stubs import StubServer
+from thredds_crawler.throttle import RequestScheduler
+
+CATALOG = """<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0">
+  <service name="all" serviceType="Compound" base="">
+    <service name="isoService" serviceType="ISO" base="/thredds/iso/" />
+    <service name="ncmlService" serviceType="NCML" base="/thredds/ncml/" />
+  </service>
+  <dataset name="dated" ID="a/dated" urlPath="dated.nc"><serviceName>all</serviceName>
+    <date type="modified">2016-01-01T00:00:00Z</date></dataset>
+  <dataset name="tagged" ID="a/tagged" urlPath="tagged.nc"><serviceName>all</serviceName></dataset>
+  <dataset name="plain" ID="a/plain" urlPath="plain.nc"><serviceName>all</serviceName></dataset>
+</catalog>"""
+
+
+def tagged(headers):
+    if headers.get("If-None-Match") == '"v1"':
+        return 304, {"ETag": '"v1"'}, b""
+    return 200, {"ETag": '"v1"'}, b"<iso>tagged</iso>"
+
+
+ROUTES = {
+    "/thredds/catalog.xml": CATALOG,
+    "/thredds/iso/dated.nc": b"<iso>dated</iso>",
+    "/thredds/iso/tagged.nc": tagged,
+    "/thredds/iso/plain.nc": b"<iso>plain</iso>",
+    "/thredds/ncml/dated.nc": b"<netcdf/>",
+}
+
+
+class HarvesterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def files(self):
+        return sorted(p.name for p in Path(self.tmp).iterdir())
+
+    def harvest(self, server, **kwargs: object):
+        datasets = crawl_iter(server.url + "/thredds/catalog.xml", workers=2)
+        return {r.dataset_id: r for r in Harvester(self.tmp, **kwargs).harvest(datasets)}
+
+    def test_harvest(self):
+        with StubServer(ROUTES) as server:
+            results = self.harvest(server)
+        assert {r.status for r in results.values()} == {DOWNLOADED}
+        assert self.files() == [".harvest.json", "a_dated.iso.xml", "a_plain.iso.xml", "a_tagged.iso.xml"]
+        assert Path(results["a/plain"].path).read_bytes() == b"<iso>plain</iso>"
+        assert results["a/plain"].size == len(b"<iso>plain</iso>")
+
+    def test_services(self):
+        with StubServer(ROUTES) as server:
+            results = Harvester(self.tmp, services=["NcML"]).harvest(crawl_iter(server.url + "/thredds/catalog.xml"))
+            statuses = sorted((r.dataset_id, r.service, r.status) for r in results)
+        assert statuses == [("a/dated", "NCML", DOWNLOADED), ("a/plain", "NCML", FAILED), ("a/tagged", "NCML", FAILED)]
+        assert self.files() == [".harvest.json", "a_dated.ncml.xml"]
+
+    def test_unchanged(self):
+        plain = Path(self.tmp) / "a_plain.iso.xml"
+        runs = 2
+        with StubServer(ROUTES) as server:
+            self.harvest(server)
+            mtime = plain.stat().st_mtime
+            time.sleep(0.05)
+            results = self.harvest(server)
+            # Not requested at all, the dataset was not modified since
+            assert server.count("/thredds/iso/dated.nc") == 1
+            # Answered with 304 Not Modified
+            assert server.count("/thredds/iso/tagged.nc") == runs
+            # Downloaded again but identical, the file is left untouched
+            assert server.count("/thredds/iso/plain.nc") == runs
+        assert {r.status for r in results.values()} == {UNCHANGED}
+        assert plain.stat().st_mtime == mtime
+
+        with StubServer(dict(ROUTES, **{"/thredds/iso/plain.nc": b"<iso>new</iso>"})) as server:
+            results = self.harvest(server)
+        assert results["a/plain"].status == DOWNLOADED
+        assert Path(results["a/plain"].path).read_bytes() == b"<iso>new</iso>"
+
+    def test_failures(self):
+        attempts = []
+        failures = 1
+
+        def flaky(_headers):
+            attempts.append(1)
+            if len(attempts) <= failures:
+                return 503, {}, b"Busy"
+            return 200, {}, b"<iso>tagged</iso>"
+
+        routes = dict(ROUTES, **{"/thredds/iso/tagged.nc": flaky})
+        del routes["/thredds/iso/plain.nc"]
+        with StubServer(routes) as server:
+            results = self.harvest(server, scheduler=RequestScheduler(backoff=0.01))
+        assert results["a/tagged"].status == DOWNLOADED
+        assert len(attempts) == failures + 1
+        assert results["a/plain"].status == FAILED
+        assert results["a/plain"].error == "HTTP 404"
+        assert not Path(results["a/plain"].path).exists()
+        assert not [f for f in self.files() if f.endswith(".part")]
+
+    def test_per_host(self):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def slow(_headers):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.1)
+            with lock:
+                active[0] -= 1
+            return 200, {}, b"<iso/>"
+
+        routes = {"/thredds/catalog.xml": CATALOG}
+        for name in ("dated", "tagged", "plain"):
+            routes[f"/thredds/iso/{name}.nc"] = slow
+        with StubServer(routes) as server:
+            results = self.harvest(server, workers=3, per_host=1)
+        assert {r.status for r in results.values()} == {DOWNLOADED}
+        assert active[1] == 1
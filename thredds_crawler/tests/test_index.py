@@ -0,0 +1,121 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+import pytz
+
+from thredds_crawler.crawl import Crawl, LeafDataset
+from thredds_crawler.index import DatasetIndex, geospatial_coverage
+from thredds_crawler.tests.stubs import CATALOG_ROUTES, StubServer
+
+METADATA = """<metadata xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0" inherited="true">
+  <geospatialCoverage>
+    <northsouth><start>%s</start><size>%s</size></northsouth>
+    <eastwest><start>%s</start><size>%s</size></eastwest>
+  </geospatialCoverage>
+</metadata>"""
+
+
+def dataset(gid, services=("OPENDAP",), modified=None, box=None, catalog="http://localhost/catalog.xml"):
+    """Returns a LeafDataset, box being the (south, height, west, width) of its geospatialCoverage"""
+    return LeafDataset.from_dict(
+        {
+            "id": gid,
+            "name": gid,
+            "catalog_url": catalog,
+            "data_size": None,
+            "modified": modified,
+            "services": [{"name": s.lower(), "service": s, "url": f"http://localhost/{gid}"} for s in services],
+            "metadata": METADATA % box if box is not None else None,
+        },
+    )
+
+
+class DatasetIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.datasets = [
+            dataset("chesapeake", ("OPENDAP", "WMS"), "2016-05-01T00:00:00Z", (36, 4, -78, 3)),
+            dataset("gulf", ("OPENDAP",), "2015-01-01T00:00:00Z", (18, 13, -98, 17)),
+            dataset("pacific", ("HTTPServer",), "2017-01-01T00:00:00Z", (-10, 20, 170, 40), "http://localhost/other.xml"),
+            dataset("undated", ("OPENDAP",)),
+        ]
+        self.index = DatasetIndex(self.datasets)
+
+    def ids(self, selection):
+        return sorted(selection.ids())
+
+    def test_lookups(self):
+        index = self.index
+        assert len(index) == len(self.datasets)
+        assert "gulf" in index
+        assert index.get("gulf").id == "gulf"
+        assert index.get("missing") is None
+        assert self.ids(index.service("OPENDAP")) == ["chesapeake", "gulf", "undated"]
+        assert self.ids(index.service("WCS")) == []
+        assert self.ids(index.catalog("http://localhost/other.xml")) == ["pacific"]
+        assert self.ids(index.undated()) == ["undated"]
+
+    def test_modified(self):
+        index = self.index
+        # Naive datetimes are taken as UTC
+        assert self.ids(index.modified(after=datetime(2016, 1, 1))) == ["chesapeake", "pacific"]  # noqa: DTZ001
+        assert self.ids(index.modified(before=datetime(2016, 5, 1, tzinfo=pytz.utc))) == ["chesapeake", "gulf"]
+        assert [d.id for d in index.all().newest(2)] == ["pacific", "chesapeake"]
+
+    def test_spatial(self):
+        index = self.index
+        assert self.ids(index.intersecting((-80, 35, -70, 45))) == ["chesapeake"]
+        assert self.ids(index.intersecting((-100, 0, -60, 50))) == ["chesapeake", "gulf"]
+        # The Pacific box crosses the antimeridian
+        assert self.ids(index.intersecting((-175, 0, -170, 5))) == ["pacific"]
+        assert self.ids(index.intersecting((175, 0, -175, 5))) == ["pacific"]
+        assert self.ids(index.intersecting((0, 0, 10, 10))) == []
+
+    def test_queries(self):
+        index = self.index
+        selection = index.service("OPENDAP") & index.modified(after=datetime(2016, 1, 1, tzinfo=pytz.utc)) | index.catalog(
+            "http://localhost/other.xml",
+        )
+        assert self.ids(selection) == ["chesapeake", "pacific"]
+        assert self.ids(index.service("OPENDAP") - index.service("WMS")) == ["gulf", "undated"]
+        assert self.ids(index.all().filter(lambda d: d.id.startswith("g"))) == ["gulf"]
+        before = datetime(2015, 6, 1, tzinfo=pytz.utc)
+        assert self.ids(index.query(service="OPENDAP", box=(-100, 0, -60, 50), before=before)) == ["gulf"]
+        with pytest.raises(ValueError, match="different indexes"):
+            index.all() & DatasetIndex().all()
+
+    def test_replace(self):
+        index = self.index
+        index.add(dataset("gulf", ("WMS",), "2018-01-01T00:00:00Z"))
+        assert len(index) == len(self.datasets)
+        assert self.ids(index.service("WMS")) == ["chesapeake", "gulf"]
+        assert self.ids(index.modified(after=datetime(2017, 6, 1, tzinfo=pytz.utc))) == ["gulf"]
+        assert self.ids(index.intersecting((-100, 0, -60, 50))) == ["chesapeake"]
+        index.remove("gulf")
+        assert "gulf" not in index
+        assert len(list(index)) == len(self.datasets) - 1
+
+    def test_save(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = Path(tmp) / "index.json"
+        self.index.save(path)
+        index = DatasetIndex.load(path)
+        assert [d.to_dict() for d in index] == [d.to_dict() for d in self.index]
+        assert index.boxes == self.index.boxes
+        assert self.ids(index.intersecting((-175, 0, -170, 5))) == ["pacific"]
+
+    def test_coverage(self):
+        box = geospatial_coverage(dataset("x", box=(40, -5, 350, 20)).metadata)
+        assert box == (-10, 35, 10, 40)
+        assert geospatial_coverage(dataset("x", box=("north", 1, 0, 1)).metadata) is None
+
+    def test_crawl(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2)
+        index = DatasetIndex(c.datasets)
+        assert sorted(d.id for d in index) == sorted(d.id for d in c.datasets)
+        assert len(index.service("OPENDAP")) == len([d for d in c.datasets if any(s.service == "OPENDAP" for s in d.services)])
@@ -0,0 +1,105 @@
+import unittest
+
+from thredds_crawler.crawl import INV_NS, XLINK_NS, Crawl
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer
+
+# The dataSize of test/agg in the catalog, in megabytes
+AGG_SIZE = 2.048
+
+# A catalog whose inherited metadata links to its documentation with xlink,
+# and the document the TDS serves for its dataset
+LINKED = """<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <service name="all" serviceType="Compound" base="">
+    <service name="odap" serviceType="OPENDAP" base="/thredds/dodsC/" />
+  </service>
+  <dataset name="Linked" ID="linked">
+    <metadata inherited="true">
+      <serviceName>all</serviceName>
+      <documentation xlink:href="http://example.com/docs" xlink:title="Docs" />
+    </metadata>
+    <dataset name="data.nc" ID="linked/data.nc" urlPath="linked/data.nc" />
+  </dataset>
+</catalog>"""
+LINKED_DATASET = """<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <service name="all" serviceType="Compound" base="">
+    <service name="odap" serviceType="OPENDAP" base="/thredds/dodsC/" />
+  </service>
+  <dataset name="data.nc" ID="linked/data.nc" urlPath="linked/data.nc">
+    <metadata inherited="true">
+      <serviceName>all</serviceName>
+      <documentation xlink:href="http://example.com/docs" xlink:title="Docs" />
+    </metadata>
+  </dataset>
+</catalog>"""
+
+
+class InlineTest(unittest.TestCase):
+    def crawl(self, **kwargs: object):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, **kwargs)
+        return server, {d.id: d for d in c.datasets}
+
+    def test_inline_resolution(self):
+        server, datasets = self.crawl()
+        assert sorted(datasets) == CATALOG_DATASETS
+
+        # Only the dataset that could not be resolved from its catalog is requested
+        assert server.count("/thredds/catalog.xml?dataset=test/agg") == 0
+        assert server.count("/thredds/child/catalog.xml?dataset=child/two.nc") == 0
+        assert server.count("/thredds/child/catalog.xml?dataset=child/one.nc") == 1
+
+    def test_inherited_services(self):
+        server, datasets = self.crawl()
+        agg = datasets["test/agg"]
+        assert [s.get("service") for s in agg.services] == ["OPENDAP", "ISO"]
+        assert agg.services[0].get("url") == server.url + "/thredds/dodsC/test/agg.nc"
+        assert "?dataset=test/agg&catalog=" in agg.services[1].get("url")
+        assert agg.catalog_url == server.url + "/thredds/catalog.xml"
+
+        dap = datasets["test/dap"]
+        assert [s.get("name") for s in dap.services] == ["dap"]
+
+    def test_inherited_metadata(self):
+        _, datasets = self.crawl()
+        agg = datasets["test/agg"]
+        assert agg.size == AGG_SIZE
+        assert agg.metadata.find(f"{{{INV_NS}}}documentation").text == "Aggregation docs"
+        assert agg.metadata.find(f"{{{INV_NS}}}creator/{{{INV_NS}}}name").text == "Inherited Creator"
+
+    def test_fallback(self):
+        _, datasets = self.crawl()
+        one = datasets["child/one.nc"]
+        assert [s.get("service") for s in one.services] == ["HTTPServer"]
+
+    def test_namespaces(self):
+        routes = {"/catalog.xml": LINKED, "/catalog.xml?dataset=linked/data.nc": LINKED_DATASET}
+        with StubServer(routes) as server:
+            (inline,) = Crawl(server.url + "/catalog.xml", workers=2).datasets
+            assert server.count("/catalog.xml?dataset=linked/data.nc") == 0
+            (requested,) = Crawl(server.url + "/catalog.xml", workers=2, inline=False).datasets
+            assert server.count("/catalog.xml?dataset=linked/data.nc") == 1
+
+        assert inline.services == requested.services
+        assert inline.metadata.nsmap == requested.metadata.nsmap
+        assert inline.metadata.nsmap["xlink"] == XLINK_NS
+        docs = [m.find(f"{{{INV_NS}}}documentation") for m in (inline.metadata, requested.metadata)]
+        assert [d.get(f"{{{XLINK_NS}}}href") for d in docs] == ["http://example.com/docs"] * 2
+
+    def test_no_service_name(self):
+        # The Compound services of a catalog are not those of a dataset that names none
+        catalog = LINKED.replace("<serviceName>all</serviceName>", "")
+        document = LINKED_DATASET.replace("<serviceName>all</serviceName>", "")
+        routes = {"/catalog.xml": catalog, "/catalog.xml?dataset=linked/data.nc": document}
+        with StubServer(routes) as server:
+            c = Crawl(server.url + "/catalog.xml", workers=2)
+        assert server.count("/catalog.xml?dataset=linked/data.nc") == 1
+        assert [s.name for s in c.datasets[0].services] == ["odap"]
+
+    def test_disabled(self):
+        server, _ = self.crawl(inline=False)
+        assert server.count("/thredds/catalog.xml?dataset=test/agg") == 1
+        assert server.count("/thredds/catalog.xml?dataset=test/dap") == 1
+        assert server.count("/thredds/child/catalog.xml?dataset=child/one.nc") == 1
+        assert server.count("/thredds/child/catalog.xml?dataset=child/two.nc") == 1
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from thredds_crawler.aio import FairBudget, MultiCrawl, crawl_roots, iter_roots
+from thredds_crawler.testing import SyntheticTDS
+from thredds_crawler.tests.stubs import StubServer, slow_routes, stalled_routes
+
+# Seconds the stalled catalog takes to answer
+STALL = 1
+
+
+class MultiCrawlTest(unittest.TestCase):
+    def test_roots(self):
+        fanout, datasets = 2, 4
+        with SyntheticTDS(depth=1, fanout=fanout, datasets=3) as a, SyntheticTDS(depth=0, datasets=datasets) as b:
+            multi = crawl_roots(
+                {
+                    "a": {"url": a.catalog_url, "select": [r".*file_0\.nc"]},
+                    "b": b.catalog_url,
+                },
+                concurrency=4,
+            )
+        assert sorted(multi.datasets) == ["a", "b"]
+        assert sorted(d.id for d in multi.datasets["a"]) == [
+            "synthetic/c0/file_0.nc",
+            "synthetic/c1/file_0.nc",
+            "synthetic/file_0.nc",
+        ]
+        assert len(multi.datasets["b"]) == datasets
+        assert multi.crawls["a"].stats.catalogs == 1 + fanout
+        assert multi.crawls["a"].scheduler is multi.crawls["b"].scheduler
+        assert not multi.errors
+
+    def test_global_budget(self):
+        lock = threading.Lock()
+        active = [0, 0]
+        count, concurrency = 8, 3
+        with StubServer(slow_routes("a", count, lock, active)) as a, StubServer(slow_routes("b", count, lock, active)) as b:
+            multi = asyncio.run(MultiCrawl([a.url + "/catalog.xml", b.url + "/catalog.xml"], concurrency=concurrency).run())
+        assert [len(multi.datasets[url + "/catalog.xml"]) for url in (a.url, b.url)] == [count, count]
+        assert 1 < active[1] <= concurrency
+
+    def test_iter_roots(self):
+        fanout, datasets = 3, 5
+        options = {"depth": 1, "fanout": fanout, "datasets": datasets}
+        with SyntheticTDS(**options) as a, SyntheticTDS(**options) as b:
+            roots = {"a": a.catalog_url, "b": b.catalog_url}
+            found = list(iter_roots(roots, concurrency=4))
+            assert len(found) == len(roots) * (1 + fanout) * datasets
+            assert {root for root, _ in found} == {"a", "b"}
+            # Closing early stops the crawl
+            stream = iter_roots(roots, concurrency=1)
+            next(stream)
+            stream.close()
+
+    def test_close_early(self):
+        async def first(url):
+            datasets = MultiCrawl({"one": url}).iter_datasets()
+            item = await datasets.__anext__()
+            await asyncio.sleep(0.2)
+            start = time.monotonic()
+            await datasets.aclose()
+            return item, time.monotonic() - start
+
+        with StubServer(stalled_routes(STALL)) as server:
+            (name, ds), elapsed = asyncio.run(first(server.url + "/catalog.xml"))
+        assert (name, ds.id) == ("one", "a")
+        assert elapsed < STALL / 2
+
+
+class FairBudgetTest(unittest.TestCase):
+    def test_turns(self):
+        order = []
+
+        async def request(budget, host):
+            async with budget.slot(host):
+                order.append(host)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            budget = FairBudget(1, per_host=1)
+            # A busy host queues many requests before a second host queues one
+            tasks = [asyncio.ensure_future(request(budget, "busy")) for _ in range(5)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.ensure_future(request(budget, "other")))
+            await asyncio.gather(*tasks)
+            assert budget.active == 0
+
+        asyncio.run(main())
+        # The other host does not wait for the queue of the busy host to drain
+        waited = 2
+        assert order.index("other") <= waited
+
+    def test_cancel(self):
+        async def main():
+            budget = FairBudget(1)
+            await budget.acquire("a")
+            waiting = asyncio.ensure_future(budget.acquire("a"))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.sleep(0)
+            budget.release("a")
+            assert budget.active == 0
+            assert not budget.waiting
+
+        asyncio.run(main())
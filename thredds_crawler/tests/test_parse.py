@@ -0,0 +1,103 @@
+import gzip
+import re
+import unittest
+
+from thredds_crawler.crawl import INV_NS, CatalogParser, Crawl, LeafDataset, iter_chunks
+from thredds_crawler.snapshot import content_hash
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer, resource
+
+URL = "http://localhost/thredds/catalog.xml"
+
+
+def large_catalog(count):
+    """Returns a catalog listing count datasets that inherit their service"""
+    datasets = "".join(f'<dataset name="{i}.nc" ID="large/{i}.nc" urlPath="large/{i}.nc" />' for i in range(count))
+    return (
+        '<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0">'
+        '<service name="dap" serviceType="OPENDAP" base="/thredds/dodsC/" />'
+        '<dataset name="Large" ID="large">'
+        '<metadata inherited="true"><serviceName>dap</serviceName></metadata>'
+        f"{datasets}</dataset></catalog>"
+    ).encode()
+
+
+class TreeSizeParser(CatalogParser):
+    """Records the number of elements in the tree each time a leaf is handled"""
+
+    def __init__(self, *args: object, **kwargs: object):
+        super().__init__(*args, **kwargs)
+        self.sizes = []
+
+    def leaf(self, url, leaf):
+        self.sizes.append(sum(1 for _ in leaf.getroottree().iter()))
+        return super().leaf(url, leaf)
+
+
+class CatalogParserTest(unittest.TestCase):
+    def test_chunks(self):
+        xml = resource("catalog.xml")
+        parser = CatalogParser(skip=[re.compile(x) for x in Crawl.SKIPS])
+        whole = parser.parse(URL, [xml])
+        split = parser.parse(URL, iter_chunks(xml, 7))
+        assert whole.references == split.references == ["http://localhost/thredds/child/catalog.xml"]
+        assert [d.id for d in whole.leaves] == [d.id for d in split.leaves] == ["test/agg", "test/dap"]
+        assert split.digest == content_hash(xml)
+
+        # Inherited metadata is still there when the datasets are read
+        agg = split.leaves[0]
+        assert [s["service"] for s in agg.services] == ["OPENDAP", "ISO"]
+        assert agg.metadata.find(f"{{{INV_NS}}}creator/{{{INV_NS}}}name").text == "Inherited Creator"
+
+    def test_bounded_tree(self):
+        parser = TreeSizeParser()
+        count = 5000
+        parsed = parser.parse(URL, iter_chunks(large_catalog(count), 4096))
+        assert len(parsed.leaves) == count
+        assert all(isinstance(d, LeafDataset) and d.services for d in parsed.leaves)
+        # Processed datasets are dropped, so the tree never holds more than a chunk worth of them
+        assert max(parser.sizes) < count / 50
+        # The datasets share the metadata they inherit instead of holding a copy each
+        assert len({id(d.metadata_bytes()) for d in parsed.leaves}) == 1
+
+    def test_batches(self):
+        xml = large_catalog(2500)
+        events = []
+
+        def chunks():
+            yield from iter_chunks(xml, 4096)
+            events.append("downloaded")
+
+        parsed = CatalogParser().parse(URL, chunks(), events.append)
+        # Handed over as soon as a batch is parsed, none are collected
+        assert events[0] != "downloaded"
+        batches = [e for e in events if e != "downloaded"]
+        assert [(b.offset, len(b.leaves)) for b in batches] == [(0, 1000), (1000, 1000), (2000, 500)]
+        assert parsed.references == parsed.leaves == []
+        assert parsed.digest == content_hash(xml)
+
+        # The same batches however the catalog is split
+        whole = list(CatalogParser().iter_batches(URL, [xml]))
+        assert whole[-1].digest == parsed.digest
+        assert [[d.id for d in b.leaves] for b in whole[:-1]] == [[d.id for d in b.leaves] for b in batches]
+
+    def test_crawl_batches(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, lazy=True)
+            c.parser.batch_size = 1
+            datasets = list(c.iter_datasets())
+        assert sorted(d.id for d in datasets) == CATALOG_DATASETS
+
+    def test_invalid(self):
+        assert CatalogParser().parse(URL, [b"<catalog><dataset>"]) is None
+        assert CatalogParser().parse(URL, []) is None
+
+    def test_gzip(self):
+        def compressed(headers):
+            if "gzip" not in headers.get("Accept-Encoding", ""):
+                return 200, {}, resource("catalog.xml")
+            return 200, {"Content-Encoding": "gzip"}, gzip.compress(resource("catalog.xml"))
+
+        with StubServer(dict(CATALOG_ROUTES, **{"/thredds/catalog.xml": compressed})) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2)
+        assert "gzip" in server.requests[0][1]["Accept-Encoding"]
+        assert sorted(d.id for d in c.datasets) == CATALOG_DATASETS
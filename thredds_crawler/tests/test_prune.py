@@ -0,0 +1,113 @@
+import re
+import unittest
+from datetime import datetime
+
+import pytz
+from lxml import etree
+
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.filters import DATE_PATTERNS, date_span, time_coverage
+from thredds_crawler.tests.stubs import StubServer
+from thredds_crawler.utils import INV_NS
+
+CATALOG = """<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
+  xmlns:xlink="http://www.w3.org/1999/xlink">
+  <service name="dap" serviceType="OPENDAP" base="/thredds/dodsC/" />
+  %s
+</catalog>"""
+
+REF = '<catalogRef xlink:href="%s" xlink:title="%s">%s</catalogRef>'
+
+DATASET = """<dataset name="%s" ID="%s" urlPath="%s"><serviceName>dap</serviceName>
+  <date type="modified">%s</date></dataset>"""
+
+COVERAGE = "<metadata><timeCoverage><start>%s</start><end>%s</end></timeCoverage></metadata>"
+
+ROUTES = {
+    "/raw/catalog.xml": CATALOG
+    % (
+        REF % ("2015/catalog.xml", "2015", "")
+        + REF % ("2016/catalog.xml", "2016", "")
+        + REF % ("old/catalog.xml", "Old", COVERAGE % ("2014-01-01T00:00:00Z", "2014-12-31T00:00:00Z"))
+    ),
+    "/raw/2015/catalog.xml": CATALOG % DATASET % ("a", "2015/a", "2015/a", "2015-06-01T00:00:00Z"),
+    "/raw/2016/catalog.xml": CATALOG % (REF % ("01/catalog.xml", "January", "") + REF % ("02/catalog.xml", "February", "")),
+    "/raw/2016/01/catalog.xml": CATALOG % DATASET % ("b", "2016/01/b", "2016/01/b", "2016-01-15T00:00:00Z"),
+    "/raw/2016/02/catalog.xml": CATALOG % DATASET % ("c", "2016/02/c", "2016/02/c", "2016-02-15T00:00:00Z"),
+    "/raw/old/catalog.xml": CATALOG % DATASET % ("d", "old/d", "old/d", "2014-06-01T00:00:00Z"),
+}
+
+
+def utc(*args: object):
+    return datetime(*args, tzinfo=pytz.utc)
+
+
+class PruneTest(unittest.TestCase):
+    def crawl(self, **kwargs: object):
+        with StubServer(ROUTES) as server:
+            c = Crawl(server.url + "/raw/catalog.xml", workers=2, **kwargs)
+        return sorted(path for path, _ in server.requests), sorted(d.id for d in c.datasets)
+
+    def test_prune(self):
+        requested, datasets = self.crawl(after=utc(2016, 2, 1), prune=True)
+        assert requested == ["/raw/2016/02/catalog.xml", "/raw/2016/catalog.xml", "/raw/catalog.xml"]
+        assert datasets == ["2016/02/c"]
+
+        requested, datasets = self.crawl(before=utc(2014, 12, 31), prune=True)
+        assert requested == ["/raw/catalog.xml", "/raw/old/catalog.xml"]
+        assert datasets == ["old/d"]
+
+    def test_no_prune(self):
+        requested, datasets = self.crawl(after=utc(2016, 2, 1))
+        assert len(requested) == len(ROUTES)
+        assert datasets == ["2016/02/c"]
+
+    def test_custom_patterns(self):
+        # Only trust the titles of the yearly catalogs
+        requested, datasets = self.crawl(after=utc(2016, 2, 1), prune=[r"^(?P<year>\d{4})$"])
+        assert "/raw/2015/catalog.xml" not in requested
+        assert "/raw/2016/01/catalog.xml" in requested
+        assert datasets == ["2016/02/c"]
+
+
+class DateSpanTest(unittest.TestCase):
+    def span(self, *texts: object):
+        return date_span(texts, [re.compile(p) for p in DATE_PATTERNS])
+
+    def test_paths(self):
+        assert self.span("/thredds/raw/2016/catalog.xml") == (utc(2016, 1, 1), utc(2017, 1, 1))
+        assert self.span("/thredds/raw/2016/12/catalog.xml") == (utc(2016, 12, 1), utc(2017, 1, 1))
+        assert self.span("/thredds/raw/2016/02/28/catalog.xml") == (utc(2016, 2, 28), utc(2016, 2, 29))
+        assert self.span("/thredds/raw/20160110/catalog.xml") == (utc(2016, 1, 10), utc(2016, 1, 11))
+        assert self.span("/thredds/raw/2016-01/catalog.xml") == (utc(2016, 1, 1), utc(2016, 2, 1))
+
+    def test_titles(self):
+        assert self.span("2016") == (utc(2016, 1, 1), utc(2017, 1, 1))
+        assert self.span("2016-01-10", "/raw/2016/catalog.xml") == (utc(2016, 1, 10), utc(2016, 1, 11))
+
+    def test_no_dates(self):
+        assert self.span("GFS_2016_v2", "/thredds/GFS_2016_v2/catalog.xml") is None
+        # Not a real date
+        assert self.span("Model Run 12345678", "/raw/2016/02/30/catalog.xml") is None
+        assert self.span(None, "") is None
+
+
+class TimeCoverageTest(unittest.TestCase):
+    def coverage(self, xml):
+        return time_coverage(etree.fromstring(f'<dataset xmlns="{INV_NS}">{xml}</dataset>'))
+
+    def test_start_end(self):
+        span = self.coverage("<timeCoverage><start>2016-01-01</start><end>2016-02-01</end></timeCoverage>")
+        assert span == (utc(2016, 1, 1), utc(2016, 2, 1))
+
+    def test_duration(self):
+        span = self.coverage("<metadata><timeCoverage><end>2016-01-10</end><duration>P9D</duration></timeCoverage></metadata>")
+        assert span == (utc(2016, 1, 1), utc(2016, 1, 10))
+
+    def test_present(self):
+        start, end = self.coverage("<timeCoverage><start>2016-01-01</start><end>present</end></timeCoverage>")
+        assert start < end <= datetime.now(pytz.utc)
+
+    def test_unknown(self):
+        assert self.coverage("") is None
+        assert self.coverage("<timeCoverage><start>2016-01-01</start><duration>10 days</duration></timeCoverage>") is None
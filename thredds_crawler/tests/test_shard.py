@@ -0,0 +1,150 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import pytest
+
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.shard import ShardedCrawl, SQLiteQueue, Task, WorkQueue, merge
+from thredds_crawler.testing import SyntheticTDS
+from thredds_crawler.throttle import RequestScheduler
+
+
+class ShardedCrawlTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = Path(self.path) / "queue.db"
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def worker(self, url, shard, found, **kwargs: object):
+        with SQLiteQueue(self.db) as q:
+            c = ShardedCrawl(q, url, worker=f"w{shard}", shard=shard, shards=3, workers=2, poll=0.05, **kwargs)
+            found[shard] = [d.id for d in c.datasets]
+
+    def test_shards(self):
+        found = {}
+        with SyntheticTDS(depth=2, fanout=3, datasets=4) as tds:
+            threads = [threading.Thread(target=self.worker, args=(tds.catalog_url, i, found)) for i in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            single = Crawl(tds.catalog_url, workers=2)
+        # Every catalog was crawled once across the workers
+        assert tds.requests["catalog"] == tds.total_catalogs * 2
+        assert sum(len(ids) for ids in found.values()) == tds.total_datasets
+        with SQLiteQueue(self.db) as q:
+            assert q.finished()
+            assert q.counts() == {"done": tds.total_catalogs}
+            merged = merge(q)
+        assert [d.id for d in merged] == sorted(d.id for d in single.datasets)
+
+    def test_dead_worker(self):
+        with SyntheticTDS(depth=1, fanout=3, datasets=2) as tds, SQLiteQueue(self.db) as q:
+            q.open(tds.catalog_url, ShardedCrawl(q, tds.catalog_url, shards=3, lazy=True)._fingerprint())  # noqa: SLF001
+            # A worker leases the root catalog and dies
+            ttl = 0.2
+            assert [t.url for t in q.lease("dead", None, 10, ttl)] == [tds.catalog_url]
+            start = time.time()
+            c = ShardedCrawl(q, tds.catalog_url, worker="alive", shards=3, workers=2, poll=0.05)
+            assert time.time() - start >= ttl
+            assert len(c.datasets) == tds.total_datasets
+            assert q.finished()
+
+    def test_circuit_open(self):
+        with SyntheticTDS(depth=1, fanout=2, datasets=2) as tds, SQLiteQueue(self.db) as q:
+            scheduler = RequestScheduler(failure_threshold=1, reset_after=0.2)
+            scheduler.finish(tds.catalog_url, error=OSError("refused"))
+            start = time.time()
+            c = ShardedCrawl(q, tds.catalog_url, workers=2, poll=0.05, scheduler=scheduler)
+            # The root catalog waited in the queue for the circuit to close instead of failing
+            assert time.time() - start >= scheduler.reset_after
+            assert len(c.datasets) == tds.total_datasets
+            assert q.counts() == {"done": tds.total_catalogs}
+
+    def test_stopped(self):
+        with SyntheticTDS(depth=1, fanout=4, datasets=2, jitter=0.5) as tds, SQLiteQueue(self.db) as q:
+            scheduler = RequestScheduler()
+            datasets = ShardedCrawl(q, tds.catalog_url, workers=2, poll=0.05, scheduler=scheduler, lazy=True).iter_datasets()
+            # The datasets of the root and of the first of its catalogRefs to answer
+            for _ in range(3):
+                next(datasets)
+            datasets.close()
+            # The requests in flight were abandoned along with their leases
+            assert all(state.active == 0 for state in scheduler.hosts.values())
+            assert "leased" not in q.counts()
+
+    def test_other_crawl(self):
+        with SyntheticTDS(depth=0, datasets=2) as tds, SQLiteQueue(self.db) as q:
+            ShardedCrawl(q, tds.catalog_url, workers=1)
+            with pytest.raises(ValueError, match="other options"):
+                ShardedCrawl(q, tds.catalog_url, workers=1, select=[".*file_0.*"])
+        with pytest.raises(ValueError, match="'shard' parameter"):
+            ShardedCrawl(None, "http://localhost/catalog.xml", shard=3, shards=3)
+
+
+class SQLiteQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.queue = SQLiteQueue(Path(self.path) / "queue.db", max_attempts=2)
+        self.queue.open("root", "{}")
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.path)
+
+    def test_preferred_shard(self):
+        q = self.queue
+        q.lease("a", None, 1, 60)
+        q.complete("a", "root", [Task("catalog", f"c{i}", 1, i % 2) for i in range(4)])
+        assert [t.url for t in q.lease("b", 1, 3, 60)] == ["c1", "c3", "c0"]
+        # Released tasks go to the next worker at once
+        q.release("b", ["c1"])
+        assert [t.url for t in q.lease("c", None, 5, 60)] == ["c1", "c2"]
+
+    def test_release_error(self):
+        q = self.queue
+        q.lease("a", None, 1, 60)
+        q.release("a", ["root"], delay=60, error="circuit open")
+        # Not given to another worker before the delay
+        assert q.lease("b", None, 1, 60) == []
+        assert not q.finished()
+
+        # Once the delay is over
+        q._db.execute("UPDATE tasks SET expires = NULL")  # noqa: SLF001
+        assert [t.url for t in q.lease("b", None, 1, 60)] == ["root"]
+        # The second lease was the last attempt
+        q.release("b", ["root"], error="circuit open")
+        assert q.failures() == [("catalog", "root", "circuit open")]
+        assert q.finished()
+
+    def test_max_attempts(self):
+        q = self.queue
+        q.lease("a", None, 1, -1)
+        q.lease("b", None, 1, -1)
+        assert q.lease("c", None, 1, 60) == []
+        assert q.failures() == [("catalog", "root", "lease expired")]
+        assert q.finished()
+
+    def test_merge(self):
+        q = self.queue
+        q.lease("a", None, 1, 60)
+        q.complete("a", "root", [Task("catalog", "b", 1, 0), Task("catalog", "a", 1, 0)])
+        q.lease("a", None, 2, 60)
+        # The same dataset listed in two catalogs
+        q.complete("a", "b", datasets=[{"id": "x", "name": "from b"}, {"id": "y", "name": "y"}])
+        q.complete("a", "a", datasets=[{"id": "x", "name": "from a"}])
+        assert list(q.datasets()) == [{"id": "x", "name": "from a"}, {"id": "y", "name": "y"}]
+
+    def test_incomplete_queue(self):
+        class NoLease(WorkQueue):
+            def open(self, root, options):
+                pass
+
+        with pytest.raises(TypeError, match="abstract"):
+            NoLease()
@@ -0,0 +1,104 @@
+import io
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+import pytest
+
+from thredds_crawler import sinks
+from thredds_crawler.crawl import crawl_iter
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer
+
+
+class SinkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        with StubServer(CATALOG_ROUTES) as server:
+            self.datasets = list(crawl_iter(server.url + "/thredds/catalog.xml", workers=2))
+
+    def path(self, name):
+        return str(Path(self.tmp) / name)
+
+    def assert_same(self, datasets):
+        datasets = sorted(datasets, key=lambda d: d.id)
+        expected = sorted(self.datasets, key=lambda d: d.id)
+        assert [d.to_dict() for d in datasets] == [d.to_dict() for d in expected]
+
+    def test_jsonl(self):
+        with sinks.JSONLinesSink(self.path("datasets.jsonl")) as sink:
+            assert sink.write_all(iter(self.datasets)) == len(self.datasets)
+        self.assert_same(sinks.read_jsonl(self.path("datasets.jsonl")))
+
+    def test_jsonl_pathlib(self):
+        path = Path(self.tmp) / "datasets.jsonl"
+        with sinks.JSONLinesSink(path) as sink:
+            sink.write_all(self.datasets)
+        self.assert_same(sinks.read_jsonl(path))
+
+    def test_jsonl_file(self):
+        f = io.StringIO()
+        with sinks.JSONLinesSink(f, metadata=False) as sink:
+            sink.write_all(self.datasets)
+        records = [json.loads(line) for line in f.getvalue().splitlines()]
+        assert sorted(r["id"] for r in records) == CATALOG_DATASETS
+        assert all(r["schema_version"] == sinks.SCHEMA_VERSION and r["metadata"] is None for r in records)
+
+    def test_sqlite(self):
+        with sinks.SQLiteSink(self.path("datasets.db"), batch_size=3) as sink:
+            sink.write_all(self.datasets)
+            # Writing a dataset again replaces it
+            sink.write(self.datasets[0])
+        self.assert_same(sinks.read_sqlite(self.path("datasets.db")))
+
+        db = sqlite3.connect(self.path("datasets.db"))
+        services = db.execute("SELECT COUNT(*) FROM services WHERE dataset_id = 'test/agg'").fetchone()[0]
+        db.close()
+        assert services == len(next(d for d in self.datasets if d.id == "test/agg").services)
+
+    def test_versions(self):
+        Path(self.path("old.jsonl")).write_text(json.dumps(dict(self.datasets[0].to_dict(), schema_version=0)) + "\n")
+        with pytest.raises(ValueError, match="schema version"):
+            list(sinks.read_jsonl(self.path("old.jsonl")))
+
+        with sinks.SQLiteSink(self.path("datasets.db")):
+            pass
+        db = sqlite3.connect(self.path("datasets.db"))
+        with db:
+            db.execute("UPDATE meta SET value = '99' WHERE key = 'schema_version'")
+        db.close()
+        with pytest.raises(ValueError, match="schema version"):
+            sinks.SQLiteSink(self.path("datasets.db"))
+        with pytest.raises(ValueError, match="schema version"):
+            list(sinks.read_sqlite(self.path("datasets.db")))
+
+    @unittest.skipIf(sinks.pa is None, "pyarrow is not installed")
+    def test_columnar(self):
+        with sinks.ParquetSink(self.path("datasets.parquet"), batch_size=2) as sink:
+            sink.write_all(self.datasets)
+        with sinks.ArrowSink(self.path("datasets.arrow")) as sink:
+            sink.write_all(self.datasets)
+
+        parquet = sinks.pq.read_table(self.path("datasets.parquet"))
+        with sinks.pa.memory_map(self.path("datasets.arrow")) as source:
+            arrow = sinks.pa.ipc.open_file(source).read_all()
+        for table in (parquet, arrow):
+            sinks.check_schema(table.schema)
+            assert table.num_rows == sum(len(d.services) for d in self.datasets)
+            assert sorted(set(table.column("dataset_id").to_pylist())) == CATALOG_DATASETS
+
+    @unittest.skipIf(sinks.pa is not None, "pyarrow is installed")
+    def test_no_pyarrow(self):
+        with pytest.raises(ImportError, match="pyarrow"):
+            sinks.ParquetSink(self.path("datasets.parquet"))
+
+    def test_incomplete_sink(self):
+        class NoWrite(sinks.Sink):
+            pass
+
+        # Fails when created, not halfway through a crawl
+        with pytest.raises(TypeError, match="abstract"):
+            NoWrite()
@@ -0,0 +1,92 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from thredds_crawler.aio import AsyncCrawl
+from thredds_crawler.crawl import CatalogParser, Crawl
+from thredds_crawler.snapshot import CrawlSnapshot
+from thredds_crawler.tests.stubs import CATALOG_ROUTES, StubServer, resource
+from thredds_crawler.tests.test_cache import conditional
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = StubServer(CATALOG_ROUTES).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.path)
+
+    def crawl(self, snapshot, **kwargs: object):
+        self.server.requests = []
+        return Crawl(self.server.url + "/thredds/catalog.xml", workers=2, snapshot=snapshot, **kwargs)
+
+    def test_first_crawl(self):
+        c = self.crawl(CrawlSnapshot())
+        assert len(c.snapshot.catalogs) == len({path.split("?")[0] for path in CATALOG_ROUTES})
+        assert sorted(c.snapshot.datasets) == sorted(d.id for d in c.datasets)
+        assert sorted(d.id for d in c.diff.added) == sorted(d.id for d in c.datasets)
+        assert c.diff.removed == c.diff.modified == []
+
+        path = Path(self.path) / "snapshot.json"
+        c.snapshot.save(path)
+        loaded = CrawlSnapshot.load(path)
+        assert loaded.catalogs == c.snapshot.catalogs
+        assert loaded.datasets == c.snapshot.datasets
+
+    def test_not_modified(self):
+        self.server.routes = {path: conditional(body, f'"{i}"') for i, (path, body) in enumerate(CATALOG_ROUTES.items())}
+        first = self.crawl(CrawlSnapshot())
+        with mock.patch.object(CatalogParser, "parse") as parse_catalog:
+            second = self.crawl(first.snapshot)
+        parse_catalog.assert_not_called()
+        # Only the two catalogs are requested and both are answered with a 304
+        assert [headers.get("If-None-Match") for _, headers in self.server.requests] == ['"0"', '"1"']
+        assert sorted(d.id for d in second.datasets) == sorted(d.id for d in first.datasets)
+        assert second.diff == ([], [], [])
+
+    def test_unchanged_content(self):
+        first = self.crawl(CrawlSnapshot())
+        second = self.crawl(first.snapshot)
+        # Parsed while downloading, the hash tells the catalogs did not change once they were read
+        assert second.snapshot.catalogs == first.snapshot.catalogs
+        assert sorted(d.id for d in second.datasets) == sorted(d.id for d in first.datasets)
+        assert second.diff == ([], [], [])
+
+    def test_changes(self):
+        first = self.crawl(CrawlSnapshot())
+        self.server.routes["/thredds/child/catalog.xml"] = (
+            resource("child.xml")
+            .replace(b'ID="child/two.nc" urlPath="child/two.nc"', b'ID="child/three.nc" urlPath="child/three.nc"')
+            .replace(b"<serviceName>remote</serviceName>", b"<serviceName>dap</serviceName>")
+        )
+        second = self.crawl(first.snapshot)
+        assert [d.id for d in second.diff.added] == ["child/three.nc"]
+        assert [d.id for d in second.diff.removed] == ["child/two.nc"]
+        assert [d.id for d in second.diff.modified] == ["child/one.nc"]
+
+    def test_settled(self):
+        first = self.crawl(CrawlSnapshot())
+        second = self.crawl(first.snapshot, settle_after=timedelta(days=1))
+        # The child catalog only holds datasets from 2016 and is not requested again
+        assert [path for path, _ in self.server.requests] == ["/thredds/catalog.xml"]
+        assert sorted(d.id for d in second.datasets) == sorted(d.id for d in first.datasets)
+        assert second.diff == ([], [], [])
+
+    def test_different_options(self):
+        first = self.crawl(CrawlSnapshot())
+        second = self.crawl(first.snapshot, select=["child/.*"], settle_after=timedelta(days=1))
+        assert self.server.count("/thredds/child/catalog.xml") == 1
+        assert sorted(d.id for d in second.diff.removed) == ["test/agg", "test/dap"]
+
+    def test_async(self):
+        first = self.crawl(CrawlSnapshot())
+        self.server.requests = []
+        second = asyncio.run(AsyncCrawl(self.server.url + "/thredds/catalog.xml", snapshot=first.snapshot).run())
+        assert sorted(d.id for d in second.datasets) == sorted(d.id for d in first.datasets)
+        assert second.diff == ([], [], [])
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import unittest
+
+from thredds_crawler.aio import AsyncCrawl
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.stats import CrawlStats, Histogram
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer
+
+BYTES = sum(len(body) for body in CATALOG_ROUTES.values())
+# The root and child catalogs, the third route being a dataset request
+CATALOGS = 2
+
+
+class CrawlStatsTest(unittest.TestCase):
+    def check(self, stats, server):
+        assert stats.catalogs == CATALOGS
+        assert stats.datasets == len(CATALOG_DATASETS)
+        assert stats.requests == {server.url.split("//")[1]: len(CATALOG_ROUTES)}
+        assert stats.bytes == BYTES
+        assert stats.latency["catalog"].count == CATALOGS
+        assert stats.latency["dataset"].count == 1
+        assert stats.parse_time > 0
+        # "Individual Files" is left out by the default skips
+        assert stats.filtered == {"skip": 1}
+        assert stats.depths == {0: 1, 1: 1}
+        assert stats.max_depth == 1
+        assert stats.fanout.count == CATALOGS
+        assert stats.fanout.total == 1
+        assert not stats.errors
+        assert stats.elapsed > 0
+        json.dumps(stats.to_dict())
+
+    def test_crawl(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2)
+        self.check(c.stats, server)
+
+    def test_async(self):
+        with StubServer(CATALOG_ROUTES) as server:
+            c = asyncio.run(AsyncCrawl(server.url + "/thredds/catalog.xml").run())
+        self.check(c.stats, server)
+
+    def test_hooks(self):
+        requests, catalogs, datasets = [], [], []
+        stats = CrawlStats(
+            on_request=lambda _url, kind, status, _elapsed, _size: requests.append((kind, status)),
+            on_catalog=lambda _url, depth, references, leaves: catalogs.append((depth, len(references), len(leaves))),
+            on_dataset=lambda dataset: datasets.append(dataset.id),
+        )
+        with StubServer(CATALOG_ROUTES) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, stats=stats)
+        assert c.stats is stats
+        assert sorted(requests) == [("catalog", 200), ("catalog", 200), ("dataset", 200)]
+        assert sorted(catalogs) == [(0, 1, 2), (1, 0, 2)]
+        assert sorted(datasets) == sorted(d.id for d in c.datasets)
+
+    def test_errors(self):
+        routes = dict(CATALOG_ROUTES)
+        del routes["/thredds/child/catalog.xml"]
+        with StubServer(routes) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2)
+        assert c.stats.errors == {"HTTP 404": 1}
+        assert c.stats.statuses == {200: 1, 404: 1}
+
+
+class HistogramTest(unittest.TestCase):
+    def test_histogram(self):
+        bounds = (1, 10, 100)
+        h = Histogram(bounds)
+        for value in (0.5, 1, 5, 50, 500):
+            h.observe(value)
+        assert h.counts == [2, 1, 1, 1]
+        assert (h.count, h.min, h.max, h.mean) == (5, 0.5, 500, 111.3)
+        assert h.quantile(0.5) == bounds[1]
+        assert h.quantile(1) == h.max
+        assert Histogram().quantile(0.5) is None
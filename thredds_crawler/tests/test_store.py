@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import pytest
+
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.store import CrawlStore
+from thredds_crawler.tests.stubs import CATALOG_DATASETS as DATASETS
+from thredds_crawler.tests.stubs import CATALOG_ROUTES, StubServer
+
+
+class CrawlStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = StubServer(CATALOG_ROUTES).__enter__()
+        self.url = self.server.url + "/thredds/catalog.xml"
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.path)
+
+    def store(self, **kwargs: object):
+        return CrawlStore(Path(self.path) / "crawl.db", **kwargs)
+
+    def stop_after_first(self, store):
+        """Starts a crawl and stops it once the first dataset is found"""
+        datasets = Crawl(self.url, workers=2, store=store, lazy=True).iter_datasets()
+        next(datasets)
+        datasets.close()
+
+    def test_complete(self):
+        with self.store() as store:
+            c = Crawl(self.url, workers=2, store=store)
+            assert sorted(d.id for d in c.datasets) == DATASETS
+            assert store.pending() == []
+            assert store.visited() == {self.url, self.server.url + "/thredds/child/catalog.xml"}
+            assert sorted(d["id"] for d in store.datasets()) == DATASETS
+
+            # A finished crawl is not resumed, the next one starts over
+            self.server.requests = []
+            c = Crawl(self.url, workers=2, store=store)
+            assert sorted(d.id for d in c.datasets) == DATASETS
+            assert self.server.count("/thredds/catalog.xml") == 1
+
+    def test_resume(self):
+        with self.store(batch_size=1) as store:
+            self.stop_after_first(store)
+            # The first dataset was in the batch of the root catalog handled before the crawl stopped
+            assert store.progress() == {self.url: 3}
+        self.server.requests = []
+        with self.store() as store:
+            c = Crawl(self.url, workers=2, store=store)
+        assert sorted(d.id for d in c.datasets) == DATASETS
+        # The root catalog is requested again, without handling its batch twice
+        assert self.server.count("/thredds/catalog.xml") == 1
+        assert self.server.count("/thredds/child/catalog.xml") == 1
+
+    def test_uncommitted(self):
+        store = self.store(batch_size=1000, interval=3600)
+        self.stop_after_first(store)
+        # Crash: the batch in progress is lost
+        store._db.rollback()  # noqa: SLF001
+        store._db.close()  # noqa: SLF001
+        with self.store() as store:
+            c = Crawl(self.url, workers=2, store=store)
+        assert sorted(d.id for d in c.datasets) == DATASETS
+
+    def test_other_crawl(self):
+        with self.store(batch_size=1) as store:
+            self.stop_after_first(store)
+            with pytest.raises(ValueError, match="other options"):
+                Crawl(self.url, workers=2, store=store, select=[".*agg.*"])
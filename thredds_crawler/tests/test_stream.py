@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from thredds_crawler.aio import AsyncCrawl
+from thredds_crawler.crawl import Crawl, crawl_iter
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer, resource
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        # The child catalog is only served once a dataset has been received
+        self.released = threading.Event()
+
+        def child(_headers):
+            self.released.wait(10)
+            return 200, {}, resource("child.xml")
+
+        self.routes = dict(CATALOG_ROUTES)
+        self.routes["/thredds/child/catalog.xml"] = child
+
+    def test_crawl_iter(self):
+        with StubServer(self.routes) as server:
+            released = 5
+            start = time.time()
+            datasets = crawl_iter(server.url + "/thredds/catalog.xml", workers=2)
+            first = next(datasets)
+            assert time.time() - start < released
+            self.released.set()
+            ids = [first.id, *(d.id for d in datasets)]
+        assert sorted(ids) == CATALOG_DATASETS
+
+    def test_stop_early(self):
+        with StubServer(self.routes) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, lazy=True)
+            datasets = c.iter_datasets()
+            assert next(datasets).id is not None
+            datasets.close()
+            self.released.set()
+        assert c.datasets is None
+
+    def test_async_iter_datasets(self):
+        async def first(url):
+            async for ds in AsyncCrawl(url).iter_datasets():
+                self.released.set()
+                return ds
+            return None
+
+        with StubServer(self.routes) as server:
+            ds = asyncio.run(first(server.url + "/thredds/catalog.xml"))
+        assert ds.id is not None
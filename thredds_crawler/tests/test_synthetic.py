@@ -0,0 +1,52 @@
+import unittest
+from http import HTTPStatus
+
+import pytest
+import requests
+
+from thredds_crawler import dap
+from thredds_crawler.crawl import Crawl
+from thredds_crawler.testing import SyntheticTDS
+from thredds_crawler.throttle import RequestScheduler
+
+
+class SyntheticTDSTest(unittest.TestCase):
+    def test_tree(self):
+        catalogs, datasets = 1 + 3 + 9, 4
+        with SyntheticTDS(depth=2, fanout=3, datasets=datasets) as tds:
+            c = Crawl(tds.catalog_url, workers=2)
+        assert tds.total_catalogs == catalogs
+        assert len(c.datasets) == tds.total_datasets == catalogs * datasets
+        assert len({d.id for d in c.datasets}) == catalogs * datasets
+        assert tds.requests == {"catalog": catalogs}
+        d = c.datasets[0]
+        assert sorted(s.service for s in d.services) == ["HTTPServer", "ISO", "OPENDAP"]
+        assert d.modified is not None
+        assert d.data_size is not None
+
+    def test_dataset_documents(self):
+        with SyntheticTDS(depth=1, fanout=2, datasets=2, sizes=False) as tds:
+            c = Crawl(tds.catalog_url, workers=2, inline=False)
+        assert sorted(d.id for d in c.datasets) == sorted(
+            f"synthetic/{node}file_{i}.nc" for node in ("", "c0/", "c1/") for i in range(2)
+        )
+        assert tds.requests == {"catalog": 3, "dataset": 6}
+
+    def test_errors(self):
+        scheduler = RequestScheduler(retries=10, backoff=0.001, failure_threshold=1000)
+        with SyntheticTDS(depth=2, fanout=3, datasets=2, error_rate=0.2, seed=1) as tds:
+            c = Crawl(tds.catalog_url, workers=2, scheduler=scheduler)
+        assert tds.errors > 0
+        assert len(c.datasets) == tds.total_datasets
+        assert c.stats.retries == tds.errors
+
+    def test_services(self):
+        with SyntheticTDS(depth=0, datasets=1, services=["dap", "ncml"]) as tds:
+            dds = requests.get(tds.url + "/thredds/dodsC/synthetic/file_0.nc.dds", timeout=10)
+            ncml = requests.get(tds.url + "/thredds/ncml/synthetic/file_0.nc", timeout=10)
+            missing = requests.get(tds.url + "/thredds/c9/catalog.xml", timeout=10)
+        assert dap.parse_dds(dds.text) == 24 * 8 + 24 * 10 * 10 * 4
+        assert ncml.status_code == HTTPStatus.OK
+        assert missing.status_code == HTTPStatus.NOT_FOUND
+        with pytest.raises(ValueError, match="Unknown services"):
+            SyntheticTDS(services=["ftp"])
@@ -0,0 +1,158 @@
+import asyncio
+import time
+import unittest
+
+from thredds_crawler.aio import AsyncCrawl
+from thredds_crawler.crawl import Crawl, XMLResponse
+from thredds_crawler.tests.stubs import CATALOG_DATASETS, CATALOG_ROUTES, StubServer
+from thredds_crawler.throttle import RequestScheduler, TokenBucket, retry_after
+
+URL = "http://example.com/catalog.xml"
+OK = XMLResponse(200, b"", None, None)
+UNAVAILABLE = XMLResponse(503, b"", None, None)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def flaky(body, failures):
+    """Returns a stub route answering 503 the first given number of times"""
+    calls = []
+
+    def route(_headers):
+        calls.append(1)
+        if len(calls) <= failures:
+            return 503, {"Retry-After": "0"}, b"Unavailable"
+        return 200, {}, body
+
+    return route
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_token_bucket(self):
+        rate = 2
+        bucket = TokenBucket(rate, burst=2, clock=self.clock)
+        bucket.take()
+        bucket.take()
+        assert bucket.delay() == 1 / rate
+        self.clock.now = 1 / rate
+        assert bucket.delay() == 0
+
+    def test_aimd(self):
+        concurrency = 4
+        scheduler = RequestScheduler(concurrency=concurrency, clock=self.clock)
+        scheduler.start(URL)
+        scheduler.finish(URL, UNAVAILABLE)
+        # Halved on failure, then raised by 1 / limit on success
+        halved = concurrency / 2
+        assert scheduler.host(URL).limit == halved
+        scheduler.start(URL)
+        scheduler.finish(URL, OK)
+        assert scheduler.host(URL).limit == halved + 1 / halved
+
+    def test_concurrency_limit(self):
+        scheduler = RequestScheduler(concurrency=1, clock=self.clock)
+        assert scheduler.delay(URL) == 0
+        scheduler.start(URL)
+        assert scheduler.delay(URL) == RequestScheduler.POLL
+        assert scheduler.delay("http://other.com/catalog.xml") == 0
+
+    def test_retries(self):
+        retries, backoff = 2, 1
+        scheduler = RequestScheduler(retries=retries, backoff=backoff, clock=self.clock)
+        # Exponential backoff with up to 50% jitter
+        assert backoff / 2 <= scheduler.finish(URL, UNAVAILABLE, attempt=1) <= backoff * 1.5
+        assert backoff <= scheduler.finish(URL, None, OSError("reset"), attempt=2) <= backoff * 3
+        assert scheduler.finish(URL, UNAVAILABLE, attempt=retries + 1) is None
+        assert scheduler.finish(URL, XMLResponse(404, b"", None, None)) is None
+
+    def test_retry_after(self):
+        wait = 10
+        scheduler = RequestScheduler(clock=self.clock)
+        assert scheduler.finish(URL, XMLResponse(429, b"", None, None, str(wait))) >= wait
+        assert scheduler.delay(URL) == wait
+        assert retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+        assert retry_after("soon") is None
+
+    def test_circuit_breaker(self):
+        scheduler = RequestScheduler(failure_threshold=2, reset_after=30, clock=self.clock)
+        scheduler.finish(URL, UNAVAILABLE)
+        scheduler.finish(URL, UNAVAILABLE)
+        assert scheduler.delay(URL) is None
+
+        # Half-open after reset_after: a single trial request, the others wait for its outcome
+        self.clock.now = 31
+        assert scheduler.delay(URL) == 0
+        scheduler.start(URL)
+        assert scheduler.delay(URL) == RequestScheduler.POLL
+        scheduler.finish(URL, OK)
+        assert scheduler.delay(URL) == 0
+
+        # A failed trial opens the circuit again
+        scheduler.finish(URL, UNAVAILABLE)
+        scheduler.finish(URL, UNAVAILABLE)
+        self.clock.now = 62
+        scheduler.start(URL)
+        assert scheduler.delay(URL) == RequestScheduler.POLL
+        scheduler.finish(URL, UNAVAILABLE)
+        assert scheduler.delay(URL) is None
+
+    def test_default_concurrency(self):
+        # As many requests to a single host as the crawl has workers
+        workers, per_host, concurrency = 16, 12, 64
+        c = Crawl("http://localhost/thredds/catalog.xml", workers=workers, lazy=True)
+        assert c.scheduler.concurrency == workers
+        assert AsyncCrawl("http://localhost/thredds/catalog.xml", per_host=per_host).scheduler.concurrency == per_host
+        assert RequestScheduler(concurrency=concurrency).max_concurrency == concurrency
+
+
+class ThrottledCrawlTest(unittest.TestCase):
+    def scheduler(self):
+        return RequestScheduler(retries=2, backoff=0.01, timeout=1)
+
+    failures = 2
+    # child/one.nc is left out, its dataset request answering 404
+    datasets = CATALOG_DATASETS[1:]
+
+    def routes(self):
+        routes = dict(CATALOG_ROUTES)
+        routes["/thredds/catalog.xml"] = flaky(routes["/thredds/catalog.xml"], self.failures)
+        routes.pop("/thredds/child/catalog.xml?dataset=child/one.nc")
+        return routes
+
+    def test_retries_and_failures(self):
+        with StubServer(self.routes()) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, scheduler=self.scheduler())
+        assert server.count("/thredds/catalog.xml") == self.failures + 1
+        assert sorted(d.id for d in c.datasets) == self.datasets
+        assert [(f.kind, f.reason) for f in c.failures] == [("dataset", "HTTP 404 after 1 attempts")]
+
+    def test_async_retries_and_failures(self):
+        with StubServer(self.routes()) as server:
+            c = asyncio.run(AsyncCrawl(server.url + "/thredds/catalog.xml", scheduler=self.scheduler()).run())
+        assert sorted(d.id for d in c.datasets) == self.datasets
+        assert [f.kind for f in c.failures] == ["dataset"]
+
+    def test_timeout(self):
+        def slow(_headers):
+            time.sleep(2)
+            return 200, {}, CATALOG_ROUTES["/thredds/child/catalog.xml"]
+
+        routes = dict(CATALOG_ROUTES)
+        routes["/thredds/child/catalog.xml"] = slow
+        scheduler = RequestScheduler(retries=0, timeout=0.2)
+        with StubServer(routes) as server:
+            c = Crawl(server.url + "/thredds/catalog.xml", workers=2, scheduler=scheduler)
+        # Only the datasets of the root catalog are found
+        assert sorted(d.id for d in c.datasets) == ["test/agg", "test/dap"]
+        assert len(c.failures) == 1
+        assert c.failures[0].url.endswith("/thredds/child/catalog.xml")
+        assert c.failures[0].reason.startswith("ReadTimeout")
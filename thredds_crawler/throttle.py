@@ -0,0 +1,219 @@
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+def retry_after(value):
+    """Returns the number of seconds a Retry-After header asks to wait, or None
+    :param str value: The header value, either seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second on average with bursts of up to ``burst`` requests"""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Returns the seconds until a token is available, 0 if one is available now"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Uses up a token"""
+        self._refill()
+        self.tokens -= 1
+
+
+class HostState:
+    """Rate limit, concurrency limit and circuit breaker state of a single host"""
+
+    def __init__(self, scheduler):
+        self.bucket = TokenBucket(scheduler.rate, scheduler.burst, scheduler.clock) if scheduler.rate else None
+        self.limit = float(scheduler.concurrency)
+        self.active = 0
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+
+class RequestScheduler:
+    """Decides when requests to each host may be made.
+
+    Every host gets a token bucket rate limit (``rate`` requests per second,
+    off by default) and an adaptive concurrency limit: it grows by one request
+    for every ``limit`` successful responses and halves when the server answers
+    with a 5xx or 429 or the request fails (AIMD). Retry-After headers are
+    honoured and failed requests are retried up to ``retries`` times with a
+    jittered exponential backoff.
+
+    After ``failure_threshold`` consecutive failures the circuit of a host
+    opens: requests to it fail immediately for ``reset_after`` seconds, after
+    which a single trial request decides whether it closes again. The other
+    requests to the host wait for the outcome of the trial.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # Seconds to wait before checking again on a host at its concurrency limit
+    POLL = 0.05
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        rate=None,
+        burst=None,
+        concurrency=8,
+        min_concurrency=1,
+        max_concurrency=None,
+        retries=2,
+        backoff=0.5,
+        max_backoff=30.0,
+        timeout=60.0,
+        failure_threshold=5,
+        reset_after=60.0,
+        clock=time.monotonic,
+    ):
+        """:param float rate: Requests per second allowed to a single host, unlimited if None
+        :param int burst: Requests allowed in a burst, defaults to the rate
+        :param int concurrency: Initial number of requests in flight allowed to a single host
+        :param int min_concurrency: Lower bound of the adaptive concurrency limit
+        :param int max_concurrency: Upper bound of the adaptive concurrency limit, the larger
+            of 32 and concurrency if None
+        :param int retries: Times a failed request is retried
+        :param float backoff: Seconds to wait before the first retry, doubled for every retry after that
+        :param float max_backoff: Longest wait between two retries
+        :param float timeout: Seconds to wait for a server to respond
+        :param int failure_threshold: Consecutive failures that open the circuit of a host
+        :param float reset_after: Seconds an open circuit stays open before a trial request is allowed
+        """
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency if max_concurrency is not None else max(32, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        """Returns the HostState of the host of a URL
+        :param str url: A URL
+        """
+        netloc = urlparse.urlsplit(url).netloc
+        state = self.hosts.get(netloc)
+        if state is None:
+            state = self.hosts[netloc] = HostState(self)
+        return state
+
+    def delay(self, url):
+        """Returns the seconds to wait before a request to url may start, 0 if it
+        may start now, or None if the circuit of its host is open. While the
+        trial request of a half-open circuit is in flight, the others wait for it.
+        :param str url: URL about to be requested
+        """
+        with self._lock:
+            state = self.host(url)
+            now = self.clock()
+            if state.opened_at is not None and now - state.opened_at < self.reset_after:
+                return None
+            if state.trial:
+                return self.POLL
+            if state.blocked_until > now:
+                return state.blocked_until - now
+            if state.active >= int(state.limit):
+                return self.POLL
+            if state.bucket is not None:
+                return state.bucket.delay()
+            return 0.0
+
+    def start(self, url):
+        """Records that a request to url started, once delay returned 0
+        :param str url: URL being requested
+        """
+        with self._lock:
+            state = self.host(url)
+            state.active += 1
+            if state.bucket is not None:
+                state.bucket.take()
+            if state.opened_at is not None:
+                # Half-open: this request decides whether the circuit closes
+                state.trial = True
+
+    def cancel(self, url):
+        """Records that a request to url was abandoned before its outcome was
+        known, such as when a crawl is cut short, freeing its place
+        :param str url: URL that was requested
+        """
+        with self._lock:
+            state = self.host(url)
+            state.active = max(0, state.active - 1)
+            state.trial = False
+
+    def finish(self, url, response=None, error=None, attempt=1):
+        """Records the outcome of a request and returns the seconds to wait
+        before retrying it, or None if it should not be retried
+        :param str url: URL that was requested
+        :param XMLResponse response: The response, None if the request raised
+        :param Exception error: The error raised by the request, if any
+        :param int attempt: Number of times the request was made, this one included
+        """
+        with self._lock:
+            state = self.host(url)
+            state.active = max(0, state.active - 1)
+            state.trial = False
+            now = self.clock()
+
+            if error is None and response.status not in self.RETRY_STATUSES:
+                # Additive increase
+                state.failures = 0
+                state.opened_at = None
+                state.limit = min(self.max_concurrency, state.limit + 1 / state.limit)
+                return None
+
+            # Multiplicative decrease
+            state.failures += 1
+            state.limit = max(self.min_concurrency, state.limit / 2)
+            wait = retry_after(response.retry_after) if response is not None else None
+            if wait is not None:
+                state.blocked_until = max(state.blocked_until, now + wait)
+            if state.failures >= self.failure_threshold:
+                state.opened_at = now
+                return None
+            if attempt > self.retries:
+                return None
+            backoff = min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)  # noqa: S311
+            return max(backoff, wait or 0.0)
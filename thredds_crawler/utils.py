@@ -1,10 +1,49 @@
 import os
+import re
+import threading
+from datetime import datetime, timedelta
 
 try:
     import urlparse
 except ImportError:
     from urllib import parse as urlparse
 
+import pytz
+import requests
+from dateutil.parser import parse
+
+INV_NS = "http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+
+# Bytes read from a response at a time when parsing it as it downloads
+CHUNK_SIZE = 64 * 1024
+ACCEPT_ENCODING = "gzip, deflate"
+
+
+_sessions = threading.local()
+
+
+def session():
+    """Returns the requests.Session of the current thread. Every worker process
+    and thread keeps its own session, so the connections to each host are kept
+    alive and reused from one request to the next.
+    """
+    s = getattr(_sessions, "session", None)
+    # A forked worker must not share the connections of its parent
+    if s is None or _sessions.pid != os.getpid():
+        s = _sessions.session = requests.Session()
+        _sessions.pid = os.getpid()
+    return s
+
+
+def request_headers(headers=None):
+    """Returns the headers to send with a request, asking for a compressed response
+    :param dict headers: Additional request headers, such as cache validators
+    """
+    headers = dict(headers or {})
+    headers.setdefault("Accept-Encoding", ACCEPT_ENCODING)
+    return headers
+
 
 def construct_url(url, href):
     u = urlparse.urlsplit(url)
@@ -25,3 +64,44 @@ def construct_url(url, href):
         cat = relative_path + "/" + href
 
     return cat
+
+
+def parse_datetime(text):
+    """Returns a date string as a UTC datetime. ISO 8601 dates, which is what
+    the TDS writes, are parsed directly and anything else goes through dateutil.
+    Raises ValueError if the string is not a date.
+    :param str text: The date string
+    """
+    if not text or not text.strip():
+        msg = "Empty date string"
+        raise ValueError(msg)
+    text = text.strip()
+    try:
+        dt = datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text)
+    except ValueError:
+        dt = parse(text)
+    if dt.tzinfo:
+        return dt.astimezone(pytz.utc)
+    return dt.replace(tzinfo=pytz.utc)
+
+
+ISO_DURATION = re.compile(
+    r"^P(?:(?P<years>\d+(?:\.\d+)?)Y)?(?:(?P<months>\d+(?:\.\d+)?)M)?(?:(?P<weeks>\d+(?:\.\d+)?)W)?"
+    r"(?:(?P<days>\d+(?:\.\d+)?)D)?(?:T(?:(?P<hours>\d+(?:\.\d+)?)H)?(?:(?P<minutes>\d+(?:\.\d+)?)M)?"
+    r"(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$",
+)
+
+
+def parse_duration(text):
+    """Returns an ISO 8601 duration (``P1Y2M10DT2H``) as a timedelta, counting
+    years as 365 days and months as 30 days. Raises ValueError if the string is
+    not a duration.
+    :param str text: The duration string
+    """
+    m = ISO_DURATION.match((text or "").strip())
+    if m is None or not any(m.groupdict().values()):
+        msg = f"Invalid duration {text}"
+        raise ValueError(msg)
+    parts = {k: float(v) for k, v in m.groupdict().items() if v}
+    parts["days"] = parts.get("days", 0) + parts.pop("years", 0) * 365 + parts.pop("months", 0) * 30
+    return timedelta(**parts)